@@ -0,0 +1,72 @@
+# +----------------------------------------------------------------------------
+# | Copyright (c) 2022 Pivotal Commware
+# | All rights reserved.
+# +----------------------------------------------------------------------------
+
+# Compares the batched, column-wise expansion of the sites GeoJSON against the original one sector at a time.
+# Run from the repository root:  python -m src.api.benchmarks.bench_extract_sites
+
+import time
+from collections import deque
+from itertools import zip_longest
+
+# Imported by their full package path, so this runs with "python -m" from the repository root
+from src.api.shared_code.sites import extract_sites
+
+
+SECTOR_COUNTS       = [10_000, 100_000, 1_000_000]
+SECTORS_PER_FEATURE = 3
+
+
+def make_geojson(sectors: int) -> dict:
+    """
+    Builds a representative sites file, with a few empty fields that disable their sectors.
+    """
+    features = []
+    for f in range(sectors // SECTORS_PER_FEATURE):
+        azimuth = [str(s * 120) for s in range(SECTORS_PER_FEATURE)]
+        downtilt = [4.5] * SECTORS_PER_FEATURE
+        if (f % 50 == 0):
+            azimuth[1] = " "
+        if (f % 70 == 0):
+            downtilt[2] = ""
+        features.append({
+            "type": "Feature",
+            "id": f"site-{f}",
+            "geometry": {"type": "Point", "coordinates": [-122.3 + f * 1e-5, 47.6 + f * 1e-5]},
+            "properties": {
+                "height_m": "30",
+                "azimuth": azimuth,
+                "ant_bw": [65] * SECTORS_PER_FEATURE,
+                "ant_pattern": ["pattern-a", "", "pattern-b"][:SECTORS_PER_FEATURE],
+                "downtilt_deg": downtilt,
+                "peak_tx_dbm": ["43.0"] * SECTORS_PER_FEATURE
+            }
+        })
+    return {"type": "FeatureCollection", "features": features}
+
+
+def time_expansion(geojson: dict, batched: bool) -> float:
+    """
+    Times expanding the whole sites file into rows, as the upload consumes them.
+    """
+    start = time.perf_counter()
+    deque(extract_sites(geojson, batched=batched), maxlen=0)
+    return time.perf_counter() - start
+
+
+def check_parity(geojson: dict) -> None:
+    """
+    Makes sure both expansions give exactly the same rows, in the same order.
+    """
+    for row, batched_row in zip_longest(extract_sites(geojson), extract_sites(geojson, batched=True)):
+        assert row == batched_row and list(row) == list(batched_row), (row, batched_row)
+
+
+if __name__ == "__main__":
+    for sectors in SECTOR_COUNTS:
+        geojson = make_geojson(sectors)
+        check_parity(geojson)
+        rows_seconds = time_expansion(geojson, batched=False)
+        batched_seconds = time_expansion(geojson, batched=True)
+        print(f"{sectors:>9,} sectors   per sector {rows_seconds:>7.3f}s   batched {batched_seconds:>7.3f}s   speedup {rows_seconds / batched_seconds:>4.1f}x")
@@ -0,0 +1,50 @@
+# +----------------------------------------------------------------------------
+# | Copyright (c) 2022 Pivotal Commware
+# | All rights reserved.
+# +----------------------------------------------------------------------------
+
+# Compares the Session codec against the original jsonpickle path.
+# Run from the repository root:  python -m src.api.benchmarks.bench_session_codec
+
+import timeit
+
+# Imported by their full package path, so this runs with "python -m" from the repository root
+from src.api.shared_code.session import Session, SessionState
+from src.api.shared_code.session_codec import encode_session, decode_session, orjson
+from src.api.shared_code.utilities import serialize, deserialize
+
+
+ITERATIONS = 2000
+
+
+def make_session() -> Session:
+    """
+    Builds a representative, fully populated session.
+    """
+    session = Session("benchmark-session", "someone@example.com")
+    session.iteration_names.extend([f"Iteration {i}" for i in range(10)])
+    session.add_state(SessionState.CONFIGURATION_COMPLETED)
+    session.add_state(SessionState.NEARMAP_COMPLETED)
+    session.configuration = serialize({f"parameter_{i}": i * 1.5 for i in range(50)})
+    for info in (session.nearmap, session.validation, session.wavescape):
+        info.task_id = "0123456789abcdef0123456789abcdef"
+        info.orchestrator_id = "fedcba9876543210fedcba9876543210"
+        info.execution_info = serialize({"exit_code": 0, "result": "success", "end_time": "2022-02-02T02:02:02"})
+    return session
+
+
+def report(name: str, encode, decode) -> None:
+    """
+    Times encode and decode of the representative session and prints throughput and payload size.
+    """
+    session = make_session()
+    payload = encode(session)
+    encode_seconds = timeit.timeit(lambda: encode(session), number=ITERATIONS)
+    decode_seconds = timeit.timeit(lambda: decode(payload), number=ITERATIONS)
+    print(f"{name:<12} encode {ITERATIONS / encode_seconds:>10,.0f}/s   decode {ITERATIONS / decode_seconds:>10,.0f}/s   payload {len(payload):>6,} bytes")
+
+
+if __name__ == "__main__":
+    print(f"orjson backend: {'yes' if orjson is not None else 'no (stdlib json)'}")
+    report("jsonpickle", serialize, deserialize)
+    report("codec", encode_session, decode_session)
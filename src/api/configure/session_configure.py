@@ -8,7 +8,8 @@ import logging
 
 from ..shared_code.utilities import serialize
 from ..shared_code.session import SessionState
-from ..shared_code.session_de import save_session
+from ..shared_code.session_de import update_session
+from ..shared_code import session_delta
 from ..shared_code.api_strings import invalid_body_json
 from ..shared_code.find_session import find_session
 
@@ -26,13 +27,16 @@ async def main(req: func.HttpRequest, starter: str) -> func.HttpResponse:
         except Exception:
             return func.HttpResponse(invalid_body_json, status_code=400)  # 400 = Bad Request
 
-        session.configuration = serialize(body)  # serialize, because we need to be able to reconstruct the object later
+        configuration = serialize(body)  # serialize, because we need to be able to reconstruct the object later
 
-        # Update the Session state and save it
-        session.add_state(SessionState.CONFIGURATION_COMPLETED)
-        session.remove_state(SessionState.VALIDATION_COMPLETED)
-        session.remove_state(SessionState.WAVESCAPE_COMPLETED)
-        await save_session(session, starter)
+        # Update the Session configuration and state inside its durable entity
+        await update_session(session.name,
+                             [session_delta.set_configuration(configuration),
+                              session_delta.add_state(SessionState.CONFIGURATION_COMPLETED),
+                              session_delta.remove_state(SessionState.VALIDATION_COMPLETED),
+                              session_delta.remove_state(SessionState.WAVESCAPE_COMPLETED)],
+                             starter,
+                             session)
 
         logging.info(f"Configuration saved for session \"{session.name}\"")
 
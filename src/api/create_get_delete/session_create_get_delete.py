@@ -9,9 +9,12 @@ import azure.functions as func
 
 from ..shared_code.utilities import is_none_or_whitespace, to_json
 from ..shared_code.session import Session
+from ..shared_code.session_codec import session_to_dict
 from ..shared_code.session_de import save_session
+from ..shared_code.session_storage_async import AsyncSessionStorage
 from ..shared_code.api_strings import missing_session_json, invalid_body_json, missing_body_param_json, storage_exists_json
 from ..shared_code.find_session import find_session
+from ..shared_code.http_compression import compress_response
 
 
 async def create(req: func.HttpRequest, starter: str) -> object:
@@ -38,7 +41,7 @@ async def create(req: func.HttpRequest, starter: str) -> object:
     # Create the session object and Azure blob container
     session = Session(session_name, user_id)
 
-    if (not session.storage.create_blob_container()):
+    if (not await AsyncSessionStorage(session.name).create_blob_container()):
         return func.HttpResponse(storage_exists_json("container", session.storage.blob_container), status_code=400)  # 400 = Bad Request
 
     # Tell the durable entity to save this session
@@ -62,7 +65,7 @@ async def get(req: func.HttpRequest, starter: str) -> object:
         return func.HttpResponse(status_code=410)  # 410 = Gone
 
     # Send it off in pretty JSON format without all the meta fields
-    return func.HttpResponse(to_json(session))
+    return func.HttpResponse(to_json(session_to_dict(session)))
 
 
 async def delete(req: func.HttpRequest, starter: str) -> object:
@@ -73,7 +76,7 @@ async def delete(req: func.HttpRequest, starter: str) -> object:
     :returns: an HttpResponse object
     """
     # Retrieve the Session object from the durable entity
-    session = await find_session(req, starter)
+    session = await find_session(req, starter, consistent=True)
     if (session is None):
         return func.HttpResponse(status_code=410)  # 410 = Gone
 
@@ -90,7 +93,7 @@ async def main(req: func.HttpRequest, starter: str) -> func.HttpResponse:
         if (req.method == "PUT"):
             return await create(req, starter)
         elif (req.method == "GET"):
-            return await get(req, starter)
+            return compress_response(req, await get(req, starter))
         elif (req.method == "DELETE"):
             return await delete(req, starter)
         else:
@@ -3,10 +3,9 @@
 # | All rights reserved.
 # +----------------------------------------------------------------------------
 
-import logging
-import requests
-
-from ..shared_code.utilities import deserialize, get_environment_variable, serialize
+from ..shared_code.runner_api import check_task_status
+from ..shared_code.utilities import deserialize
+from ..shared_code.worker_stats import log_worker_stats
 
 
 def main(payload: str) -> bool:
@@ -22,32 +21,6 @@ def main(payload: str) -> bool:
     batch_task_id: str = input_dict["batch_task_id"]
 
     # Call the batch API to retrieve the status of the batch task
-    api_url = get_environment_variable("WAVESCAPE_RUNNER_API_URL")  # e.g. "https://{FUNCTION_APP}.azurewebsites.net/api
-    api_key = get_environment_variable("WAVESCAPE_RUNNER_API_KEY")
-    api_call = f"{activity_name.lower()}/status/{batch_task_id}"
-    url = f"{api_url}/{api_call}?code={api_key}"
-
-    response = requests.get(url)
-
-    # Process the response
-    execution_info: str = ""
-    check_again: bool = True
-    if (response.status_code != requests.codes.ok):
-        logging.error(f"Failed to get Azure batch task status. API={url}, status={response.status_code}, reason={response.reason}")
-        check_again = False
-
-        # Special handling:
-        if (response.status_code == 404):
-            # 404 = Not Found; the requested resource could not be found but may be available in the future. Subsequent requests are permissible.
-            check_again = True
-        # The status API should return a 410 (Gone) for when the task no longer exists, meaning we will not check again.
-    else:
-        state = (deserialize(response.content)['state'])["_value_"]
-        if (state == "completed"):
-            execution_info = serialize(deserialize(response.content)['execution_info'])
-            logging.info(f"Azure batch activity={activity_name} task={batch_task_id} completed, result={execution_info}")
-            check_again = False
-        else:
-            logging.info(f"Azure batch activity={activity_name} task={batch_task_id} not yet completed, state={state}")
-
-    return {"check_again": check_again, "execution_info": execution_info}
+    status = check_task_status(activity_name, batch_task_id)
+    log_worker_stats()
+    return status
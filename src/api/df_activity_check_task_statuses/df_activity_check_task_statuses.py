@@ -0,0 +1,20 @@
+# +----------------------------------------------------------------------------
+# | Copyright (c) 2022 Pivotal Commware
+# | All rights reserved.
+# +----------------------------------------------------------------------------
+
+from ..shared_code.runner_api import check_task_statuses
+from ..shared_code.utilities import deserialize
+from ..shared_code.worker_stats import log_worker_stats
+
+
+def main(payload: str) -> dict:
+    """
+    Call the batched 'status' API to determine which of the specified batch tasks are completed.
+    NOTE: Activity functions must always return something.
+    :param str payload: serialized list of tasks, as {"activity": activity name, "task_id": task id} dictionaries
+    :returns dict: for each task id, whether or not to "check_again" later and the serialized "execution_info" once completed
+    """
+    statuses = check_task_statuses(deserialize(payload))
+    log_worker_stats()
+    return statuses
@@ -7,8 +7,9 @@ import logging
 
 from ..shared_code.session_activity import SessionActivity
 from ..shared_code.utilities import deserialize
-from ..shared_code.session_de import get_session, save_session
-from ..shared_code.session import Session, SessionState
+from ..shared_code.session_de import update_session
+from ..shared_code.session import SessionState
+from ..shared_code import session_delta
 
 
 async def main(payload: str, starter: str) -> None:
@@ -26,21 +27,11 @@ async def main(payload: str, starter: str) -> None:
     activity: SessionActivity = input_dict["activity"]
     execution_info = input_dict["execution_info"]
 
-    # Get the Session and update it
-    session: Session = await get_session(session_name, starter)
-    if (session is not None):
-        session.add_state(add_state)        # One of the *_COMPLETED
-        session.remove_state(remove_state)  # One of the *_RUNNING
-
-        if (activity == SessionActivity.NEARMAP):
-            session.nearmap.execution_info = execution_info
-        if (activity == SessionActivity.VALIDATION):
-            session.validation.execution_info = execution_info
-        if (activity == SessionActivity.WAVESCAPE):
-            session.wavescape.execution_info = execution_info
-
-        await save_session(session, starter)
-        return "Success"
-    else:
-        logging.error(f"Session not found, session_name={session_name}")
-        return "Failure"
+    # Update the Session inside its durable entity; no need to read it first
+    await update_session(session_name,
+                         [session_delta.add_state(add_state),         # One of the *_COMPLETED
+                          session_delta.remove_state(remove_state),   # One of the *_RUNNING
+                          session_delta.set_activity_info(activity, execution_info=execution_info)],
+                         starter)
+    logging.info(f"Session \"{session_name}\" updated, {activity.name} completed")
+    return "Success"
@@ -0,0 +1,29 @@
+# +----------------------------------------------------------------------------
+# | Copyright (c) 2022 Pivotal Commware
+# | All rights reserved.
+# +----------------------------------------------------------------------------
+
+import azure.durable_functions as df
+
+from ..shared_code.batch_task_poller import GET_OPERATION, REGISTER_OPERATION, UNREGISTER_OPERATION
+
+
+def entity_function(context: df.DurableEntityContext):
+    """
+    Registry of one poller shard's outstanding batch tasks: a dictionary of task id -> task record.
+    """
+    tasks: dict = context.get_state(lambda: {})
+    operation = context.operation_name
+    if operation == REGISTER_OPERATION:
+        record: dict = context.get_input()
+        tasks[record["task_id"]] = record
+        context.set_state(tasks)
+    elif operation == UNREGISTER_OPERATION:
+        for task_id in context.get_input():
+            tasks.pop(task_id, None)
+        context.set_state(tasks)
+    elif operation == GET_OPERATION:
+        context.set_result(tasks)
+
+
+main = df.Entity.create(entity_function)
@@ -3,8 +3,13 @@
 # | All rights reserved.
 # +----------------------------------------------------------------------------
 
+import logging
+
 import azure.durable_functions as df
 
+from ..shared_code.session_codec import decode_session, encode_session, loads
+from ..shared_code.session_delta import APPLY_OPERATION, DELTA_OPERATIONS, apply_delta
+
 
 def entity_function(context: df.DurableEntityContext):
     operation = context.operation_name
@@ -14,6 +19,19 @@ def entity_function(context: df.DurableEntityContext):
     elif operation == "get":
         current_value = context.get_state(lambda: 0)
         context.set_result(current_value)
+    elif operation == APPLY_OPERATION or operation in DELTA_OPERATIONS:
+        # Apply small changes to the session in place; the input is the JSON of a delta's input, or of a list of deltas for "apply"
+        current_value = context.get_state(lambda: None)
+        if (current_value is None):
+            logging.error(f"Ignoring \"{operation}\" for session \"{context.entity_key}\" which does not exist")
+            return
+        input = loads(context.get_input())
+        deltas = input if operation == APPLY_OPERATION else [{"operation": operation, "input": input}]
+
+        session = decode_session(str(current_value))
+        for delta in deltas:
+            apply_delta(session, delta)
+        context.set_state(encode_session(session))  # the session index is updated by the caller, see update_session()
 
 
 main = df.Entity.create(entity_function)
@@ -0,0 +1,129 @@
+# +----------------------------------------------------------------------------
+# | Copyright (c) 2022 Pivotal Commware
+# | All rights reserved.
+# +----------------------------------------------------------------------------
+
+import logging
+from datetime import datetime, timedelta
+
+import azure.durable_functions as df
+from azure.durable_functions.models.Task import TaskState
+
+from ..shared_code.batch_task_poller import GET_OPERATION, POLLER_IDLE_SECONDS, UNREGISTER_OPERATION, registry_entity_id
+from ..shared_code.polling_schedule import PollingSchedule, next_check_interval_seconds
+from ..shared_code.session import SessionState
+from ..shared_code.session_activity import SessionActivity
+from ..shared_code.utilities import serialize
+
+
+FIXED_SCHEDULE   = PollingSchedule(initial_seconds=60, max_seconds=60, factor=1)     # for tasks registered without a schedule
+FAILURE_SCHEDULE = PollingSchedule(initial_seconds=30, max_seconds=1800, factor=2)  # for tasks whose status check or session update failed
+ACTIVITY_RETRY   = df.RetryOptions(first_retry_interval_in_milliseconds=5000, max_number_of_attempts=3)
+
+
+def task_schedule(task: dict) -> PollingSchedule:
+    "Gets the polling schedule of a registered task"
+    return PollingSchedule.from_dict(task["schedule"]) if "schedule" in task else FIXED_SCHEDULE
+
+
+def back_off(check: dict, now: datetime) -> None:
+    "Reschedules the check of a task whose status check or session update failed, waiting longer after each failure in a row"
+    check["failures"] = check.get("failures", 0) + 1
+    interval = next_check_interval_seconds(FAILURE_SCHEDULE, check["failures"] - 1, 0)
+    check["next_check"] = (now + timedelta(seconds=interval)).isoformat()
+
+
+def batch_task_poller_orchestrator(context: df.DurableOrchestrationContext):
+    """
+    Azure DF Orchestrator responsible for periodically checking on all of the batch tasks registered with its shard,
+    with one batched status call per cycle, and updating the sessions of the tasks that completed.
+    Each task is only checked when due according to its activity's polling schedule; the orchestrator sleeps until
+    the next task is due, but never longer than POLLER_IDLE_SECONDS so newly registered tasks are noticed promptly.
+    This is the "eternal orchestration" pattern; it runs forever, at one timer and at most one status call per cycle
+    however many tasks are outstanding. It keeps running while idle, see ensure_poller_running().
+    Failures are handled one task at a time, so no task can end the loop for the whole shard: the activities are retried,
+    and a task whose status check or session update still fails stays registered and is checked again later, backing off.
+    NOTE: Orchestrator functions cannot be 'async'.
+    :param df.DurableOrchestrationContext context: the context
+    """
+    input: dict = context.get_input()
+    registry = registry_entity_id(input["shard"])
+    checks: dict = input.get("checks", {})  # task id -> {"checks_done", "started", "next_check", "failures"}, times in ISO 8601 UTC
+    now = context.current_utc_datetime
+
+    # Forget the tasks no longer registered, and schedule the first check of the newly registered ones
+    tasks: dict = yield context.call_entity(registry, GET_OPERATION)
+    checks = {task_id: checks[task_id] for task_id in checks if task_id in tasks}
+    for task_id, task in tasks.items():
+        if (task_id not in checks):
+            first_check = now + timedelta(seconds=task_schedule(task).initial_seconds)
+            checks[task_id] = {"checks_done": 0, "started": now.isoformat(), "next_check": first_check.isoformat()}
+
+    # Check the status of every task that is due, at once
+    due = [tasks[task_id] for task_id, check in checks.items() if datetime.fromisoformat(check["next_check"]) <= now]
+    if (due):
+        check_payload = [{"activity": task["activity"], "task_id": task["task_id"]} for task in due]
+        try:
+            statuses: dict = yield context.call_activity_with_retry("df_activity_check_task_statuses", ACTIVITY_RETRY, serialize(check_payload))
+        except Exception as ex:
+            if (not(context.is_replaying)):
+                logging.error(f"Batch task poller {context.instance_id}: failed to check {len(due)} tasks, exception={repr(ex)}")
+            statuses = {}
+            for task in due:
+                back_off(checks[task["task_id"]], now)
+
+        completed = []
+        for task in due:
+            task_id = task["task_id"]
+            status = statuses.get(task_id)
+            if (status is None):
+                continue  # backed off
+            if (not status["check_again"]):
+                completed.append(task)
+                continue
+            check = checks[task_id]
+            check.pop("failures", None)
+            elapsed_seconds = (now - datetime.fromisoformat(check["started"])).total_seconds()
+            check["checks_done"] += 1
+            interval = next_check_interval_seconds(task_schedule(task), check["checks_done"], elapsed_seconds, status)
+            check["next_check"] = (now + timedelta(seconds=interval)).isoformat()
+
+        # Fan out the updates of the sessions whose tasks completed; a task whose update failed is kept, to be checked and updated again later
+        if (completed):
+            if (not(context.is_replaying)):
+                logging.info(f"Batch task poller {context.instance_id}: {len(completed)} of {len(tasks)} tasks completed")
+            updates = []
+            for task in completed:
+                update_payload_dict = {
+                    "session_name": task["session_name"],
+                    "add_state": SessionState[task["completion_state_add"]],
+                    "remove_state": SessionState[task["completion_state_remove"]],
+                    "activity": SessionActivity[task["activity"]],
+                    "execution_info": statuses[task["task_id"]]["execution_info"]
+                }
+                updates.append(context.call_activity_with_retry("df_activity_update_session", ACTIVITY_RETRY, serialize(update_payload_dict)))
+            try:
+                yield context.task_all(updates)
+            except Exception as ex:
+                if (not(context.is_replaying)):
+                    logging.error(f"Batch task poller {context.instance_id}: failed to update the sessions of some completed tasks, exception={repr(ex)}")
+            updated = []
+            for task, update in zip(completed, updates):
+                if (update.state is TaskState.SUCCEEDED):
+                    updated.append(task["task_id"])
+                    del checks[task["task_id"]]
+                else:
+                    back_off(checks[task["task_id"]], now)  # failed, or not finished when another one failed; updating again is harmless
+            if (updated):
+                context.signal_entity(registry, UNREGISTER_OPERATION, updated)
+
+    # Sleep until the next task is due
+    next_check = now + timedelta(seconds=POLLER_IDLE_SECONDS)
+    for check in checks.values():
+        next_check = min(next_check, datetime.fromisoformat(check["next_check"]))
+    yield context.create_timer(next_check)
+
+    context.continue_as_new({"shard": input["shard"], "checks": checks})
+
+
+main = df.Orchestrator.create(batch_task_poller_orchestrator)
@@ -4,38 +4,67 @@
 # +----------------------------------------------------------------------------
 
 import logging
-from datetime import timedelta
+from datetime import datetime, timedelta
 
 import azure.durable_functions as df
 
 from ..shared_code.batch_task_wait_orchestrator_input import BatchTaskWaitOrchestratorInput
-from ..shared_code.utilities import deserialize, serialize
+from ..shared_code.polling_schedule import next_check_interval_seconds
+from ..shared_code.session_codec import decode_orchestrator_input, encode_orchestrator_input
+from ..shared_code.task_callback import TASK_COMPLETED_EVENT
+from ..shared_code.utilities import serialize
 
 
 def batch_task_wait_orchestrator(context: df.DurableOrchestrationContext):
     """
     Azure DF Orchestrator responsible for periodically checking on the status of the specified batch task.
+    The wait between checks follows the input's polling schedule: short at first, growing as the task ages,
+    and shortened or lengthened when the status reports an ETA or progress.
+    When the runner was given a callback URL, completion is normally reported by the TASK_COMPLETED_EVENT external event,
+    and the status checks are only a rare fallback in case the callback is lost.
     This is the "eternal orchestration" pattern; it will run forever until the batch task completes,
     or until it is terminated by the session "stop" API.
     NOTE: Orchestrator functions cannot be 'async'.
     :param df.DurableOrchestrationContext context: the context
     """
-    input: BatchTaskWaitOrchestratorInput = deserialize(context.get_input())
+    input: BatchTaskWaitOrchestratorInput = decode_orchestrator_input(context.get_input())
+    if (input.started is None):
+        input.started = context.current_utc_datetime.isoformat()
 
-    # Wait a bit before checking the status of the task
+    # Wait a bit before checking the status of the task, or until the runner reports that it completed
     time_delta = timedelta(seconds=input.check_interval_seconds)
     next_check = context.current_utc_datetime + time_delta
     if (not(context.is_replaying)):  # this is broken as of Feb-2022; keeping check just in case Microsoft decides to fix it
         logging.info(f"Checking Azure batch activity={input.activity.name} task={input.batch_task_id} after {time_delta} at {next_check} UTC")
-    yield context.create_timer(next_check)
+    timer = context.create_timer(next_check)
+    status = None
+    if (input.callback_fallback_seconds is None):
+        yield timer
+    else:
+        completed_event = context.wait_for_external_event(TASK_COMPLETED_EVENT)
+        winner = yield context.task_any([completed_event, timer])
+        if (winner == completed_event):
+            timer.cancel()
+            if (completed_event.result.get("task_id") == input.batch_task_id):
+                status = completed_event.result
 
-    # Check the status of the task
-    check_payload_dict = {"activity_name": input.activity.name, "batch_task_id": input.batch_task_id}
-    status = yield context.call_activity("df_activity_check_task_status", serialize(check_payload_dict))
+    # Check the status of the task, unless the runner already reported it
+    if (status is None):
+        check_payload_dict = {"activity_name": input.activity.name, "batch_task_id": input.batch_task_id}
+        status = yield context.call_activity("df_activity_check_task_status", serialize(check_payload_dict))
 
-    # If the task is not completed, keep going
+    # If the task is not completed, keep going; orchestrators started before polling schedules existed keep their fixed interval
     if (status["check_again"]):
-        context.continue_as_new(context.get_input())
+        if (input.schedule is None):
+            context.continue_as_new(context.get_input())
+        else:
+            input.checks_done += 1
+            elapsed_seconds = (context.current_utc_datetime - datetime.fromisoformat(input.started)).total_seconds()
+            input.check_interval_seconds = next_check_interval_seconds(input.schedule, input.checks_done, elapsed_seconds, status)
+            if (input.callback_fallback_seconds is not None):
+                input.check_interval_seconds = max(input.check_interval_seconds, input.callback_fallback_seconds)
+            context.continue_as_new(encode_orchestrator_input(input))
+        return
 
     # Task completed, update the Session
     update_payload_dict = {
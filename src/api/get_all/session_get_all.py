@@ -7,29 +7,114 @@ import logging
 
 import azure.functions as func
 
-from ..shared_code.utilities import to_json
-from ..shared_code.session_de import get_all_sessions
+from ..shared_code.utilities import decode_continuation_token, encode_continuation_token, is_none_or_whitespace, to_json
+from ..shared_code.session import SessionState
+from ..shared_code.session_de import iter_session_pages
+from ..shared_code.session_index import get_session_summary, iter_session_summary_pages
+from ..shared_code.session_codec import session_to_dict
+from ..shared_code.api_strings import invalid_query_param_json
+from ..shared_code.http_compression import compress_response
 
 
-async def get_all(starter: str) -> list:
+PAGE_SIZE_PARAM          = "pageSize"
+CONTINUATION_TOKEN_PARAM = "continuationToken"
+CONTINUATION_HEADER      = "x-continuation-token"
+MAX_PAGE_SIZE            = 1000  # the most Azure table storage returns in one response
+
+# Serving from the session index (summaries) rather than from the sessions' Durable Entities (full sessions)
+SOURCE_PARAM        = "source"
+INDEX_SOURCE        = "index"
+NAME_PARAM          = "name"
+CREATED_BY_PARAM    = "createdBy"
+STATE_PARAM         = "state"
+UPDATED_SINCE_PARAM = "updatedSince"
+INDEX_FILTER_PARAMS = [NAME_PARAM, CREATED_BY_PARAM, STATE_PARAM, UPDATED_SINCE_PARAM]
+
+
+async def get_all(pages) -> str:
     """
     Gets all the data for all the sessions that currently exist.
-    :param str starter: the context
-    :returns: list of session objects
+    The JSON is built page by page, so only one page of session objects is in memory at a time.
+    :param pages: an async generator of a (list of session dictionaries, continuation token) 'tuple'
+    :returns str: JSON list of session objects
     """
-    sessions = await get_all_sessions(starter)
-    return sessions
+    pieces = []
+    count = 0
+    async for sessions, _ in pages:
+        pieces.extend(to_json(session, pretty=False) for session in sessions)
+        count += len(sessions)
+    logging.info(f"Returning {count} sessions")
+    return "[" + ",".join(pieces) + "]"
+
+
+async def get_page(pages) -> func.HttpResponse:
+    """
+    Gets the data for one page of the sessions that currently exist.
+    The continuation token for the next page, if any, is returned in the "x-continuation-token" header.
+    :param pages: an async generator of a (list of session dictionaries, continuation token) 'tuple'
+    :returns func.HttpResponse: JSON list of session objects
+    """
+    sessions, next_token = [], None
+    async for sessions, next_token in pages:
+        break
+    headers = {}
+    next_token = encode_continuation_token(next_token)
+    if (next_token is not None):
+        headers[CONTINUATION_HEADER] = next_token
+    return func.HttpResponse(to_json(sessions), headers=headers)
+
+
+async def session_pages(page_size: int, continuation_token: dict):
+    "Pages of full sessions, from the sessions' Durable Entities"
+    async for sessions, next_token in iter_session_pages(page_size, continuation_token):
+        yield [session_to_dict(session) for session in sessions], next_token
 
 
 async def main(req: func.HttpRequest, starter: str) -> func.HttpResponse:
     try:
-        if (req.method == "GET"):
-            response = await get_all(starter)
-        else:
+        if (req.method != "GET"):
             raise ValueError()  # if we get here, our function.json is misconfigured
 
+        try:
+            continuation_token = decode_continuation_token(req.params.get(CONTINUATION_TOKEN_PARAM))
+        except ValueError:
+            return func.HttpResponse(invalid_query_param_json(CONTINUATION_TOKEN_PARAM, "a token from a previous response"), status_code=400)  # 400 = Bad Request
+
+        page_size = req.params.get(PAGE_SIZE_PARAM)
+        if (page_size is not None):
+            try:
+                page_size = int(page_size)
+                if (not (1 <= page_size <= MAX_PAGE_SIZE)):
+                    raise ValueError()
+            except ValueError:
+                return func.HttpResponse(invalid_query_param_json(PAGE_SIZE_PARAM, f"an integer from 1 to {MAX_PAGE_SIZE}"), status_code=400)  # 400 = Bad Request
+
+        use_index = (req.params.get(SOURCE_PARAM) == INDEX_SOURCE) or any(req.params.get(param) is not None for param in INDEX_FILTER_PARAMS)
+        if (use_index):
+            # Point lookup
+            session_name = req.params.get(NAME_PARAM)
+            if (not is_none_or_whitespace(session_name)):
+                summary = await get_session_summary(session_name)
+                return compress_response(req, func.HttpResponse(to_json([summary] if summary is not None else [])))
+
+            state = req.params.get(STATE_PARAM)
+            if (state is not None):
+                if (state not in SessionState.__members__):
+                    return func.HttpResponse(invalid_query_param_json(STATE_PARAM, "a session state name, e.g. \"WAVESCAPE_RUNNING\""), status_code=400)  # 400 = Bad Request
+                state = SessionState[state]
+
+            pages = iter_session_summary_pages(created_by=req.params.get(CREATED_BY_PARAM),
+                                               state=state,
+                                               updated_since=req.params.get(UPDATED_SINCE_PARAM),
+                                               page_size=page_size or MAX_PAGE_SIZE,
+                                               continuation_token=continuation_token)
+        else:
+            pages = session_pages(page_size or MAX_PAGE_SIZE, continuation_token)
+
+        if (page_size is None and continuation_token is None):
+            return compress_response(req, func.HttpResponse(await get_all(pages)))
+        return compress_response(req, await get_page(pages))
+
     except Exception as ex:
         logging.exception(ex)
         return func.HttpResponse(repr(ex), status_code=500)  # 500 = Internal Server Error
-
-    return func.HttpResponse(to_json(response))
@@ -11,18 +11,23 @@ import azure.functions as func
 from ..shared_code.session import Session, SessionState
 from ..shared_code.session_activity import SessionActivity
 from ..shared_code.session_storage import AOI_BLOB_PATH
-from ..shared_code.utilities import is_none_or_whitespace, str_to_bool, to_json
+from ..shared_code.session_storage_async import AsyncSessionStorage
+from ..shared_code.utilities import PhaseTimer, is_none_or_whitespace, str_to_bool, to_json
 from ..shared_code.session_batch import start_nearmap
+from ..shared_code.uploaded_files import UPLOADED_PARAM_NAME, get_expected_upload, verify_uploaded_file
 from ..shared_code.api_strings import invalid_body_json, missing_body_param_json, invalid_b64_json, blob_exists_json, already_running_text, initiated_text
 from ..shared_code.find_session import find_session
+from ..shared_code.task_logs import get_logs
 
 
-async def post(session: Session, req: func.HttpRequest, starter: str) -> func.HttpResponse:
+async def post(session: Session, req: func.HttpRequest, starter: str, timer: PhaseTimer) -> func.HttpResponse:
     """
     Saves the AOI file and starts the Nearmap batch task.
+    Instead of the Base64 AOI, the body may say the AOI has been "uploaded" directly with a write SAS URI; it is then only verified.
     :param Session session: The session.
     :param func.HttpRequest req: The HTTP request.
     :param str starter: The context.
+    :param PhaseTimer timer: Times the phases of the kick-off, reported in the "Server-Timing" response header.
     :returns func.HttpResponse: an HttpResponse object.
     """
     AOI_PARAM_NAME = "aoi"
@@ -33,20 +38,19 @@ async def post(session: Session, req: func.HttpRequest, starter: str) -> func.Ht
     except Exception:
         return func.HttpResponse(invalid_body_json, status_code=400)  # 400 = Bad Request
 
-    aoi_b64 = body.get(AOI_PARAM_NAME)
-    if (is_none_or_whitespace(aoi_b64)):
-        return func.HttpResponse(missing_body_param_json(AOI_PARAM_NAME), status_code=400)  # 400 = Bad Request
+    uploaded = body.get(UPLOADED_PARAM_NAME)
+    if (not uploaded):
+        aoi_b64 = body.get(AOI_PARAM_NAME)
+        if (is_none_or_whitespace(aoi_b64)):
+            return func.HttpResponse(missing_body_param_json(AOI_PARAM_NAME), status_code=400)  # 400 = Bad Request
 
-    try:
-        aoi_bytes = base64.b64decode(aoi_b64, validate=True)
-    except Exception:
-        return func.HttpResponse(invalid_b64_json(AOI_PARAM_NAME), status_code=400)  # 400 = Bad Request
+        try:
+            aoi_bytes = base64.b64decode(aoi_b64, validate=True)
+        except Exception:
+            return func.HttpResponse(invalid_b64_json(AOI_PARAM_NAME), status_code=400)  # 400 = Bad Request
 
-    # Maybe error if the blob already exists
     optional_overwrite = body.get("overwrite")
     overwrite = not is_none_or_whitespace(optional_overwrite) and str_to_bool(optional_overwrite)
-    if (session.storage.blob_exists(AOI_BLOB_PATH) and not overwrite):
-        return func.HttpResponse(blob_exists_json(AOI_BLOB_PATH), status_code=400)  # 400 = Bad Request
 
     # Ensure that only one Nearmap activity is running at a time
     if (SessionState.NEARMAP_RUNNING.name in session.states):
@@ -54,34 +58,48 @@ async def post(session: Session, req: func.HttpRequest, starter: str) -> func.Ht
         logging.info(msg)
         return func.HttpResponse(to_json(msg), status_code=400)  # 400 = Bad Request
 
-    # Save the AOI file to the cloud and tell the durable entity to start Nearmap
-    session.storage.save_file(AOI_BLOB_PATH, aoi_bytes, overwrite)
-    await start_nearmap(session, starter)
+    # Save the AOI file to the cloud, maybe erroring if it already exists, and tell the durable entity to start Nearmap
+    storage = AsyncSessionStorage(session.name)
+    if (uploaded):
+        with timer.phase("verify"):
+            error = await verify_uploaded_file(storage, AOI_BLOB_PATH, get_expected_upload(uploaded))
+        if (error is not None):
+            return func.HttpResponse(error, status_code=400)  # 400 = Bad Request
+    else:
+        with timer.phase("upload"):
+            saved = await storage.save_file(AOI_BLOB_PATH, aoi_bytes, overwrite)
+        if (saved.conflict):
+            return func.HttpResponse(blob_exists_json(AOI_BLOB_PATH), status_code=400)  # 400 = Bad Request
+    with timer.phase("start"):
+        await start_nearmap(session, starter, timer)
 
     logging.info(initiated_text(SessionActivity.NEARMAP, session.name, session.nearmap.task_id))
+    logging.info(f"Nearmap kick-off timings for session \"{session.name}\": {timer.summary()}")
 
-    return func.HttpResponse(status_code=202)  # 202 = Accepted
+    return func.HttpResponse(status_code=202, headers={"Server-Timing": timer.server_timing()})  # 202 = Accepted
 
 
-async def get(session: Session) -> func.HttpResponse:
+async def get(session: Session, req: func.HttpRequest) -> func.HttpResponse:
     """
     Gets the two log files, "stdout.txt" and "stderr.txt", produced and published by the batch Nearmap task.
+    Parts of them may be requested, see get_logs().
     """
-    response = session.storage.read_logs(session.nearmap.task_id)
-    return func.HttpResponse(to_json(response))
+    return await get_logs(session.name, session.nearmap.task_id, req)
 
 
 async def main(req: func.HttpRequest, starter: str) -> func.HttpResponse:
     try:
         # Retrieve the Session object from the durable entity
-        session: Session = await find_session(req, starter)
+        timer = PhaseTimer()
+        with timer.phase("session"):
+            session: Session = await find_session(req, starter, consistent=(req.method != "GET"))
         if (session is None):
             return func.HttpResponse(status_code=410)  # 410 = Gone
 
         if (req.method == "POST"):
-            return await post(session, req, starter)
+            return await post(session, req, starter, timer)
         elif (req.method == "GET"):
-            return await get(session)
+            return await get(session, req)
         else:
             raise ValueError()  # if we get here, our function.json is misconfigured
 
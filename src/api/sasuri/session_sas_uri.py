@@ -3,53 +3,15 @@
 # | All rights reserved.
 # +----------------------------------------------------------------------------
 
-from datetime import datetime, timedelta
 import logging
 
 import azure.functions as func
-from azure.storage.blob import generate_blob_sas, BlobSasPermissions
 
-from ..shared_code.session_storage import get_storage_account_key, get_storage_account_name
+from ..shared_code.session_storage import READ_PERMISSION_PARAM, WRITE_PERMISSION_PARAM, generate_link
 from ..shared_code.utilities import is_none_or_whitespace, to_json
 from ..shared_code.api_strings import missing_session_json, missing_query_param_json
 
 
-WRITE_PERMISSION_PARAM = "write"
-WRITE_WINDOW = timedelta(minutes=15)
-
-READ_PERMISSION_PARAM = "read"
-READ_WINDOW = timedelta(minutes=15)
-
-
-def generate_link(container_name: str, blob_name: str, permission: str):
-    """
-    Generates the SAS URI for accessing the specified resource with the specified permission.
-    Requires the 'STORAGE_ACCOUNT_NAME' and 'STORAGE_ACCOUNT_ACCESS_KEY' environment variables to be set appropriately.
-    :param str container_name: the name of the session
-    :param str blob_name: the path to the blob, e.g. 'path/file_name.txt'
-    :param str permission: the requested access right; must be either "read" or "write"
-    """
-    account_name = get_storage_account_name()
-
-    if (permission == READ_PERMISSION_PARAM):
-        sas_permission = BlobSasPermissions(read=True)
-        sas_duration = READ_WINDOW
-    elif (permission == WRITE_PERMISSION_PARAM):
-        sas_permission = BlobSasPermissions(write=True)
-        sas_duration = WRITE_WINDOW
-    else:
-        raise ValueError(f"Unexpected permission param: {permission}")
-
-    sas = generate_blob_sas(account_name=account_name,
-                            container_name=container_name,
-                            blob_name=blob_name,
-                            account_key=get_storage_account_key(),
-                            permission=sas_permission,
-                            expiry=datetime.utcnow() + sas_duration)
-
-    return f"https://{account_name}.blob.core.windows.net/{container_name}/{blob_name}?{sas}"
-
-
 def main(req: func.HttpRequest) -> func.HttpResponse:
     try:
         session_name = req.route_params.get("sessionName")
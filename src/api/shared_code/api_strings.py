@@ -31,6 +31,11 @@ def missing_query_param_json(param: str) -> str:
     return to_json(f"\"{param}\" query parameter not provided; please refer to API documentation")
 
 
+def invalid_query_param_json(param: str, expected: str) -> str:
+    "\"{param}\" query parameter is invalid, expected {expected}; please refer to API documentation"
+    return to_json(f"\"{param}\" query parameter is invalid, expected {expected}; please refer to API documentation")
+
+
 def invalid_b64_json(param: str) -> str:
     "\"{param}\" is not a valid Base64 encoded string; please refer to API documentation"
     return to_json(f"\"{param}\" is not a valid Base64 encoded string; please refer to API documentation")
@@ -41,6 +46,16 @@ def blob_exists_json(blob: str) -> str:
     return to_json(f"Azure blob \"{blob}\" already exists for this session")
 
 
+def blob_not_uploaded_json(blob: str) -> str:
+    "Azure blob \"{blob}\" has not been uploaded for this session"
+    return to_json(f"Azure blob \"{blob}\" has not been uploaded for this session")
+
+
+def blob_upload_mismatch_json(blob: str, property: str, expected: object, actual: object) -> str:
+    "Azure blob \"{blob}\" {property} is {actual}, expected {expected}; the upload may be incomplete or stale"
+    return to_json(f"Azure blob \"{blob}\" {property} is {actual}, expected {expected}; the upload may be incomplete or stale")
+
+
 def storage_exists_json(type: str, name: str) -> str:
     "Azure {type} \"{name}\" already exists"
     return to_json(f"Azure {type} \"{name}\" already exists")
@@ -0,0 +1,157 @@
+# +----------------------------------------------------------------------------
+# | Copyright (c) 2022 Pivotal Commware
+# | All rights reserved.
+# +----------------------------------------------------------------------------
+
+import logging
+import zlib
+from typing import Optional
+
+import azure.durable_functions as df
+from azure.durable_functions import DurableOrchestrationClient
+from azure.durable_functions.models.OrchestrationRuntimeStatus import OrchestrationRuntimeStatus
+
+from .session import SessionState
+from .session_activity import SessionActivity
+from .polling_schedule import PollingSchedule
+from .utilities import get_environment_variable, str_to_bool
+
+
+# +-------------------------------------------------------------------------------------------
+# | Instead of one eternal wait orchestrator per started batch task, the outstanding tasks can be
+# | tracked by a small, fixed set of "shards". Each shard is a registry Durable Entity holding
+# | the shard's outstanding tasks, and one eternal poller orchestrator that checks all of them
+# | with a single batched "status" call per cycle, then fans out the completion updates.
+# | Enabled with the BATCH_TASK_POLLER_ENABLED environment variable.
+# +-------------------------------------------------------------------------------------------
+POLLER_ORCHESTRATOR_NAME = "df_orchestrator_batch_task_poller"
+REGISTRY_ENTITY_NAME     = "df_entity_batch_tasks"
+POLLER_INSTANCE_PREFIX   = "batch-task-poller-"
+DEFAULT_POLLER_SHARDS    = 4
+POLLER_IDLE_SECONDS      = 60  # the longest a poller sleeps, so newly registered tasks are noticed within this time
+
+REGISTER_OPERATION   = "register"
+UNREGISTER_OPERATION = "unregister"
+GET_OPERATION        = "get"
+
+ACTIVE_RUNTIME_STATUSES = (OrchestrationRuntimeStatus.Running, OrchestrationRuntimeStatus.Pending, OrchestrationRuntimeStatus.ContinuedAsNew)
+
+
+def is_poller_enabled() -> bool:
+    """
+    Determines whether or not batch tasks are waited for by the sharded pollers rather than by one orchestrator each.
+    :returns bool: the value of the BATCH_TASK_POLLER_ENABLED environment variable; default is False
+    """
+    enabled = get_environment_variable("BATCH_TASK_POLLER_ENABLED")
+    return enabled is not None and str_to_bool(enabled)
+
+
+def get_poller_shards() -> int:
+    """
+    Gets the number of poller shards, tunable with the BATCH_TASK_POLLER_SHARDS environment variable.
+    :returns int: the number of shards
+    """
+    shards = get_environment_variable("BATCH_TASK_POLLER_SHARDS")
+    return max(int(shards), 1) if shards is not None else DEFAULT_POLLER_SHARDS
+
+
+def shard_for_task(task_id: str) -> int:
+    """
+    Gets the shard responsible for the specified batch task; stable across workers and restarts.
+    :param str task_id: the id of the batch task
+    :returns int: the shard number
+    """
+    return zlib.crc32(task_id.encode("utf-8")) % get_poller_shards()
+
+
+def poller_instance_id(shard: int) -> str:
+    "Gets the fixed instance id of the specified shard's poller orchestrator"
+    return f"{POLLER_INSTANCE_PREFIX}{shard}"
+
+
+def is_poller_instance(instance_id: Optional[str]) -> bool:
+    "Determines whether or not the orchestrator instance id is one of the shared pollers, which must never be terminated for a single session"
+    return instance_id is not None and instance_id.startswith(POLLER_INSTANCE_PREFIX)
+
+
+def registry_entity_id(shard: int) -> df.EntityId:
+    "Gets the id of the Durable Entity holding the specified shard's outstanding batch tasks"
+    return df.EntityId(REGISTRY_ENTITY_NAME, str(shard))
+
+
+def make_task_record(session_name: str,
+                     activity: SessionActivity,
+                     task_id: str,
+                     completion_state_add: SessionState,
+                     completion_state_remove: SessionState,
+                     schedule: PollingSchedule) -> dict:
+    """
+    Builds the registry record of an outstanding batch task; plain JSON data.
+    :param str session_name: the session to update when the task completes
+    :param SessionActivity activity: the activity of the task
+    :param str task_id: the id of the batch task
+    :param SessionState completion_state_add: the SessionState to add to the Session's set of states when the task completes
+    :param SessionState completion_state_remove: the SessionState to remove from the Session's set of states when the task completes
+    :param PollingSchedule schedule: how often to check the task's status
+    :returns dict: the record
+    """
+    return {
+        "session_name": session_name,
+        "activity": activity.name,
+        "task_id": task_id,
+        "completion_state_add": completion_state_add.name,
+        "completion_state_remove": completion_state_remove.name,
+        "schedule": schedule.to_dict()
+    }
+
+
+async def ensure_poller_running(client: DurableOrchestrationClient, shard: int) -> None:
+    """
+    Starts the specified shard's poller orchestrator, unless its status says it is already running.
+    The check and the start are not atomic, so two workers registering tasks at once may both start it. Depending on the
+    Durable Functions extension, the second start either fails, which is ignored here, or replaces the running instance;
+    either way the tasks are kept in the registry and still polled, only their check schedules start over.
+    A poller never completes, even when it has no tasks: if it did, a task registered while it was completing could see it
+    still running and never be polled. While idle it costs one registry read and one timer every POLLER_IDLE_SECONDS.
+    :param DurableOrchestrationClient client: the durable functions client
+    :param int shard: the shard number
+    """
+    instance_id = poller_instance_id(shard)
+    status = await client.get_status(instance_id)
+    if (status is not None and status.runtime_status in ACTIVE_RUNTIME_STATUSES):
+        return
+    try:
+        await client.start_new(POLLER_ORCHESTRATOR_NAME, instance_id=instance_id, client_input={"shard": shard, "checks": {}})
+    except Exception as ex:
+        status = await client.get_status(instance_id)
+        if (status is None or status.runtime_status not in ACTIVE_RUNTIME_STATUSES):
+            raise
+        logging.info(f"Batch task poller {instance_id} was started concurrently, exception={repr(ex)}")
+        return
+    logging.info(f"Batch task poller started, instance ID = {instance_id}")
+
+
+async def register_batch_task(starter: str, record: dict) -> str:
+    """
+    Adds a batch task to its shard's registry, and makes sure the shard's poller is running.
+    :param str starter: the context
+    :param dict record: the task, as built by make_task_record()
+    :returns str: the instance id of the poller orchestrator now waiting for the task
+    """
+    client = DurableOrchestrationClient(starter)
+    shard = shard_for_task(record["task_id"])
+    await client.signal_entity(registry_entity_id(shard), REGISTER_OPERATION, record)
+    await ensure_poller_running(client, shard)
+    return poller_instance_id(shard)
+
+
+async def unregister_batch_task(starter: str, instance_id: str, task_id: str) -> None:
+    """
+    Removes a batch task from the registry of the poller waiting for it, so no completion update is made for it.
+    :param str starter: the context
+    :param str instance_id: the instance id of the poller orchestrator, as returned by register_batch_task()
+    :param str task_id: the id of the batch task
+    """
+    shard = int(instance_id[len(POLLER_INSTANCE_PREFIX):])
+    client = DurableOrchestrationClient(starter)
+    await client.signal_entity(registry_entity_id(shard), UNREGISTER_OPERATION, [task_id])
@@ -4,9 +4,11 @@
 # +----------------------------------------------------------------------------
 
 from dataclasses import dataclass
+from typing import Optional
 
 from .session import SessionState
 from .session_activity import SessionActivity
+from .polling_schedule import PollingSchedule
 
 
 @dataclass
@@ -18,11 +20,20 @@ class BatchTaskWaitOrchestratorInput:
     batch_task_id:           the task id necessary for the "status" API
     completion_state_add:    the SessionState to add to the Session's set of states when the task completes
     completion_state_remove: the SessionState to remove from the Session's set of states when the task completes
-    check_interval_seconds:  how many seconds to wait between batch task status checks; optional, default is 60 seconds
+    check_interval_seconds:  how many seconds to wait before the next batch task status check; optional, default is 60 seconds
+    schedule:                how the wait grows between checks; optional, default is None (always wait check_interval_seconds)
+    checks_done:             how many status checks have been made so far
+    started:                 when the orchestrator first ran (ISO 8601 UTC), to estimate the task's remaining time from its progress
+    callback_fallback_seconds: the shortest wait between status checks when the runner will report completion with a callback;
+                             optional, default is None (no callback, rely on polling)
     """
     session_name: str
     activity: SessionActivity
     batch_task_id: str
     completion_state_add: SessionState
     completion_state_remove: SessionState
-    check_interval_seconds: int = 60
+    check_interval_seconds: float = 60
+    schedule: Optional[PollingSchedule] = None
+    checks_done: int = 0
+    started: Optional[str] = None
+    callback_fallback_seconds: Optional[float] = None
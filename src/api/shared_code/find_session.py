@@ -7,21 +7,31 @@ from typing import Optional
 
 import azure.functions as func
 
-from .utilities import is_none_or_whitespace
+from .utilities import is_none_or_whitespace, str_to_bool
 from .session import Session
 from .session_de import get_session
+from .worker_stats import log_worker_stats
 
 
-async def find_session(req: func.HttpRequest, starter: str) -> Optional[Session]:
+CONSISTENT_PARAM = "consistent"
+
+
+async def find_session(req: func.HttpRequest, starter: str, consistent: bool = False) -> Optional[Session]:
     """
     Returns the session object for the session name given in the route, or None if it does not exist.
+    The session may come from the worker's session cache, unless a consistent read is requested,
+    either by the caller or by the request's "consistent=true" query parameter.
     :param func.HttpRequest req: the HTTP request object
     :param str starter: the context
+    :param bool consistent: whether to bypass the cache, e.g. before modifying the session; optional, default is False
     :returns: Session object or None
     """
     session_name = req.route_params.get("sessionName")
     if (is_none_or_whitespace(session_name)):
         return None
 
+    consistent = consistent or str_to_bool(req.params.get(CONSISTENT_PARAM))
+    log_worker_stats()
+
     # Retrieve the Session object from the durable entity
-    return await get_session(session_name, starter)
+    return await get_session(session_name, starter, consistent)
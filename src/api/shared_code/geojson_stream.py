@@ -0,0 +1,152 @@
+# +----------------------------------------------------------------------------
+# | Copyright (c) 2022 Pivotal Commware
+# | All rights reserved.
+# +----------------------------------------------------------------------------
+
+import codecs
+import json
+from typing import AsyncIterable, Iterable
+
+
+WHITESPACE = " \t\r\n"
+FEATURES_KEY = "features"
+# Where the "features" array may be: a member of the top level object, or of its "geoJSON" member; None is the top level
+FEATURES_PARENTS = ([None], [None, "geoJSON"])
+MAX_KEY_LENGTH = 64  # longer strings cannot be keys of interest, so only their start is kept
+
+
+class FeatureStreamParser:
+    """
+    Incrementally parses the "features" array of a GeoJSON document (optionally wrapped in a top level "geoJSON" object).
+    Text is fed in arbitrary pieces; each feature is returned as soon as it has been fully received,
+    so only the feature currently being received is held in memory, never the whole document.
+    """
+
+    def __init__(self):
+        """
+        Constructor.
+        """
+        self.buffer    = ""
+        self.position  = 0
+        self.in_array  = False
+        self.completed = False
+        self.decoder   = json.JSONDecoder()
+
+        # While searching for the "features" array: the keys of the containers the text is in, and the string being read
+        self.parents     = []
+        self.member_key  = None  # the key of the member whose value comes next
+        self.in_string   = False
+        self.escaped     = False
+        self.string_text = ""
+        self.last_string = None
+
+
+    def feed(self, text: str, final: bool = False) -> list:
+        """
+        Adds more of the document and returns the features that are now complete.
+        :param str text: The next piece of the document.
+        :param bool final: Whether or not this is the last piece of the document.
+        :returns list: The features completed by this piece, in document order; may be empty.
+        :raises ValueError: if the document is not GeoJSON with a "features" array, or is malformed or truncated
+        """
+        features = []
+        if (self.completed):
+            return features
+
+        self.buffer = self.buffer[self.position:] + text
+        self.position = 0
+
+        if (not self.in_array):
+            if (not self.find_features_array()):
+                if (final):
+                    raise ValueError("GeoJSON document does not contain a \"features\" array")
+                self.buffer, self.position = "", 0  # all of it scanned; the scan's state is kept
+                return features
+            self.in_array = True
+
+        while True:
+            while (self.position < len(self.buffer) and self.buffer[self.position] in WHITESPACE + ","):
+                self.position += 1
+            if (self.position >= len(self.buffer)):
+                break
+            if (self.buffer[self.position] == "]"):
+                self.completed = True
+                break
+            try:
+                feature, self.position = self.decoder.raw_decode(self.buffer, self.position)
+            except json.JSONDecodeError:
+                if (final):
+                    raise
+                break  # the feature is not fully received yet
+            features.append(feature)
+
+        if (final and not self.completed):
+            raise ValueError("GeoJSON \"features\" array is truncated")
+        return features
+
+
+    def find_features_array(self) -> bool:
+        """
+        Scans the buffer for the start of the "features" array, skipping any "features" key nested deeper or inside a string.
+        :returns bool: True, with the position just after the array's "[", if found; False if the whole buffer was scanned
+        """
+        buffer = self.buffer
+        for position in range(self.position, len(buffer)):
+            char = buffer[position]
+            if (self.in_string):
+                if (self.escaped):
+                    self.escaped = False
+                elif (char == "\\"):
+                    self.escaped = True
+                elif (char == '"'):
+                    self.in_string = False
+                    self.last_string = self.string_text
+                elif (len(self.string_text) <= MAX_KEY_LENGTH):
+                    self.string_text += char
+                continue
+
+            if (char == '"'):
+                self.in_string, self.string_text = True, ""
+            elif (char == ":"):
+                self.member_key = self.last_string
+            elif (char in "{["):
+                if (char == "[" and self.member_key == FEATURES_KEY and self.parents in FEATURES_PARENTS):
+                    self.position = position + 1
+                    return True
+                self.parents.append(self.member_key)
+                self.member_key = None
+            elif (char in "}]"):
+                if (self.parents):
+                    self.parents.pop()
+                self.member_key = None
+            elif (char == ","):
+                self.member_key = None
+        return False
+
+
+def iter_geojson_features(chunks: Iterable[bytes]) -> Iterable[dict]:
+    """
+    Yields the features of a UTF-8 encoded GeoJSON document as its bytes arrive.
+    :param chunks: An iterable of 'bytes', e.g. a blob download's chunks
+    :returns Generator: A generator of a 'dictionary', one per feature
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    parser = FeatureStreamParser()
+    for chunk in chunks:
+        yield from parser.feed(decoder.decode(chunk))
+    yield from parser.feed(decoder.decode(b"", final=True), final=True)
+
+
+async def aiter_geojson_features(chunks: AsyncIterable[bytes]):
+    """
+    Yields the features of a UTF-8 encoded GeoJSON document as its bytes arrive, without blocking the event loop.
+    :param chunks: An async iterable of 'bytes', e.g. an async blob download's chunks
+    :returns AsyncGenerator: An async generator of a 'dictionary', one per feature
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    parser = FeatureStreamParser()
+    async for chunk in chunks:
+        for feature in parser.feed(decoder.decode(chunk)):
+            yield feature
+    for feature in parser.feed(decoder.decode(b"", final=True), final=True):
+        yield feature
@@ -0,0 +1,80 @@
+# +----------------------------------------------------------------------------
+# | Copyright (c) 2022 Pivotal Commware
+# | All rights reserved.
+# +----------------------------------------------------------------------------
+
+import gzip
+from typing import Optional
+
+import azure.functions as func
+
+try:
+    import brotli  # optional, compresses JSON better than gzip; add "brotli" to requirements.txt to enable "br" responses
+except ImportError:
+    brotli = None
+
+
+MIN_COMPRESSED_SIZE = 1024  # smaller bodies are sent as is; compressing them saves nothing worth the CPU
+GZIP_LEVEL          = 6
+BROTLI_QUALITY      = 5     # the default (11) is far too slow for compressing on the fly
+
+
+def parse_accept_encoding(accept_encoding: Optional[str]) -> dict:
+    """
+    Parses the value of an "Accept-Encoding" request header, e.g. "gzip, deflate, br;q=0.9".
+    :param str accept_encoding: the header value, or None
+    :returns dict: the quality of each accepted encoding, by encoding name
+    """
+    qualities = {}
+    for item in (accept_encoding or "").split(","):
+        name, _, params = item.strip().partition(";")
+        if (not name):
+            continue
+        quality = 1.0
+        params = params.strip()
+        if (params.startswith("q=")):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        qualities[name.strip().lower()] = quality
+    return qualities
+
+
+def choose_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """
+    Chooses how to compress a response, from what the client accepts: Brotli if available, else gzip.
+    :param str accept_encoding: the value of the request's "Accept-Encoding" header, or None
+    :returns: "br", "gzip", or None to not compress
+    """
+    qualities = parse_accept_encoding(accept_encoding)
+    wildcard = qualities.get("*", 0.0)
+    candidates = (["br"] if (brotli is not None) else []) + ["gzip"]
+    accepted = [encoding for encoding in candidates if qualities.get(encoding, wildcard) > 0]
+    if (not accepted):
+        return None
+    return max(accepted, key=lambda encoding: qualities.get(encoding, wildcard))  # on a tie, the first (best) candidate wins
+
+
+def compress_response(req: func.HttpRequest, response: func.HttpResponse) -> func.HttpResponse:
+    """
+    Compresses the body of a response, if the client accepts a compressed response and the body is large enough to be worth it.
+    :param func.HttpRequest req: the HTTP request, for its "Accept-Encoding" header
+    :param func.HttpResponse response: the uncompressed response
+    :returns func.HttpResponse: the response, compressed or not
+    """
+    body = response.get_body()
+    if (len(body) < MIN_COMPRESSED_SIZE or "content-encoding" in response.headers):
+        return response
+    encoding = choose_encoding(req.headers.get("accept-encoding"))
+    if (encoding is None):
+        return response
+
+    if (encoding == "br"):
+        body = brotli.compress(body, quality=BROTLI_QUALITY)
+    else:
+        body = gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+    headers = dict(response.headers)
+    headers["Content-Encoding"] = encoding
+    headers["Vary"] = "Accept-Encoding"
+    return func.HttpResponse(body, status_code=response.status_code, headers=headers, mimetype=response.mimetype, charset=response.charset)
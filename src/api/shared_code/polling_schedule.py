@@ -0,0 +1,98 @@
+# +----------------------------------------------------------------------------
+# | Copyright (c) 2022 Pivotal Commware
+# | All rights reserved.
+# +----------------------------------------------------------------------------
+
+import logging
+from dataclasses import asdict, dataclass
+from typing import Optional
+
+from .session_activity import SessionActivity
+from .utilities import get_environment_variable
+
+
+@dataclass
+class PollingSchedule:
+    """
+    How often to check on a batch task: quickly at first, then less and less often as the task ages.
+    initial_seconds: how many seconds to wait before the first status check
+    max_seconds:     the longest wait between two status checks
+    factor:          how much longer each wait is than the previous one
+    """
+    initial_seconds: float
+    max_seconds: float
+    factor: float
+
+    def to_dict(self) -> dict:
+        "Converts the schedule into plain data, e.g. for an orchestrator's input"
+        return asdict(self)
+
+    @staticmethod
+    def from_dict(data: dict) -> "PollingSchedule":
+        "Converts plain data back into a schedule"
+        return PollingSchedule(data["initial_seconds"], data["max_seconds"], data["factor"])
+
+
+# Nearmap and Validation typically finish in minutes; WaveScape runs for hours
+DEFAULT_POLLING_SCHEDULES = {
+    SessionActivity.NEARMAP: PollingSchedule(initial_seconds=15, max_seconds=60, factor=1.5),
+    SessionActivity.VALIDATION: PollingSchedule(initial_seconds=15, max_seconds=120, factor=1.5),
+    SessionActivity.WAVESCAPE: PollingSchedule(initial_seconds=30, max_seconds=900, factor=1.5)
+}
+
+MIN_CHECK_INTERVAL_SECONDS = 5  # never check more often than this, whatever the hints say
+ETA_MARGIN_SECONDS         = 5  # when the runner gives an ETA, check this long after it
+
+
+def get_polling_schedule(activity: SessionActivity) -> PollingSchedule:
+    """
+    Gets the polling schedule of the specified activity.
+    Can be overridden with a BATCH_TASK_POLLING_{ACTIVITY} environment variable, e.g. BATCH_TASK_POLLING_WAVESCAPE="30,900,1.5"
+    for the initial wait, the longest wait and the growth factor.
+    :param SessionActivity activity: the activity
+    :returns PollingSchedule: the schedule
+    """
+    setting = get_environment_variable(f"BATCH_TASK_POLLING_{activity.name}")
+    if (setting is not None):
+        try:
+            initial_seconds, max_seconds, factor = (float(value) for value in setting.split(","))
+            return PollingSchedule(initial_seconds, max_seconds, factor)
+        except ValueError:
+            logging.error(f"Ignoring invalid BATCH_TASK_POLLING_{activity.name}=\"{setting}\", expected \"initial,max,factor\"")
+    return DEFAULT_POLLING_SCHEDULES[activity]
+
+
+def estimate_remaining_seconds(elapsed_seconds: float, status: dict) -> Optional[float]:
+    """
+    Estimates how long until the task completes, from the optional hints in its status:
+    "eta_seconds" (time remaining) or "progress" (fraction completed, 0 to 1).
+    :param float elapsed_seconds: how long ago the task was started
+    :param dict status: the result of the status check
+    :returns: the estimated number of seconds remaining, or None if there is no hint
+    """
+    eta_seconds = status.get("eta_seconds")
+    if (eta_seconds is not None):
+        return max(float(eta_seconds), 0.0)
+    progress = status.get("progress")
+    if (progress is not None and 0 < float(progress) < 1 and elapsed_seconds > 0):
+        return elapsed_seconds * (1 - float(progress)) / float(progress)
+    return None
+
+
+def next_check_interval_seconds(schedule: PollingSchedule, checks_done: int, elapsed_seconds: float, status: Optional[dict] = None) -> float:
+    """
+    Computes how long to wait before the next status check of a task that is not yet completed.
+    Without hints the wait grows geometrically from the schedule's initial wait up to its longest wait;
+    with an ETA or progress hint, the next check is made shortly after the task is expected to complete, within the same bounds.
+    Pure function of its arguments, so it is safe to call from an orchestrator.
+    :param PollingSchedule schedule: the activity's polling schedule
+    :param int checks_done: how many status checks have been made so far
+    :param float elapsed_seconds: how long ago the task was started
+    :param dict status: the result of the last status check, possibly with hints; optional
+    :returns float: the number of seconds to wait
+    """
+    interval = min(schedule.max_seconds, schedule.initial_seconds * (schedule.factor ** checks_done))
+    remaining = estimate_remaining_seconds(elapsed_seconds, status or {})
+    if (remaining is not None):
+        interval = min(schedule.max_seconds, remaining + ETA_MARGIN_SECONDS)
+    return max(interval, MIN_CHECK_INTERVAL_SECONDS)
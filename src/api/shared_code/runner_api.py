@@ -0,0 +1,354 @@
+# +----------------------------------------------------------------------------
+# | Copyright (c) 2022 Pivotal Commware
+# | All rights reserved.
+# +----------------------------------------------------------------------------
+
+import bisect
+import json
+import logging
+import random
+import threading
+import time
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+
+from .session_activity import SessionActivity
+from .utilities import get_environment_variable, serialize
+
+
+# +-------------------------------------------------------------------------------------------
+# | Client for the WaveScape runner API ("{activity}/start", "{activity}/stop/{task_id}" and
+# | "{activity}/status/{task_id}"), shared by every caller in the worker: one keep-alive
+# | connection pool, connect/read timeouts, retries with backoff for idempotent calls, and
+# | latency/error histograms per activity and endpoint.
+# +-------------------------------------------------------------------------------------------
+DEFAULT_CONNECTION_POOL_SIZE    = 10
+DEFAULT_CONNECT_TIMEOUT_SECONDS = 5
+DEFAULT_READ_TIMEOUT_SECONDS    = 30
+DEFAULT_MAX_RETRIES             = 4
+RETRY_BASE_SECONDS              = 0.5
+RETRY_MAX_SECONDS               = 8
+RETRYABLE_STATUS_CODES          = (429, 500, 502, 503, 504)
+
+LATENCY_BUCKETS_MS = [50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000]  # upper bounds; the last bucket is "more than 30 s"
+
+START_ENDPOINT  = "start"
+STOP_ENDPOINT   = "stop"
+STATUS_ENDPOINT = "status"
+BATCH_LABEL     = "batch"  # metrics label of calls that are not for a single activity
+
+_session_lock = threading.Lock()
+_http_session: Optional[requests.Session] = None
+
+
+def get_runner_http_session() -> requests.Session:
+    """
+    Gets the HTTP session (and its keep-alive connection pool) shared by all of the runner API calls.
+    The pool size can be tuned with the WAVESCAPE_RUNNER_CONNECTION_POOL_SIZE environment variable.
+    :returns requests.Session: the shared HTTP session
+    """
+    global _http_session
+    with _session_lock:
+        if (_http_session is None):
+            pool_size = get_environment_variable("WAVESCAPE_RUNNER_CONNECTION_POOL_SIZE")
+            adapter = HTTPAdapter(pool_maxsize=int(pool_size) if pool_size is not None else DEFAULT_CONNECTION_POOL_SIZE)
+            session = requests.Session()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _http_session = session
+        return _http_session
+
+
+def get_timeouts() -> tuple:
+    """
+    Gets the connect and read timeouts for runner API calls, tunable with the
+    WAVESCAPE_RUNNER_CONNECT_TIMEOUT_SECONDS and WAVESCAPE_RUNNER_READ_TIMEOUT_SECONDS environment variables.
+    :returns tuple: the (connect, read) timeouts, in seconds
+    """
+    connect_timeout = get_environment_variable("WAVESCAPE_RUNNER_CONNECT_TIMEOUT_SECONDS")
+    read_timeout = get_environment_variable("WAVESCAPE_RUNNER_READ_TIMEOUT_SECONDS")
+    return (float(connect_timeout) if connect_timeout is not None else DEFAULT_CONNECT_TIMEOUT_SECONDS,
+            float(read_timeout) if read_timeout is not None else DEFAULT_READ_TIMEOUT_SECONDS)
+
+
+def get_max_retries() -> int:
+    """
+    Gets how many times an idempotent runner API call is retried, tunable with the WAVESCAPE_RUNNER_MAX_RETRIES environment variable.
+    :returns int: the maximum number of retries
+    """
+    max_retries = get_environment_variable("WAVESCAPE_RUNNER_MAX_RETRIES")
+    return int(max_retries) if max_retries is not None else DEFAULT_MAX_RETRIES
+
+
+def retry_delay_seconds(attempt: int) -> float:
+    """
+    Computes how long to wait before the next attempt: exponential backoff with "full jitter", capped.
+    :param int attempt: the number of the attempt that just failed, starting at 0
+    :returns float: the delay, in seconds
+    """
+    return random.uniform(0, min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * (2 ** attempt)))
+
+
+def is_request_unsent(ex: requests.RequestException) -> bool:
+    """
+    Determines whether a failed call never reached the runner, e.g. the connection was refused or timed out, so even a call that is not idempotent can be retried.
+    :param requests.RequestException ex: the exception raised by the call
+    :returns bool: True if the request was never sent, False if it may have been
+    """
+    if (isinstance(ex, requests.ConnectTimeout)):
+        return True
+    reason = getattr(ex.args[0], "reason", None) if (ex.args) else None  # the urllib3 MaxRetryError's underlying error
+    return isinstance(ex, requests.ConnectionError) and isinstance(reason, (NewConnectionError, ConnectTimeoutError))
+
+
+class RunnerApiMetrics:
+    """
+    Per-worker latency and error histograms of the runner API calls, keyed by activity (or BATCH_LABEL) and endpoint.
+    Every attempt is recorded, including the ones that are retried.
+    """
+
+    def __init__(self):
+        """
+        Constructor.
+        """
+        self.lock      = threading.Lock()
+        self.latencies = {}  # "activity/endpoint" -> list of counts, one per LATENCY_BUCKETS_MS bucket plus overflow
+        self.errors    = {}  # "activity/endpoint" -> {"status code" or exception name: count}
+
+
+    def record(self, activity: Optional[SessionActivity], endpoint: str, elapsed_seconds: float, error: Optional[str] = None) -> None:
+        """
+        Records the outcome of one attempt.
+        :param SessionActivity activity: the activity that was called, or None for calls covering several activities
+        :param str endpoint: the endpoint that was called, e.g. STATUS_ENDPOINT
+        :param float elapsed_seconds: how long the attempt took
+        :param str error: the unexpected status code or exception name; optional, default is None (success)
+        """
+        key = f"{activity.name.lower() if activity is not None else BATCH_LABEL}/{endpoint}"
+        bucket = bisect.bisect_left(LATENCY_BUCKETS_MS, elapsed_seconds * 1000)
+        with self.lock:
+            self.latencies.setdefault(key, [0] * (len(LATENCY_BUCKETS_MS) + 1))[bucket] += 1
+            if (error is not None):
+                errors = self.errors.setdefault(key, {})
+                errors[error] = errors.get(error, 0) + 1
+
+
+    def stats(self) -> dict:
+        """
+        Gets a snapshot of the histograms.
+        :returns dict: per "activity/endpoint", the "latency_ms" bucket counts (keyed by upper bound, "+Inf" for the overflow) and the "errors" counts
+        """
+        labels = [str(bound) for bound in LATENCY_BUCKETS_MS] + ["+Inf"]
+        with self.lock:
+            return {
+                key: {
+                    "latency_ms": dict(zip(labels, counts)),
+                    "errors": dict(self.errors.get(key, {}))
+                }
+                for key, counts in self.latencies.items()
+            }
+
+
+runner_api_metrics = RunnerApiMetrics()
+
+
+def call_runner_api(method: str, activity: Optional[SessionActivity], endpoint: str, api_call: str, data: Optional[str] = None, idempotent: bool = False,
+                    deadline_seconds: Optional[float] = None) -> requests.Response:
+    """
+    Calls the WaveScape runner API. Blocking, retries included, so async callers run it with asyncio.to_thread().
+    Idempotent calls are retried on timeouts, connection errors and RETRYABLE_STATUS_CODES;
+    other calls are only retried when the connection could not be established, i.e. the request was never sent, see is_request_unsent().
+    :param str method: the HTTP method, e.g. "POST"
+    :param SessionActivity activity: the activity being called, or None for calls covering several activities (for metrics)
+    :param str endpoint: the endpoint being called, e.g. START_ENDPOINT (for metrics)
+    :param str api_call: the path of the call, relative to WAVESCAPE_RUNNER_API_URL, e.g. "nearmap/status/{task_id}"
+    :param str data: the JSON body; optional, default is no body
+    :param bool idempotent: whether or not the call can safely be repeated; optional, default is False
+    :param float deadline_seconds: how long the call may take, retries included; optional, default is only limited by the timeouts and retries
+    :returns requests.Response: the response of the last attempt
+    :raises requests.RequestException: if the last attempt failed without a response
+    """
+    api_url = get_environment_variable("WAVESCAPE_RUNNER_API_URL")  # e.g. "https://{FUNCTION_APP}.azurewebsites.net/api
+    api_key = get_environment_variable("WAVESCAPE_RUNNER_API_KEY")
+    url = f"{api_url}/{api_call}"
+    headers = {"Content-Type": "application/json"} if data is not None else None
+    max_retries = get_max_retries()
+    deadline = time.perf_counter() + deadline_seconds if deadline_seconds is not None else None
+
+    attempt = 0
+    while True:
+        start = time.perf_counter()
+        timeouts = get_timeouts() if deadline is None else tuple(min(timeout, max(deadline - start, 0.1)) for timeout in get_timeouts())
+        delay = retry_delay_seconds(attempt)
+        try:
+            response = get_runner_http_session().request(method, url, params={"code": api_key}, data=data, headers=headers, timeout=timeouts)
+        except requests.RequestException as ex:
+            runner_api_metrics.record(activity, endpoint, time.perf_counter() - start, type(ex).__name__)
+            retryable = idempotent or is_request_unsent(ex)
+            out_of_time = deadline is not None and time.perf_counter() + delay >= deadline
+            if (not(retryable) or attempt >= max_retries or out_of_time):
+                raise
+            logging.warning(f"Runner API {method} {url} failed, attempt {attempt + 1}, exception={repr(ex)}")
+        else:
+            retry = idempotent and response.status_code in RETRYABLE_STATUS_CODES
+            runner_api_metrics.record(activity, endpoint, time.perf_counter() - start, None if response.ok else str(response.status_code))
+            out_of_time = deadline is not None and time.perf_counter() + delay >= deadline
+            if (not(retry) or attempt >= max_retries or out_of_time):
+                return response
+            logging.warning(f"Runner API {method} {url} failed, attempt {attempt + 1}, status={response.status_code}, reason={response.reason}")
+        time.sleep(delay)
+        attempt += 1
+
+
+def start_task(activity: SessionActivity, body: str) -> requests.Response:
+    """
+    Asks the runner to start a batch task for the specified activity. Not retried once sent, since it is not idempotent.
+    :param SessionActivity activity: the activity to start
+    :param str body: the JSON body
+    :returns requests.Response: the response
+    """
+    return call_runner_api("POST", activity, START_ENDPOINT, f"{activity.name.lower()}/start", data=body)
+
+
+def stop_task(activity: SessionActivity, task_id: str, deadline_seconds: Optional[float] = None) -> requests.Response:
+    """
+    Asks the runner to stop the specified batch task.
+    :param SessionActivity activity: the activity of the task
+    :param str task_id: the id of the task to stop
+    :param float deadline_seconds: how long the call may take, retries included; optional, see call_runner_api()
+    :returns requests.Response: the response
+    """
+    return call_runner_api("POST", activity, STOP_ENDPOINT, f"{activity.name.lower()}/stop/{task_id}", idempotent=True, deadline_seconds=deadline_seconds)
+
+
+def get_task_status(activity: SessionActivity, task_id: str) -> requests.Response:
+    """
+    Asks the runner for the status of the specified batch task.
+    :param SessionActivity activity: the activity of the task
+    :param str task_id: the id of the task
+    :returns requests.Response: the response
+    """
+    return call_runner_api("GET", activity, STATUS_ENDPOINT, f"{activity.name.lower()}/status/{task_id}", idempotent=True)
+
+
+def get_task_statuses(tasks: list) -> requests.Response:
+    """
+    Asks the runner for the status of many batch tasks, of any activities, in one call ("POST status").
+    The response is a JSON object mapping each task id to the same status object as get_task_status() returns,
+    or to null if the task no longer exists; task ids missing from the response are unknown to the runner.
+    :param list tasks: the tasks, as {"activity": activity name, "task_id": task id} dictionaries
+    :returns requests.Response: the response
+    """
+    body = json.dumps({"tasks": [{"activity": task["activity"].lower(), "task_id": task["task_id"]} for task in tasks]})
+    return call_runner_api("POST", None, STATUS_ENDPOINT, "status", data=body, idempotent=True)
+
+
+def interpret_task_status(activity_name: str, batch_task_id: str, status: Optional[dict]) -> dict:
+    """
+    Interprets the status object of a batch task returned by the runner.
+    :param str activity_name: the name of the task's activity (for logging)
+    :param str batch_task_id: the id of the task (for logging)
+    :param dict status: the status object, e.g. {"state": {"_value_": "completed"}, "execution_info": {...}}
+    :returns dict: whether or not to "check_again" later, the serialized "execution_info" once completed, and
+        the optional "eta_seconds" and "progress" hints of a running task
+    """
+    execution_info: str = ""
+    check_again: bool = True
+    state = status["state"]["_value_"]
+    if (state == "completed"):
+        execution_info = serialize(status["execution_info"])
+        logging.info(f"Azure batch activity={activity_name} task={batch_task_id} completed, result={execution_info}")
+        check_again = False
+    else:
+        logging.info(f"Azure batch activity={activity_name} task={batch_task_id} not yet completed, state={state}")
+    return {"check_again": check_again, "execution_info": execution_info, "eta_seconds": status.get("eta_seconds"), "progress": status.get("progress")}
+
+
+def check_task_status(activity_name: str, batch_task_id: str) -> dict:
+    """
+    Determines whether or not the specified batch task is completed.
+    :param str activity_name: the name of the task's activity, e.g. "NEARMAP"
+    :param str batch_task_id: the id of the task
+    :returns dict: whether or not to "check_again" later: True if the API call failed with 404 or the task is not completed,
+        False otherwise; and the serialized "execution_info" once completed
+    """
+    try:
+        response = get_task_status(SessionActivity[activity_name], batch_task_id)
+    except requests.RequestException as ex:
+        # Transient failures were already retried; if it still failed, try again at the next check
+        logging.error(f"Failed to get Azure batch task status. activity={activity_name} task={batch_task_id}, exception={repr(ex)}")
+        return {"check_again": True, "execution_info": ""}
+
+    if (response.status_code == requests.codes.ok):
+        return interpret_task_status(activity_name, batch_task_id, response.json())
+
+    logging.error(f"Failed to get Azure batch task status. API={response.request.path_url.split('?')[0]}, status={response.status_code}, reason={response.reason}")
+    # 404 = Not Found; the requested resource could not be found but may be available in the future. Subsequent requests are permissible.
+    # The status API should return a 410 (Gone) for when the task no longer exists, meaning we will not check again.
+    return {"check_again": response.status_code == 404, "execution_info": ""}
+
+
+def check_task_statuses(tasks: list) -> dict:
+    """
+    Determines whether or not each of the specified batch tasks is completed, with a single batched call.
+    Falls back to one call per task if the runner does not support the batched call.
+    :param list tasks: the tasks, as {"activity": activity name, "task_id": task id} dictionaries
+    :returns dict: for each task id, the same result as check_task_status()
+    """
+    if (not tasks):
+        return {}
+    try:
+        response = get_task_statuses(tasks)
+    except requests.RequestException as ex:
+        logging.error(f"Failed to get Azure batch task statuses for {len(tasks)} tasks, exception={repr(ex)}")
+        return {task["task_id"]: {"check_again": True, "execution_info": ""} for task in tasks}
+
+    if (response.status_code in (404, 405)):  # 404 = Not Found, 405 = Method Not Allowed; no batched call, so ask one task at a time
+        return {task["task_id"]: check_task_status(task["activity"], task["task_id"]) for task in tasks}
+    if (response.status_code != requests.codes.ok):
+        logging.error(f"Failed to get Azure batch task statuses. status={response.status_code}, reason={response.reason}")
+        return {task["task_id"]: {"check_again": True, "execution_info": ""} for task in tasks}
+
+    try:
+        statuses = response.json()
+    except ValueError as ex:
+        logging.error(f"Failed to get Azure batch task statuses, the response is not JSON, exception={repr(ex)}")
+        return {task["task_id"]: {"check_again": True, "execution_info": ""} for task in tasks}
+    results = {}
+    for task in tasks:
+        task_id = task["task_id"]
+        if (task_id not in statuses):
+            logging.error(f"Azure batch activity={task['activity']} task={task_id} unknown to the status API")
+            results[task_id] = {"check_again": True, "execution_info": ""}
+        elif (statuses[task_id] is None):
+            logging.error(f"Azure batch activity={task['activity']} task={task_id} no longer exists")
+            results[task_id] = {"check_again": False, "execution_info": ""}
+        else:
+            results[task_id] = interpret_task_status(task["activity"], task_id, statuses[task_id])
+    return results
+
+
+def get_runner_api_stats() -> dict:
+    """
+    Gets the runner API latency/error histograms and the connection pool's counters, e.g. for logging.
+    :returns dict: "calls" per "activity/endpoint" (see RunnerApiMetrics.stats()), and "connections" with the
+        number of "requests" sent and connections "opened"
+    """
+    requests_sent = 0
+    connections_opened = 0
+    if (_http_session is not None):
+        for adapter in set(_http_session.adapters.values()):
+            pool_manager = getattr(adapter, "poolmanager", None)
+            if (pool_manager is not None):
+                for key in list(pool_manager.pools.keys()):
+                    pool = pool_manager.pools.get(key)
+                    if (pool is not None):
+                        requests_sent += pool.num_requests
+                        connections_opened += pool.num_connections
+    return {
+        "calls": runner_api_metrics.stats(),
+        "connections": {"requests": requests_sent, "opened": connections_opened}
+    }
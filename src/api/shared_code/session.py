@@ -7,7 +7,7 @@ import datetime
 
 from enum import Enum, unique, auto
 
-from .session_activity import SessionActivityInfo
+from .session_activity import SessionActivity, SessionActivityInfo
 from .session_storage import SessionStorage
 
 
@@ -97,3 +97,15 @@ class Session:
         Returns the last name in the list of iteration names.
         """
         return self.iteration_names[-1]
+
+
+    def activity_info(self, activity: SessionActivity) -> SessionActivityInfo:
+        """
+        Returns the information about the specified activity.
+        :param SessionActivity activity: the activity
+        """
+        if (activity == SessionActivity.NEARMAP):
+            return self.nearmap
+        if (activity == SessionActivity.VALIDATION):
+            return self.validation
+        return self.wavescape
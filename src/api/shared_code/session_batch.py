@@ -3,17 +3,25 @@
 # | All rights reserved.
 # +----------------------------------------------------------------------------
 
+import asyncio
 import logging
+import uuid
 import requests
 from dataclasses import dataclass
+from typing import Optional
 
 from azure.durable_functions import DurableOrchestrationClient
 
 from .session import Session, SessionState
 from .session_activity import SessionActivity
-from .session_de import save_session
+from .session_de import SessionUnitOfWork
 from .batch_task_wait_orchestrator_input import BatchTaskWaitOrchestratorInput
-from .utilities import deserialize, get_environment_variable, serialize, to_json
+from .session_codec import encode_orchestrator_input
+from .runner_api import start_task, stop_task
+from .batch_task_poller import is_poller_enabled, make_task_record, register_batch_task
+from .polling_schedule import PollingSchedule, get_polling_schedule
+from .task_callback import get_callback_fallback_seconds, get_callback_url
+from .utilities import PhaseTimer, deserialize, to_json
 
 
 @dataclass
@@ -24,6 +32,7 @@ class StartWaveScapeBody:
     table_sas: str
     configuration: object
     stages: object
+    callback_url: Optional[str] = None
 
 
 @dataclass
@@ -32,6 +41,7 @@ class StartValidationBody:
     container_sas: str
     table_sas: str
     configuration: object
+    callback_url: Optional[str] = None
 
 
 @dataclass
@@ -39,54 +49,74 @@ class StartNearmapBody:
     session_name: str
     container_sas: str
     table_sas: str
+    callback_url: Optional[str] = None
+
+
+def prepare_callback(body: object) -> Optional[str]:
+    """
+    Chooses the instance id of the orchestrator that will wait for the batch task about to be started and,
+    if completion callbacks are enabled, puts the URL the runner should call on completion in the start body.
+    :param object body: the body of the start API call; its callback_url is set
+    :returns: the instance id for create_orchestrator(), or None to let it generate one
+    """
+    if (is_poller_enabled()):
+        return None  # the shared pollers do not wait for callbacks
+    instance_id = uuid.uuid4().hex
+    body.callback_url = get_callback_url(instance_id)
+    return instance_id if body.callback_url is not None else None
 
 
 def call_batch_activity_start_api(api_body: object, session_name: str, activity: SessionActivity) -> str:
     """
     Calls the "start"" Azure Batch API for the specified activity with the provided body.
+    Blocking, retries included, so async callers run it with asyncio.to_thread().
     :param object api_body: The body of the API call
     :param str session_name: The name of the session (for error log)
     :param SessionActivity activity: What action is being initiated
     :returns str: The id of the Batch task that was just started
     :raises RuntimeError: if the result of calling the API does not indicate success
     """
-    api_url = get_environment_variable("WAVESCAPE_RUNNER_API_URL")  # e.g. "https://{FUNCTION_APP}.azurewebsites.net/api
-    api_key = get_environment_variable("WAVESCAPE_RUNNER_API_KEY")
-    api_call = f"{activity.name.lower()}/start"
-    url = f"{api_url}/{api_call}?code={api_key}"
-
-    response = requests.post(url, data=to_json(api_body, pretty=False), headers={"Content-Type": "application/json"})
-
     action = f"start {activity.name.lower()} for session \"{session_name}\""
+    try:
+        response = start_task(activity, to_json(api_body, pretty=False))
+    except requests.RequestException as ex:
+        msg = f"Failed to {action}. exception={repr(ex)}"
+        logging.error(msg)
+        raise RuntimeError(msg) from ex
+
     if (not(response.ok)):
-        msg = f"Failed to {action}. API={url}, status={response.status_code}, reason={response.reason}"
+        msg = f"Failed to {action}. API={response.request.path_url.split('?')[0]}, status={response.status_code}, reason={response.reason}"
         logging.error(msg)
         raise RuntimeError(msg)
     logging.info(f"{action} successful, task ID = {response.text}")
     return response.text
 
 
-def call_batch_activity_stop_api(session_name: str, activity: SessionActivity, task_id: str) -> None:
+def call_batch_activity_stop_api(session_name: str, activity: SessionActivity, task_id: str, deadline_seconds: Optional[float] = None) -> bool:
     """
     Calls the "stop"" Azure Batch API for the specified activity with the provided task id.
+    Blocking, retries included, so async callers run it with asyncio.to_thread().
     :param str session_name: The name of the session (for error log)
     :param SessionActivity activity: What action is being initiated
     :param str task_id: The id of the task to stop.
+    :param float deadline_seconds: How long the call may take, retries included; optional, see call_runner_api()
+    :returns bool: True if the task was stopped or no longer exists, False otherwise
     """
-    api_url = get_environment_variable("WAVESCAPE_RUNNER_API_URL")  # e.g. "https://{FUNCTION_APP}.azurewebsites.net/api
-    api_key = get_environment_variable("WAVESCAPE_RUNNER_API_KEY")
-    api_call = f"{activity.name.lower()}/stop/{task_id}"
-    url = f"${api_url}/{api_call}?code={api_key}"
-
-    response = requests.post(url)
     action = f"stop {activity.name.lower()} for session \"{session_name}\""
+    try:
+        response = stop_task(activity, task_id, deadline_seconds)
+    except requests.RequestException as ex:
+        logging.warning(f"Failed to {action}. exception={repr(ex)}")
+        return False
+
     if (not(response.ok)):
         if (response.status_code == 410):  # 410 = Gone
             logging.info(f"{action} successful, task already deleted")
-        else:
-            logging.warning(f"Failed to {action}. API={url}, status={response.status_code}, reason={response.reason}")
-    else:
-        logging.info(f"{action} successful")
+            return True
+        logging.warning(f"Failed to {action}. API={response.request.path_url.split('?')[0]}, status={response.status_code}, reason={response.reason}")
+        return False
+    logging.info(f"{action} successful")
+    return True
 
 
 async def create_orchestrator(starter: str,
@@ -95,22 +125,44 @@ async def create_orchestrator(starter: str,
                               completion_state_add: SessionState,
                               completion_state_remove: SessionState,
                               activity: SessionActivity,
-                              check_interval_seconds: int = 60) -> str:
+                              schedule: Optional[PollingSchedule] = None,
+                              instance_id: Optional[str] = None) -> str:
     """
-    Create a new orchestrator to wait for the specified batch task to complete.
+    Create a new orchestrator to wait for the specified batch task to complete,
+    or register the task with its shard's shared poller orchestrator if BATCH_TASK_POLLER_ENABLED is set.
     :param str starter: the context
     :param str session_name: so it knows what session to update when completion occurs
     :param str wait_task_id: the id of the task for which to wait
     :param SessionState completion_state_add: the state to add to the Session's set of states when completion occurs
     :param SessionState completion_state_remove: the state to remove from the Session's set of states when completion occurs
     :param SessionActivity activity: What activity was started, either "wavescape", "nearmap", or "validation"
-    :param int check_interval_seconds: how many seconds to wait between batch task status checks; optional, default is 60 seconds
-    :returns str: The id of the Batch orchestrator that was just created
+    :param PollingSchedule schedule: how often to check the batch task's status; optional, default is the activity's schedule
+    :param str instance_id: the instance id for the orchestrator, whose callback URL was given to the runner by prepare_callback();
+        optional, default is None (no callback, the orchestrator polls)
+    :returns str: The id of the Batch orchestrator that was just created, or of the poller orchestrator now waiting for the task
     :raises RuntimeError: if the result of starting a new orchestrator does not indicate success
     """
+    if (schedule is None):
+        schedule = get_polling_schedule(activity)
+
+    if (is_poller_enabled()):
+        record = make_task_record(session_name, activity, wait_task_id, completion_state_add, completion_state_remove, schedule)
+        poller_id = await register_batch_task(starter, record)
+        logging.info(f"{activity.name.lower()} batch task {wait_task_id} registered with poller {poller_id}")
+        return poller_id
+
     client = DurableOrchestrationClient(starter)
-    input = BatchTaskWaitOrchestratorInput(session_name, activity, wait_task_id, completion_state_add, completion_state_remove, check_interval_seconds)
-    orchestration_id = await client.start_new("df_orchestrator_batch_task_wait", client_input=serialize(input))
+    input = BatchTaskWaitOrchestratorInput(session_name,
+                                           activity,
+                                           wait_task_id,
+                                           completion_state_add,
+                                           completion_state_remove,
+                                           check_interval_seconds=schedule.initial_seconds,
+                                           schedule=schedule)
+    if (instance_id is not None):
+        input.callback_fallback_seconds = get_callback_fallback_seconds()
+        input.check_interval_seconds = max(input.check_interval_seconds, input.callback_fallback_seconds)
+    orchestration_id = await client.start_new("df_orchestrator_batch_task_wait", instance_id=instance_id, client_input=encode_orchestrator_input(input))
     action = f"create orchestrator to wait for {activity.name.lower()} batch task to complete"
     if (orchestration_id is None):
         msg = f"Failed to {action}."
@@ -120,47 +172,55 @@ async def create_orchestrator(starter: str,
     return orchestration_id
 
 
-async def start_nearmap(session: Session, starter: str) -> None:
+async def start_nearmap(session: Session, starter: str, timer: Optional[PhaseTimer] = None) -> None:
     """
     Initiate Nearmap processing.
     :param Session session: the session object
     :param str starter: the context
+    :param PhaseTimer timer: times the "runner" and "orchestrator" phases; optional
     """
     MAX_PROCESSING_TIME_HOURS = 1
+    timer = timer or PhaseTimer()
 
     # Construct the body that the Batch API needs
     body = StartNearmapBody(session.name,
                             session.storage.get_container_sas_uri(MAX_PROCESSING_TIME_HOURS),
                             session.storage.get_table_sas_uri(MAX_PROCESSING_TIME_HOURS))
 
-    # Call the Nearmap kick-off Batch API
-    session.nearmap.task_id = call_batch_activity_start_api(body, session.name, SessionActivity.NEARMAP)
-
-    # Update and save the Session now in case the next part fails
-    session.set_state(SessionState.NEARMAP_RUNNING)
-    await save_session(session, starter)
-
-    # Create an orchestrator to wait for Nearmap to complete
-    session.nearmap.orchestrator_id = await create_orchestrator(starter,
-                                                                session.name,
-                                                                session.nearmap.task_id,
-                                                                completion_state_add=SessionState.NEARMAP_COMPLETED,
-                                                                completion_state_remove=SessionState.NEARMAP_RUNNING,
-                                                                activity=SessionActivity.NEARMAP)
-
-    # Update and save the Session
-    session.touched()
-    await save_session(session, starter)
-
-
-async def start_wavescape(session: Session, stages: object, starter: str) -> None:
+    # Let the runner report completion with a callback, if enabled
+    instance_id = prepare_callback(body)
+
+    # The Session is saved once, when the block exits, even if creating the orchestrator fails
+    async with SessionUnitOfWork(session, starter):
+        # Call the Nearmap kick-off Batch API
+        with timer.phase("runner"):
+            session.nearmap.task_id = await asyncio.to_thread(call_batch_activity_start_api, body, session.name, SessionActivity.NEARMAP)
+        session.set_state(SessionState.NEARMAP_RUNNING)
+
+        # Create an orchestrator to wait for Nearmap to complete
+        with timer.phase("orchestrator"):
+            session.nearmap.orchestrator_id = await create_orchestrator(starter,
+                                                                        session.name,
+                                                                        session.nearmap.task_id,
+                                                                        completion_state_add=SessionState.NEARMAP_COMPLETED,
+                                                                        completion_state_remove=SessionState.NEARMAP_RUNNING,
+                                                                        activity=SessionActivity.NEARMAP,
+                                                                        instance_id=instance_id)
+        session.touched()
+
+
+async def start_wavescape(session: Session, stages: object, starter: str, timer: Optional[PhaseTimer] = None, baseline: Optional[dict] = None) -> None:
     """
     Initiate WaveScape processing.
     :param Session session: The session object
     :param object stage: The WaveScape stages collection
     :param str starter: The context
+    :param PhaseTimer timer: Times the "runner" and "orchestrator" phases; optional
+    :param dict baseline: The session before the caller changed it, e.g. added the iteration name, from session_to_dict(), so those changes are saved too;
+                          optional, default is None (the caller made no changes)
     """
     MAX_PROCESSING_TIME_HOURS = 12
+    timer = timer or PhaseTimer()
 
     # Construct the body that the Batch API needs
     body = StartWaveScapeBody(session.name,
@@ -170,36 +230,42 @@ async def start_wavescape(session: Session, stages: object, starter: str) -> Non
                               deserialize(session.configuration),
                               stages)
 
-    # Call the WaveScape kick-off Batch API
-    session.wavescape.task_id = call_batch_activity_start_api(body, session.name, SessionActivity.WAVESCAPE)
-
-    # Update the session's state, and save the Session now in case the next part fails
-    session.remove_state(SessionState.STOPPED)
-    session.remove_state(SessionState.WAVESCAPE_COMPLETED)
-    session.add_state(SessionState.READY_TO_RUN)  # In case we are coming from the stopped state
-    session.add_state(SessionState.WAVESCAPE_RUNNING)
-    await save_session(session, starter)
-
-    # Create an orchestrator to wait for WaveScape to complete
-    session.wavescape.orchestrator_id = await create_orchestrator(starter,
-                                                                  session.name,
-                                                                  session.wavescape.task_id,
-                                                                  completion_state_add=SessionState.WAVESCAPE_COMPLETED,
-                                                                  completion_state_remove=SessionState.WAVESCAPE_RUNNING,
-                                                                  activity=SessionActivity.WAVESCAPE)
-
-    # Update and save the Session
-    session.touched()
-    await save_session(session, starter)
-
-
-async def start_validation(session: Session, starter: str) -> None:
+    # Let the runner report completion with a callback, if enabled
+    instance_id = prepare_callback(body)
+
+    # The Session is saved once, when the block exits, even if creating the orchestrator fails
+    async with SessionUnitOfWork(session, starter, baseline):
+        # Call the WaveScape kick-off Batch API
+        with timer.phase("runner"):
+            session.wavescape.task_id = await asyncio.to_thread(call_batch_activity_start_api, body, session.name, SessionActivity.WAVESCAPE)
+
+        # Update the session's state
+        session.remove_state(SessionState.STOPPED)
+        session.remove_state(SessionState.WAVESCAPE_COMPLETED)
+        session.add_state(SessionState.READY_TO_RUN)  # In case we are coming from the stopped state
+        session.add_state(SessionState.WAVESCAPE_RUNNING)
+
+        # Create an orchestrator to wait for WaveScape to complete
+        with timer.phase("orchestrator"):
+            session.wavescape.orchestrator_id = await create_orchestrator(starter,
+                                                                          session.name,
+                                                                          session.wavescape.task_id,
+                                                                          completion_state_add=SessionState.WAVESCAPE_COMPLETED,
+                                                                          completion_state_remove=SessionState.WAVESCAPE_RUNNING,
+                                                                          activity=SessionActivity.WAVESCAPE,
+                                                                          instance_id=instance_id)
+        session.touched()
+
+
+async def start_validation(session: Session, starter: str, timer: Optional[PhaseTimer] = None) -> None:
     """
     Initiate Validation processing.
     :param Session session: the session object
     :param str starter: the context
+    :param PhaseTimer timer: times the "runner" and "orchestrator" phases; optional
     """
     MAX_PROCESSING_TIME_HOURS = 1
+    timer = timer or PhaseTimer()
 
     # Construct the body that the Batch API needs
     body = StartValidationBody(session.name,
@@ -207,24 +273,28 @@ async def start_validation(session: Session, starter: str) -> None:
                                session.storage.get_table_sas_uri(MAX_PROCESSING_TIME_HOURS),
                                deserialize(session.configuration))
 
-    # Call the Validation kick-off Batch API
-    session.validation.task_id = call_batch_activity_start_api(body, session.name, SessionActivity.VALIDATION)
-
-    # Update the session's state, and save the Session now in case the next part fails
-    session.remove_state(SessionState.STOPPED)
-    session.remove_state(SessionState.VALIDATION_COMPLETED)
-    session.add_state(SessionState.READY_TO_RUN)  # In case we are coming from the stopped state
-    session.add_state(SessionState.VALIDATION_RUNNING)
-    await save_session(session, starter)
-
-    # Create an orchestrator to wait for Validation to complete
-    session.validation.orchestrator_id = await create_orchestrator(starter,
-                                                                   session.name,
-                                                                   session.validation.task_id,
-                                                                   completion_state_add=SessionState.VALIDATION_COMPLETED,
-                                                                   completion_state_remove=SessionState.VALIDATION_RUNNING,
-                                                                   activity=SessionActivity.VALIDATION)
-
-    # Update and save the Session
-    session.touched()
-    await save_session(session, starter)
+    # Let the runner report completion with a callback, if enabled
+    instance_id = prepare_callback(body)
+
+    # The Session is saved once, when the block exits, even if creating the orchestrator fails
+    async with SessionUnitOfWork(session, starter):
+        # Call the Validation kick-off Batch API
+        with timer.phase("runner"):
+            session.validation.task_id = await asyncio.to_thread(call_batch_activity_start_api, body, session.name, SessionActivity.VALIDATION)
+
+        # Update the session's state
+        session.remove_state(SessionState.STOPPED)
+        session.remove_state(SessionState.VALIDATION_COMPLETED)
+        session.add_state(SessionState.READY_TO_RUN)  # In case we are coming from the stopped state
+        session.add_state(SessionState.VALIDATION_RUNNING)
+
+        # Create an orchestrator to wait for Validation to complete
+        with timer.phase("orchestrator"):
+            session.validation.orchestrator_id = await create_orchestrator(starter,
+                                                                           session.name,
+                                                                           session.validation.task_id,
+                                                                           completion_state_add=SessionState.VALIDATION_COMPLETED,
+                                                                           completion_state_remove=SessionState.VALIDATION_RUNNING,
+                                                                           activity=SessionActivity.VALIDATION,
+                                                                           instance_id=instance_id)
+        session.touched()
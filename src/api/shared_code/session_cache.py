@@ -0,0 +1,102 @@
+# +----------------------------------------------------------------------------
+# | Copyright (c) 2022 Pivotal Commware
+# | All rights reserved.
+# +----------------------------------------------------------------------------
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from .utilities import get_environment_variable
+
+
+DEFAULT_MAX_ENTRIES = 256
+DEFAULT_TTL_SECONDS = 10
+
+
+class SessionCache:
+    """
+    Per-worker LRU cache of sessions' encoded JSON state, keyed by session name, with a time-to-live.
+    The encoded JSON is cached rather than the Session object, so every reader decodes its own private copy.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        """
+        Constructor.
+        :param int max_entries: the most sessions to keep; the least recently used are evicted first
+        :param float ttl_seconds: how long an entry may be served before it must be read again from its Durable Entity
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.entries     = OrderedDict()  # session name -> (expiry, encoded session)
+        self.lock        = threading.Lock()
+        self.hits        = 0
+        self.misses      = 0
+        self.evictions   = 0
+
+
+    def get(self, session_name: str) -> Optional[str]:
+        """
+        Gets the cached encoded state of the specified session.
+        :param str session_name: the name of the session
+        :returns: the encoded session, or None if it is not cached or has expired
+        """
+        with self.lock:
+            entry = self.entries.get(session_name)
+            if (entry is None or entry[0] < time.monotonic()):
+                if (entry is not None):
+                    del self.entries[session_name]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(session_name)
+            self.hits += 1
+            return entry[1]
+
+
+    def put(self, session_name: str, session_json: str) -> None:
+        """
+        Caches the encoded state of the specified session, replacing any previous entry.
+        :param str session_name: the name of the session
+        :param str session_json: the encoded session
+        """
+        if (self.max_entries <= 0):
+            return
+        with self.lock:
+            self.entries[session_name] = (time.monotonic() + self.ttl_seconds, session_json)
+            self.entries.move_to_end(session_name)
+            while (len(self.entries) > self.max_entries):
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+
+    def invalidate(self, session_name: str) -> None:
+        """
+        Removes the specified session from the cache, if it is there.
+        :param str session_name: the name of the session
+        """
+        with self.lock:
+            self.entries.pop(session_name, None)
+
+
+    def stats(self) -> dict:
+        """
+        Gets the cache's counters.
+        :returns dict: the number of "entries", "hits", "misses" and "evictions"
+        """
+        with self.lock:
+            return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+
+def _make_session_cache() -> SessionCache:
+    """
+    Creates the worker's session cache, sized by the SESSION_CACHE_MAX_ENTRIES and SESSION_CACHE_TTL_SECONDS environment variables.
+    Setting SESSION_CACHE_MAX_ENTRIES to 0 disables caching.
+    """
+    max_entries = get_environment_variable("SESSION_CACHE_MAX_ENTRIES")
+    ttl_seconds = get_environment_variable("SESSION_CACHE_TTL_SECONDS")
+    return SessionCache(int(max_entries) if max_entries is not None else DEFAULT_MAX_ENTRIES,
+                        float(ttl_seconds) if ttl_seconds is not None else DEFAULT_TTL_SECONDS)
+
+
+session_cache = _make_session_cache()
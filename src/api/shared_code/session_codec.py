@@ -0,0 +1,202 @@
+# +----------------------------------------------------------------------------
+# | Copyright (c) 2022 Pivotal Commware
+# | All rights reserved.
+# +----------------------------------------------------------------------------
+
+import json
+
+from .session import Session, SessionState
+from .session_activity import SessionActivity, SessionActivityInfo
+from .session_storage import SessionStorage
+from .batch_task_wait_orchestrator_input import BatchTaskWaitOrchestratorInput
+from .polling_schedule import PollingSchedule
+from .utilities import deserialize
+
+try:
+    import orjson  # optional, faster JSON backend
+except ImportError:
+    orjson = None
+
+
+# +-------------------------------------------------------------------------------------------
+# | Explicit JSON encoding of the objects persisted in Durable Functions state.
+# | Every encoded document carries CODEC_VERSION_KEY; documents without it are assumed to be
+# | the original jsonpickle format ("py/object" tags) and are decoded with jsonpickle.
+# | The optional orjson package, left out of requirements.txt, makes encoding and decoding
+# | faster; add "orjson" there to enable it. Either way the JSON decodes to the same data.
+# +-------------------------------------------------------------------------------------------
+CODEC_VERSION_KEY = "codec_version"
+CODEC_VERSION     = 1
+
+
+def dumps(obj: object) -> str:
+    """
+    Converts plain Python data (dict, list, str, numbers, bool, None) into a compact JSON string.
+    :param object obj: the data to convert
+    :returns str: the JSON string
+    """
+    if (orjson is not None):
+        return orjson.dumps(obj).decode("utf-8")
+    return json.dumps(obj, separators=(",", ":"))
+
+
+def loads(text) -> object:
+    """
+    Converts a JSON string into plain Python data.
+    :param text: the JSON string (str or bytes)
+    :returns object: the data
+    """
+    if (orjson is not None):
+        return orjson.loads(text)
+    return json.loads(text)
+
+
+def is_legacy(data: object) -> bool:
+    """
+    Determines whether or not the decoded JSON data was written by jsonpickle rather than by this codec.
+    :param object data: the decoded JSON data
+    :returns bool: True if the data is in the jsonpickle format, False otherwise
+    """
+    return not (isinstance(data, dict) and CODEC_VERSION_KEY in data)
+
+
+def activity_info_to_dict(info: SessionActivityInfo) -> dict:
+    "Converts a SessionActivityInfo into plain data"
+    return {
+        "task_id": info.task_id,
+        "orchestrator_id": info.orchestrator_id,
+        "execution_info": info.execution_info
+    }
+
+
+def activity_info_from_dict(data: dict) -> SessionActivityInfo:
+    "Converts plain data back into a SessionActivityInfo"
+    return SessionActivityInfo(data["task_id"], data["orchestrator_id"], data["execution_info"])
+
+
+def storage_to_dict(storage: SessionStorage) -> dict:
+    "Converts a SessionStorage into plain data"
+    return {
+        "blob_container": storage.blob_container,
+        "table": storage.table,
+        "direct_link_container": storage.direct_link_container,
+        "direct_link_table": storage.direct_link_table
+    }
+
+
+def storage_from_dict(data: dict) -> SessionStorage:
+    "Converts plain data back into a SessionStorage, without recomputing its links"
+    storage = SessionStorage.__new__(SessionStorage)
+    storage.blob_container        = data["blob_container"]
+    storage.table                 = data["table"]
+    storage.direct_link_container = data["direct_link_container"]
+    storage.direct_link_table     = data["direct_link_table"]
+    return storage
+
+
+def session_to_dict(session: Session) -> dict:
+    """
+    Converts a Session into plain data.
+    The keys and their order match the public JSON representation of a Session returned by the API.
+    :param Session session: the session to convert
+    :returns dict: the plain data
+    """
+    return {
+        "version": session.version,
+        "name": session.name,
+        "iteration_names": list(session.iteration_names),
+        "created_by": session.created_by,
+        "created": session.created,
+        "updated": session.updated,
+        "states": sorted(session.states),
+        "storage": storage_to_dict(session.storage),
+        "configuration": session.configuration,
+        "nearmap": activity_info_to_dict(session.nearmap),
+        "validation": activity_info_to_dict(session.validation),
+        "wavescape": activity_info_to_dict(session.wavescape)
+    }
+
+
+def session_from_dict(data: dict) -> Session:
+    """
+    Converts plain data back into a Session, without running the constructor's defaults.
+    :param dict data: the plain data, as produced by session_to_dict()
+    :returns Session: the session
+    """
+    session = Session.__new__(Session)
+    session.version         = data["version"]
+    session.name            = data["name"]
+    session.iteration_names = list(data["iteration_names"])
+    session.created_by      = data["created_by"]
+    session.created         = data["created"]
+    session.updated         = data["updated"]
+    session.states          = set(data["states"])
+    session.storage         = storage_from_dict(data["storage"])
+    session.configuration   = data["configuration"]
+    session.nearmap         = activity_info_from_dict(data["nearmap"])
+    session.validation      = activity_info_from_dict(data["validation"])
+    session.wavescape       = activity_info_from_dict(data["wavescape"])
+    return session
+
+
+def encode_session(session: Session) -> str:
+    """
+    Converts a Session into its versioned JSON string for persisting in its Durable Entity.
+    :param Session session: the session to convert
+    :returns str: the JSON string
+    """
+    return dumps({CODEC_VERSION_KEY: CODEC_VERSION, **session_to_dict(session)})
+
+
+def decode_session(text: str) -> Session:
+    """
+    Converts a JSON string back into a Session; accepts both this codec's format and the original jsonpickle format.
+    :param str text: the JSON string
+    :returns Session: the session
+    """
+    data = loads(text)
+    if (is_legacy(data)):
+        return deserialize(text)
+    return session_from_dict(data)
+
+
+def encode_orchestrator_input(input: BatchTaskWaitOrchestratorInput) -> str:
+    """
+    Converts the batch task wait orchestrator's input into its versioned JSON string.
+    :param BatchTaskWaitOrchestratorInput input: the orchestrator input
+    :returns str: the JSON string
+    """
+    return dumps({
+        CODEC_VERSION_KEY: CODEC_VERSION,
+        "session_name": input.session_name,
+        "activity": input.activity.name,
+        "batch_task_id": input.batch_task_id,
+        "completion_state_add": input.completion_state_add.name,
+        "completion_state_remove": input.completion_state_remove.name,
+        "check_interval_seconds": input.check_interval_seconds,
+        "schedule": input.schedule.to_dict() if input.schedule is not None else None,
+        "checks_done": input.checks_done,
+        "started": input.started,
+        "callback_fallback_seconds": input.callback_fallback_seconds
+    })
+
+
+def decode_orchestrator_input(text: str) -> BatchTaskWaitOrchestratorInput:
+    """
+    Converts a JSON string back into the batch task wait orchestrator's input; accepts both this codec's format and the original jsonpickle format.
+    :param str text: the JSON string
+    :returns BatchTaskWaitOrchestratorInput: the orchestrator input
+    """
+    data = loads(text)
+    if (is_legacy(data)):
+        return deserialize(text)
+    return BatchTaskWaitOrchestratorInput(data["session_name"],
+                                          SessionActivity[data["activity"]],
+                                          data["batch_task_id"],
+                                          SessionState[data["completion_state_add"]],
+                                          SessionState[data["completion_state_remove"]],
+                                          data["check_interval_seconds"],
+                                          PollingSchedule.from_dict(data["schedule"]) if data.get("schedule") is not None else None,
+                                          data.get("checks_done", 0),
+                                          data.get("started"),
+                                          data.get("callback_fallback_seconds"))
@@ -9,9 +9,20 @@ from typing import Optional
 from azure.durable_functions import DurableOrchestrationClient
 import azure.durable_functions as df
 
-from ..shared_code.session_storage import get_table_service_client
+from .session_storage_async import get_async_table_service_client
 from .session import Session
-from .utilities import serialize, deserialize
+from .session_codec import encode_session, decode_session, dumps, loads, session_from_dict, session_to_dict
+from .session_delta import APPLY_OPERATION, apply_delta, diff_session
+from .session_index import upsert_session_summary
+from .session_cache import session_cache
+
+
+DE_TABLE_NAME = "DurableTaskInstances"
+
+# Session entity rows are the ones whose PartitionKey starts with "@df_entity_session@"; "A" is the character after "@"
+SESSION_ENTITY_FILTER = "PartitionKey ge @first and PartitionKey lt @last"
+SESSION_ENTITY_FILTER_PARAMETERS = {"first": "@df_entity_session@", "last": "@df_entity_sessionA"}
+SESSION_ENTITY_COLUMNS = ["Input"]
 
 
 def make_entity_id(session_name: str) -> df.EntityId:
@@ -26,37 +37,152 @@ def make_entity_id(session_name: str) -> df.EntityId:
 
 async def save_session(session: Session, starter: str) -> None:
     """
-    Save the session object as a Durable Entity (DE).
+    Save the session object as a Durable Entity (DE), and its summary in the session index.
+    The worker's session cache is updated too (write-through).
     :param Session session: the session object to persist
     :param str starter: the context
     """
     client = DurableOrchestrationClient(starter)
     entityId = make_entity_id(session.name)
-    session_json = serialize(session)
+    session_json = encode_session(session)
     await client.signal_entity(entityId, operation_name="save", operation_input=session_json)
+    session_cache.put(session.name, session_json)
+    await upsert_session_summary(session)
 
 
-async def get_session(session_name: str, starter: str) -> Optional[Session]:
+class SessionUnitOfWork:
     """
-    Retrieve the session data (pickleable JSON) from its Durable Entity (DE).
+    Tracks the changes made to a Session and saves them as a single entity operation at the commit point,
+    instead of saving after every intermediate step.
+    The changes are sent as deltas when possible, so concurrent changes to other parts of the session are not overwritten.
+    Used as an async context manager, the commit point is the end of the "async with" block, reached normally or by an exception,
+    so whatever was recorded before a failure (e.g. the id of a batch task that was started) is still persisted.
+    """
+
+    def __init__(self, session: Session, starter: str, snapshot: Optional[dict] = None):
+        """
+        Constructor.
+        :param Session session: the session whose changes to track
+        :param str starter: the context
+        :param dict snapshot: the session as it was before any of the changes, from session_to_dict(), if changes were made before tracking started;
+                              optional, default is None (the session as it is now)
+        """
+        self.session  = session
+        self.starter  = starter
+        self.snapshot = snapshot if (snapshot is not None) else session_to_dict(session)
+
+
+    def is_dirty(self) -> bool:
+        """
+        Determines whether the session has changed since the last commit (or since tracking started).
+        :returns bool: True if there are changes to save, False otherwise
+        """
+        return session_to_dict(self.session) != self.snapshot
+
+
+    async def commit(self) -> bool:
+        """
+        Saves the session if it has changed.
+        :returns bool: True if the session was saved, False if there was nothing to save
+        """
+        current = session_to_dict(self.session)
+        if (current == self.snapshot):
+            return False
+        deltas = diff_session(self.snapshot, current)
+        if (deltas is None):
+            await save_session(self.session, self.starter)
+        else:
+            await update_session(self.session.name, deltas, self.starter, session_from_dict(self.snapshot))
+        self.snapshot = current
+        return True
+
+
+    async def __aenter__(self) -> Session:
+        return self.session
+
+
+    async def __aexit__(self, exc_type, exc, traceback) -> bool:
+        await self.commit()
+        return False  # never swallow the exception
+
+
+async def get_session(session_name: str, starter: str, consistent: bool = False) -> Optional[Session]:
+    """
+    Retrieve the session data (pickleable JSON) from its Durable Entity (DE), or from the worker's session cache.
     :param str session_name: the name of the session for which to retrieve its JSON
     :param str starter: the context
+    :param bool consistent: whether to bypass the cache and always read the Durable Entity; optional, default is False
     :returns: Session object or None
     """
+    if (not consistent):
+        session_json = session_cache.get(session_name)
+        if (session_json is not None):
+            return decode_session(session_json)
+
     client = DurableOrchestrationClient(starter)
     entityId = make_entity_id(session_name)
     entity_state_response = await client.read_entity_state(entityId)
     entity_state = None
     if (entity_state_response.entity_exists):
-        entity_state = deserialize(str(entity_state_response.entity_state))
+        session_json = str(entity_state_response.entity_state)
+        entity_state = decode_session(session_json)
+        session_cache.put(session_name, session_json)
+    else:
+        session_cache.invalidate(session_name)
     return entity_state
 
 
-async def get_all_sessions(starter: str) -> list:
+async def update_session(session_name: str, deltas: list, starter: str, session: Optional[Session] = None) -> None:
     """
-    Retrieve all the sessions' data from all the Durable Entities.
+    Applies small changes to the session inside its Durable Entity, as one entity operation, instead of overwriting the whole session.
+    The session index is updated here, like save_session() does, so the entity itself does no I/O; the worker's cached copy of the session is dropped.
+    :param str session_name: the name of the session to change
+    :param list deltas: the changes, as built by the functions of the session_delta module, applied in order
     :param str starter: the context
-    :returns list: a list of Session objects
+    :param Session session: the caller's copy of the session, before the changes, to summarize in the index; it is not changed;
+                            optional, default is None (read the session)
+    """
+    if (not deltas):
+        return
+    client = DurableOrchestrationClient(starter)
+    entityId = make_entity_id(session_name)
+    await client.signal_entity(entityId, operation_name=APPLY_OPERATION, operation_input=dumps(deltas))
+    session_cache.invalidate(session_name)
+
+    # The entity may not have applied the changes yet, so apply them to a copy; applying any of them twice gives the same summary
+    summarized = session_from_dict(session_to_dict(session)) if (session is not None) else await get_session(session_name, starter, consistent=True)
+    if (summarized is None):
+        return
+    for delta in deltas:
+        apply_delta(summarized, delta)
+    await upsert_session_summary(summarized)
+
+
+def invalidate_cached_session(session_name: str) -> None:
+    """
+    Removes the specified session from the worker's session cache, so its next read goes to its Durable Entity.
+    :param str session_name: the name of the session
+    """
+    session_cache.invalidate(session_name)
+
+
+def session_from_instance(instance: dict) -> Session:
+    """
+    Extracts the Session object from a session entity row of the Durable Functions instances table.
+    :param dict instance: the table row, with at least its "Input" column
+    :returns Session: the session object
+    """
+    input_column = loads(instance["Input"])
+    return decode_session(loads(input_column["state"]))  # yes, twice, because the state JSON string is wrapped in single quotes
+
+
+async def iter_session_pages(page_size: Optional[int] = None, continuation_token: Optional[dict] = None):
+    """
+    Retrieves the sessions' data from the Durable Entities, one page at a time.
+    Only the session entity rows, and only their "Input" column, are fetched; the filtering happens in table storage.
+    :param int page_size: the maximum number of sessions per page; optional, default is the storage service's maximum (1000)
+    :param dict continuation_token: where to resume a previous listing; optional, default is from the start
+    :returns AsyncGenerator: an async generator of a (list of Session objects, continuation token or None) 'tuple'
     """
     # +-------------------------------------------------------------------------------------------
     # | You would think that you can do the following according to the Microsoft documentation:
@@ -67,32 +193,43 @@ async def get_all_sessions(starter: str) -> list:
     #       - get_status_by()
     # | return only the first 100 instances and there is no paging mechanism in the Python SDK.
     # +-------------------------------------------------------------------------------------------
+    client = get_async_table_service_client().get_table_client(DE_TABLE_NAME)
+    pages = client.query_entities(SESSION_ENTITY_FILTER,
+                                  parameters=SESSION_ENTITY_FILTER_PARAMETERS,
+                                  select=SESSION_ENTITY_COLUMNS,
+                                  results_per_page=page_size).by_page(continuation_token=continuation_token)
+    async for page in pages:
+        sessions = [session_from_instance(instance) async for instance in page]
+        yield sessions, pages.continuation_token
 
-    DE_TABLE_NAME = "DurableTaskInstances"
-    all_instances = list(get_table_service_client().get_table_client(DE_TABLE_NAME).list_entities())
 
-    sessions = []  # A list of Session objects
-    logging.info(f"Found {len(all_instances)} total durable instances")
-    for instance in all_instances:
-        if (instance["PartitionKey"].startswith("@df_entity_session@")):  # ignore orchestrators
-            input_column = deserialize(instance["Input"])
-            obj = deserialize(deserialize(input_column["state"]))  # yes, twice, because the state JSON string is wrapped in single quotes
-            sessions.append(obj)
-    logging.info(f"Returning {len(sessions)} sessions; others were orchestrators")
-    return sessions
+async def get_all_sessions(starter: str) -> list:
+    """
+    Retrieve all the sessions' data from all the Durable Entities.
+    :param str starter: the context
+    :returns list: a list of Session objects
+    """
+    all_sessions = []  # A list of Session objects
+    async for sessions, _ in iter_session_pages():
+        all_sessions.extend(sessions)
+    logging.info(f"Returning {len(all_sessions)} sessions")
+    return all_sessions
 
 
-async def terminate_orchestrator(orchestrator_id: str, reason: str, starter: str) -> None:
+async def terminate_orchestrator(orchestrator_id: str, reason: str, starter: str) -> bool:
     """
     Terminates the specified orchestrator, providing the specified reason.
     :param str orchestrator_id: The instance id of the orchestrator.
     :param str reason: The reason for terminating this orchestrator.
     :param str starter: The context.
+    :returns bool: True if the orchestrator was terminated, False otherwise
     """
     client = df.DurableOrchestrationClient(starter)
     try:
         await client.terminate(orchestrator_id, reason)
         logging.info(f"orchestrator termination successful, id={orchestrator_id}, reason={reason}")
+        return True
     except Exception as ex:
         #  This may happen if the session is stopped after a completed orchestrator has already been automatically removed by the Azure DF system.
         logging.warning(f"orchestrator termination failed with an unexpected status code, id={orchestrator_id}, exception=\n{repr(ex)}")
+        return False
@@ -0,0 +1,138 @@
+# +----------------------------------------------------------------------------
+# | Copyright (c) 2022 Pivotal Commware
+# | All rights reserved.
+# +----------------------------------------------------------------------------
+
+from typing import Optional
+
+from .session import Session, SessionState
+from .session_activity import SessionActivity
+
+
+# +-------------------------------------------------------------------------------------------
+# | Small changes ("deltas") to a Session, applied inside its Durable Entity, so callers do not
+# | have to read, modify and re-save the whole Session, and concurrent changes do not overwrite
+# | each other.  A delta is a {"operation": ..., "input": ...} dictionary of plain JSON data.
+# +-------------------------------------------------------------------------------------------
+ADD_STATE_OPERATION         = "add_state"
+REMOVE_STATE_OPERATION      = "remove_state"
+SET_STATE_OPERATION         = "set_state"
+SET_ACTIVITY_INFO_OPERATION = "set_activity_info"
+APPEND_ITERATION_OPERATION  = "append_iteration"
+SET_CONFIGURATION_OPERATION = "set_configuration"
+APPLY_OPERATION             = "apply"  # applies a list of deltas, in order, as one entity operation
+
+DELTA_OPERATIONS = [
+    ADD_STATE_OPERATION,
+    REMOVE_STATE_OPERATION,
+    SET_STATE_OPERATION,
+    SET_ACTIVITY_INFO_OPERATION,
+    APPEND_ITERATION_OPERATION,
+    SET_CONFIGURATION_OPERATION
+]
+
+
+def add_state(state: SessionState) -> dict:
+    "Delta adding the specified state to the session's set of states"
+    return {"operation": ADD_STATE_OPERATION, "input": state.name}
+
+
+def remove_state(state: SessionState) -> dict:
+    "Delta removing the specified state from the session's set of states"
+    return {"operation": REMOVE_STATE_OPERATION, "input": state.name}
+
+
+def set_state(state: SessionState) -> dict:
+    "Delta making the specified state the session's only state"
+    return {"operation": SET_STATE_OPERATION, "input": state.name}
+
+
+def set_activity_info(activity: SessionActivity,
+                      task_id: Optional[str] = None,
+                      orchestrator_id: Optional[str] = None,
+                      execution_info: Optional[str] = None) -> dict:
+    "Delta setting the specified (non-None) fields of one of the session's activity infos"
+    fields = {"task_id": task_id, "orchestrator_id": orchestrator_id, "execution_info": execution_info}
+    input = {name: value for name, value in fields.items() if value is not None}
+    input["activity"] = activity.name
+    return {"operation": SET_ACTIVITY_INFO_OPERATION, "input": input}
+
+
+def append_iteration(iteration_name: str) -> dict:
+    "Delta appending an iteration name, unless it is already the current one"
+    return {"operation": APPEND_ITERATION_OPERATION, "input": iteration_name}
+
+
+def set_configuration(configuration: str) -> dict:
+    "Delta replacing the session's (serialized) configuration"
+    return {"operation": SET_CONFIGURATION_OPERATION, "input": configuration}
+
+
+def apply_delta(session: Session, delta: dict) -> None:
+    """
+    Applies one delta to the session.
+    :param Session session: the session to change
+    :param dict delta: the delta, as built by the functions of this module
+    :raises ValueError: if the delta's operation is unknown
+    """
+    operation = delta["operation"]
+    input = delta["input"]
+
+    if (operation == ADD_STATE_OPERATION):
+        session.add_state(SessionState[input])
+    elif (operation == REMOVE_STATE_OPERATION):
+        session.remove_state(SessionState[input])
+    elif (operation == SET_STATE_OPERATION):
+        session.set_state(SessionState[input])
+    elif (operation == SET_ACTIVITY_INFO_OPERATION):
+        info = session.activity_info(SessionActivity[input["activity"]])
+        for field in ("task_id", "orchestrator_id", "execution_info"):
+            if (field in input):
+                setattr(info, field, input[field])
+        session.touched()
+    elif (operation == APPEND_ITERATION_OPERATION):
+        if (input != session.current_iteration_name()):
+            session.iteration_names.append(input)
+        session.touched()
+    elif (operation == SET_CONFIGURATION_OPERATION):
+        session.configuration = input
+        session.touched()
+    else:
+        raise ValueError(f"Unexpected session delta operation: {operation}")
+
+
+def diff_session(before: dict, after: dict) -> Optional[list]:
+    """
+    Expresses the changes between two versions of a session as a list of deltas.
+    :param dict before: the earlier version, as produced by session_codec.session_to_dict()
+    :param dict after: the later version, as produced by session_codec.session_to_dict()
+    :returns: the list of deltas (empty if nothing changed), or None if the changes cannot be expressed as deltas
+    """
+    DELTA_FIELDS = ["iteration_names", "configuration", "states", "updated"] + [activity.name.lower() for activity in SessionActivity]
+    if (any(before[key] != after[key] for key in after if key not in DELTA_FIELDS)):
+        return None
+
+    deltas = []
+
+    iterations_before = before["iteration_names"]
+    iterations_after = after["iteration_names"]
+    if (iterations_after[:len(iterations_before)] != iterations_before):
+        return None
+    deltas.extend(append_iteration(name) for name in iterations_after[len(iterations_before):])
+
+    if (before["configuration"] != after["configuration"]):
+        deltas.append(set_configuration(after["configuration"]))
+
+    for activity in SessionActivity:
+        info_before = before[activity.name.lower()]
+        info_after = after[activity.name.lower()]
+        changed = {field: value for field, value in info_after.items() if info_before.get(field) != value}
+        if (changed):
+            deltas.append(set_activity_info(activity, **changed))
+
+    states_before = set(before["states"])
+    states_after = set(after["states"])
+    deltas.extend(remove_state(SessionState[name]) for name in sorted(states_before - states_after))
+    deltas.extend(add_state(SessionState[name]) for name in sorted(states_after - states_before))
+
+    return deltas
@@ -0,0 +1,198 @@
+# +----------------------------------------------------------------------------
+# | Copyright (c) 2022 Pivotal Commware
+# | All rights reserved.
+# +----------------------------------------------------------------------------
+
+import logging
+from typing import Optional
+
+from azure.core.exceptions import ResourceExistsError, ResourceNotFoundError
+from azure.data.tables import UpdateMode
+
+from .session import Session, SessionState
+from .session_storage_async import get_async_table_service_client
+from .utilities import is_none_or_whitespace
+
+
+# +-------------------------------------------------------------------------------------------
+# | The session index is a small Azure table holding one summary row per session, written on
+# | every save_session(), so that listing and looking up sessions does not require reading
+# | and decoding each session's full Durable Entity state.
+# +-------------------------------------------------------------------------------------------
+SESSION_INDEX_TABLE_NAME = "SessionIndex"
+SESSION_INDEX_PARTITION  = "sessions"
+
+# Marks that the sessions which existed before the index was introduced have been added to it
+BACKFILL_MARKER_PARTITION = "index"
+BACKFILL_MARKER_ROW       = "backfill"
+
+STATE_COLUMN_PREFIX = "state_"  # one Boolean column per SessionState, so states can be filtered on in table storage
+SUMMARY_COLUMNS = ["name", "created_by", "created", "updated", "states", "current_iteration", "nearmap_task_id", "validation_task_id", "wavescape_task_id"]
+
+_index_ready = False  # whether this worker has already made sure the index table exists and has been backfilled
+
+
+def state_column(state: SessionState) -> str:
+    """
+    Gets the name of the index column flagging whether a session is in the specified state.
+    :param SessionState state: the state
+    :returns str: the column name
+    """
+    return f"{STATE_COLUMN_PREFIX}{state.name}"
+
+
+def make_summary_entity(session: Session) -> dict:
+    """
+    Builds the index row summarizing the specified session.
+    :param Session session: the session to summarize
+    :returns dict: the table entity
+    """
+    entity = {
+        "PartitionKey": SESSION_INDEX_PARTITION,
+        "RowKey": session.name,
+        "name": session.name,
+        "created_by": session.created_by,
+        "created": session.created,
+        "updated": session.updated,
+        "states": ",".join(sorted(session.states)),
+        "current_iteration": session.current_iteration_name(),
+        "nearmap_task_id": session.nearmap.task_id,
+        "validation_task_id": session.validation.task_id,
+        "wavescape_task_id": session.wavescape.task_id
+    }
+    for state in SessionState:
+        entity[state_column(state)] = state.name in session.states
+    return entity
+
+
+def summary_from_entity(entity: dict) -> dict:
+    """
+    Converts an index row into the session summary returned by the API.
+    :param dict entity: the table entity
+    :returns dict: the session summary, with "states" as a list like the full session
+    """
+    summary = {column: entity.get(column) for column in SUMMARY_COLUMNS}
+    summary["states"] = [state for state in (entity.get("states") or "").split(",") if state]
+    return summary
+
+
+def build_summary_filter(created_by: Optional[str] = None, state: Optional[SessionState] = None, updated_since: Optional[str] = None) -> tuple:
+    """
+    Builds the table storage filter selecting the index rows matching all of the specified criteria.
+    :param str created_by: only sessions created by this user; optional
+    :param SessionState state: only sessions currently in this state; optional
+    :param str updated_since: only sessions updated at or after this ISO 8601 UTC time, e.g. "2022-02-01T00:00:00Z"; optional
+    :returns tuple: the filter string and its parameters
+    """
+    clauses = ["PartitionKey eq @partition"]
+    parameters = {"partition": SESSION_INDEX_PARTITION}
+    if (not is_none_or_whitespace(created_by)):
+        clauses.append("created_by eq @created_by")
+        parameters["created_by"] = created_by
+    if (state is not None):
+        clauses.append(f"{state_column(state)} eq true")
+    if (not is_none_or_whitespace(updated_since)):
+        clauses.append("updated ge @updated_since")
+        parameters["updated_since"] = updated_since
+    return " and ".join(clauses), parameters
+
+
+async def upsert_session_summary(session: Session) -> None:
+    """
+    Writes (or rewrites) the index row summarizing the specified session.
+    Failures are logged and swallowed; the Durable Entity remains the source of truth.
+    :param Session session: the session to summarize
+    """
+    client = get_async_table_service_client().get_table_client(SESSION_INDEX_TABLE_NAME)
+    try:
+        try:
+            await client.upsert_entity(make_summary_entity(session), mode=UpdateMode.REPLACE)
+        except ResourceNotFoundError:
+            await create_index_table()
+            await client.upsert_entity(make_summary_entity(session), mode=UpdateMode.REPLACE)
+    except Exception as ex:
+        logging.warning(f"Failed to update the session index for session \"{session.name}\", exception=\n{repr(ex)}")
+
+
+async def create_index_table() -> bool:
+    """
+    Creates the session index table, if it does not already exist.
+    :returns bool: True = table created, False = the table already exists
+    """
+    try:
+        await get_async_table_service_client().create_table(SESSION_INDEX_TABLE_NAME)
+        logging.info(f"Table created: {SESSION_INDEX_TABLE_NAME}")
+        return True
+    except ResourceExistsError:
+        return False
+
+
+async def ensure_session_index() -> None:
+    """
+    Makes sure the session index exists and includes the sessions saved before the index was introduced.
+    The backfill reads every session's Durable Entity once, ever; afterwards this is a no-op for the life of the worker.
+    """
+    global _index_ready
+    if (_index_ready):
+        return
+
+    from .session_de import iter_session_pages  # deferred, session_de depends on this module
+
+    await create_index_table()
+    client = get_async_table_service_client().get_table_client(SESSION_INDEX_TABLE_NAME)
+    try:
+        await client.get_entity(BACKFILL_MARKER_PARTITION, BACKFILL_MARKER_ROW)
+    except ResourceNotFoundError:
+        count = 0
+        async for sessions, _ in iter_session_pages():
+            for session in sessions:
+                # Do not overwrite rows written by save_session() while the backfill was running
+                try:
+                    await client.create_entity(make_summary_entity(session))
+                    count += 1
+                except ResourceExistsError:
+                    pass
+        await client.upsert_entity({"PartitionKey": BACKFILL_MARKER_PARTITION, "RowKey": BACKFILL_MARKER_ROW})
+        logging.info(f"Session index backfilled with {count} sessions")
+    _index_ready = True
+
+
+async def get_session_summary(session_name: str) -> Optional[dict]:
+    """
+    Looks up the summary of a single session in the index.
+    :param str session_name: the name of the session
+    :returns: the session summary, or None if the session is not in the index
+    """
+    await ensure_session_index()
+    client = get_async_table_service_client().get_table_client(SESSION_INDEX_TABLE_NAME)
+    try:
+        entity = await client.get_entity(SESSION_INDEX_PARTITION, session_name, select=SUMMARY_COLUMNS)
+    except ResourceNotFoundError:
+        return None
+    return summary_from_entity(entity)
+
+
+async def iter_session_summary_pages(created_by: Optional[str] = None,
+                                     state: Optional[SessionState] = None,
+                                     updated_since: Optional[str] = None,
+                                     page_size: Optional[int] = None,
+                                     continuation_token: Optional[dict] = None):
+    """
+    Retrieves the summaries of the sessions matching all of the specified criteria from the index, one page at a time.
+    :param str created_by: only sessions created by this user; optional
+    :param SessionState state: only sessions currently in this state; optional
+    :param str updated_since: only sessions updated at or after this ISO 8601 UTC time; optional
+    :param int page_size: the maximum number of summaries per page; optional, default is the storage service's maximum (1000)
+    :param dict continuation_token: where to resume a previous listing; optional, default is from the start
+    :returns AsyncGenerator: an async generator of a (list of session summaries, continuation token or None) 'tuple'
+    """
+    await ensure_session_index()
+    query_filter, parameters = build_summary_filter(created_by, state, updated_since)
+    client = get_async_table_service_client().get_table_client(SESSION_INDEX_TABLE_NAME)
+    pages = client.query_entities(query_filter,
+                                  parameters=parameters,
+                                  select=SUMMARY_COLUMNS,
+                                  results_per_page=page_size).by_page(continuation_token=continuation_token)
+    async for page in pages:
+        summaries = [summary_from_entity(entity) async for entity in page]
+        yield summaries, pages.continuation_token
@@ -5,15 +5,25 @@
 
 from datetime import timedelta
 import datetime
+import gzip
 import logging
+import threading
+import zlib
+from dataclasses import dataclass
+from enum import Enum, unique, auto
+from typing import Optional
 from urllib.parse import urlencode
 
-from azure.core.exceptions import ResourceExistsError, ResourceNotFoundError
-from azure.storage.blob import BlobServiceClient, generate_container_sas, ContainerSasPermissions
+import requests
+from requests.adapters import HTTPAdapter
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceExistsError, ResourceModifiedError, ResourceNotFoundError
+from azure.core.pipeline.transport import RequestsTransport
+from azure.storage.blob import BlobProperties, BlobSasPermissions, BlobServiceClient, ContentSettings, generate_blob_sas, generate_container_sas, ContainerSasPermissions
 from azure.data.tables import TableServiceClient, generate_table_sas, TableSasPermissions
 from azure.core.credentials import AzureNamedKeyCredential
 
-from ..shared_code.utilities import get_environment_variable
+from ..shared_code.utilities import get_environment_variable, str_to_bool
 
 
 AZURITE_PORT = {"blob": 10000, "table": 10002}
@@ -22,9 +32,70 @@ AOI_BLOB_PATH       = "setup/aoi.gpkg"
 RAW_SITES_BLOB_PATH = "setup/raw_sites.csv"
 SITES_BLOB_PATH     = "setup/sites.geojson"
 
+SITES_TABLE_CHECKPOINT_BLOB_PATH = "setup/sites_table_checkpoint.json"  # only while the sites table upload is incomplete
+
+LOG_FILES           = {"std_out": "stdout.txt", "std_err": "stderr.txt"}  # the batch tasks' log files, by their key in API responses
+LOG_TAIL_CHUNK_SIZE = 64 * 1024  # when tailing a log by lines, how much more of it to read at a time
+
 RESOURCE_TYPE_BLOB_CONTAINER = "Azure.BlobContainer"
 RESOURCE_TYPE_TABLE = "Azure.Table"
 
+DEFAULT_CONNECTION_POOL_SIZE = 20
+STORAGE_ENDPOINTS            = 2  # blob and table; one connection pool per host
+
+# Uploads larger than the single put size are split into blocks, uploaded in parallel, then committed as a block list
+MEGABYTE                       = 1024 * 1024
+DEFAULT_UPLOAD_BLOCK_SIZE_MB   = 4
+DEFAULT_UPLOAD_SINGLE_PUT_MB   = 8
+DEFAULT_UPLOAD_CONCURRENCY     = 4
+
+READ_PERMISSION_PARAM  = "read"
+READ_WINDOW            = timedelta(minutes=15)
+WRITE_PERMISSION_PARAM = "write"
+WRITE_WINDOW           = timedelta(minutes=15)
+
+GZIP_ENCODING = "gzip"  # the Content-Encoding of blobs stored compressed, see is_gzip_at_rest_enabled()
+
+
+@unique
+class SaveFileOutcome(Enum):
+    CREATED     = auto()  # the blob did not exist
+    OVERWRITTEN = auto()  # the blob existed and was replaced
+    SAVED       = auto()  # the blob was created or replaced, whichever it was; an unconditional upload cannot tell
+    CONFLICT    = auto()  # the blob existed (or no longer had the expected ETag) and was left alone
+
+
+@dataclass
+class SaveFileResult:
+    """
+    The result of saving a file with save_file().
+    outcome: whether the blob was created, overwritten (or either, when saved unconditionally) or left alone
+    etag:    the ETag of the blob as written, or None if nothing was written
+    """
+    outcome: SaveFileOutcome
+    etag: Optional[str] = None
+
+    @property
+    def conflict(self) -> bool:
+        "Whether or not the blob was left alone because it already existed"
+        return self.outcome == SaveFileOutcome.CONFLICT
+
+
+def log_file_saved(blob_container: str, blob_path: str, result: SaveFileResult) -> None:
+    "Logs the result of saving a file"
+    if (result.conflict):
+        logging.info(f"File not saved \"/{blob_container}/{blob_path}\", it already exists")
+    else:
+        overwritten: str = " (overwritten)" if (result.outcome == SaveFileOutcome.OVERWRITTEN) else ""
+        logging.info(f"File saved \"/{blob_container}/{blob_path}\"{overwritten}")
+
+
+# Process-wide storage clients, created on first use and shared by every function invocation in this worker
+_client_lock = threading.Lock()
+_http_session: Optional[requests.Session] = None
+_blob_service_client: Optional[BlobServiceClient] = None
+_table_service_client: Optional[TableServiceClient] = None
+
 
 def get_storage_account_name() -> str:
     """
@@ -57,21 +128,187 @@ def get_account_uri(type: str) -> str:
         return f"https://{account_name}.{type}.core.windows.net"
 
 
+def generate_link(container_name: str, blob_name: str, permission: str) -> str:
+    """
+    Generates the SAS URI for accessing the specified resource with the specified permission.
+    Requires the 'STORAGE_ACCOUNT_NAME' and 'STORAGE_ACCOUNT_ACCESS_KEY' environment variables to be set appropriately.
+    :param str container_name: the name of the session
+    :param str blob_name: the path to the blob, e.g. 'path/file_name.txt'
+    :param str permission: the requested access right; must be either "read" or "write"
+    :returns str: a limited-time SAS URI for the blob
+    """
+    if (permission == READ_PERMISSION_PARAM):
+        sas_permission = BlobSasPermissions(read=True)
+        sas_duration = READ_WINDOW
+    elif (permission == WRITE_PERMISSION_PARAM):
+        sas_permission = BlobSasPermissions(write=True)
+        sas_duration = WRITE_WINDOW
+    else:
+        raise ValueError(f"Unexpected permission param: {permission}")
+
+    sas = generate_blob_sas(account_name=get_storage_account_name(),
+                            container_name=container_name,
+                            blob_name=blob_name,
+                            account_key=get_storage_account_key(),
+                            permission=sas_permission,
+                            expiry=datetime.datetime.utcnow() + sas_duration)
+
+    return f"{get_account_uri('blob')}/{container_name}/{blob_name}?{sas}"
+
+
+def get_connection_pool_size() -> int:
+    """
+    Gets the maximum number of connections to keep alive per storage endpoint.
+    Can be tuned with the STORAGE_CONNECTION_POOL_SIZE environment variable.
+    :returns int: the connection pool size
+    """
+    pool_size = get_environment_variable("STORAGE_CONNECTION_POOL_SIZE")
+    return int(pool_size) if pool_size is not None else DEFAULT_CONNECTION_POOL_SIZE
+
+
+def get_upload_client_settings() -> dict:
+    """
+    Gets the blob service client's upload settings: when to split an upload into blocks, and how big the blocks are.
+    Can be tuned with the STORAGE_UPLOAD_SINGLE_PUT_SIZE_MB and STORAGE_UPLOAD_BLOCK_SIZE_MB environment variables.
+    :returns dict: the keyword arguments for the BlobServiceClient constructor
+    """
+    single_put_mb = get_environment_variable("STORAGE_UPLOAD_SINGLE_PUT_SIZE_MB")
+    block_size_mb = get_environment_variable("STORAGE_UPLOAD_BLOCK_SIZE_MB")
+    return {
+        "max_single_put_size": int(float(single_put_mb if single_put_mb is not None else DEFAULT_UPLOAD_SINGLE_PUT_MB) * MEGABYTE),
+        "max_block_size": int(float(block_size_mb if block_size_mb is not None else DEFAULT_UPLOAD_BLOCK_SIZE_MB) * MEGABYTE)
+    }
+
+
+def get_upload_concurrency() -> int:
+    """
+    Gets how many blocks of a large upload are uploaded at the same time.
+    Can be tuned with the STORAGE_UPLOAD_CONCURRENCY environment variable.
+    :returns int: the number of parallel block uploads
+    """
+    concurrency = get_environment_variable("STORAGE_UPLOAD_CONCURRENCY")
+    return max(int(concurrency), 1) if concurrency is not None else DEFAULT_UPLOAD_CONCURRENCY
+
+
+def is_gzip_at_rest_enabled() -> bool:
+    """
+    Determines whether or not large JSON and CSV files, e.g. the sites, are stored gzip compressed (with "Content-Encoding: gzip").
+    read_file() decompresses them transparently, but the batch tasks read the session's files directly, so they must support it too.
+    :returns bool: the value of the STORAGE_GZIP_AT_REST environment variable; default is False
+    """
+    enabled = get_environment_variable("STORAGE_GZIP_AT_REST")
+    return enabled is not None and str_to_bool(enabled)
+
+
+def get_upload_options(file_bytes: object, compress: bool) -> tuple:
+    """
+    Gets what to upload to a blob, and how.
+    :param object file_bytes: the contents of the file, 'bytes' or 'str'
+    :param bool compress: whether or not to store the file gzip compressed
+    :returns tuple: the data to upload, and the keyword arguments for upload_blob()
+    """
+    options = {"max_concurrency": get_upload_concurrency()}
+    if (compress):
+        data = file_bytes.encode("utf-8") if isinstance(file_bytes, str) else file_bytes
+        file_bytes = gzip.compress(data, mtime=0)
+        options["content_settings"] = ContentSettings(content_encoding=GZIP_ENCODING)
+    return file_bytes, options
+
+
+def is_gzipped(properties: BlobProperties) -> bool:
+    "Determines whether or not a blob is stored gzip compressed"
+    return (properties.content_settings.content_encoding or "").lower() == GZIP_ENCODING
+
+
+def gunzip_chunks(chunks):
+    """
+    Decompresses gzip compressed data piece by piece, so the whole file is never held in memory.
+    :param chunks: an iterable of compressed 'bytes'
+    :returns Generator: a generator of decompressed 'bytes'
+    """
+    decompressor = zlib.decompressobj(wbits=zlib.MAX_WBITS | 16)  # 16 = expect a gzip header
+    for chunk in chunks:
+        data = decompressor.decompress(chunk)
+        if (data):
+            yield data
+    data = decompressor.flush()
+    if (data):
+        yield data
+
+
+def get_storage_http_session() -> requests.Session:
+    """
+    Gets the HTTP session (and its keep-alive connection pool) shared by all of the storage service clients.
+    :returns requests.Session: the shared HTTP session
+    """
+    global _http_session
+    with _client_lock:
+        if (_http_session is None):
+            pool_size = get_connection_pool_size()
+            adapter = HTTPAdapter(pool_connections=STORAGE_ENDPOINTS, pool_maxsize=pool_size)
+            session = requests.Session()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _http_session = session
+            logging.info(f"Storage HTTP session created, pool size = {pool_size}")
+        return _http_session
+
+
 def get_blob_service_client() -> BlobServiceClient:
     """
     Gets the Azure blob service client for interating with Azure blob storage.
+    The client is created once per worker process and reused, so its connections stay open between calls.
     :returns BlobServiceClient: the blob service client
     """
-    return BlobServiceClient(account_url=get_account_uri("blob"), credential=get_storage_account_key())
+    global _blob_service_client
+    if (_blob_service_client is None):
+        transport = RequestsTransport(session=get_storage_http_session(), session_owner=False)
+        with _client_lock:
+            if (_blob_service_client is None):
+                _blob_service_client = BlobServiceClient(account_url=get_account_uri("blob"),
+                                                         credential=get_storage_account_key(),
+                                                         transport=transport,
+                                                         **get_upload_client_settings())
+    return _blob_service_client
 
 
 def get_table_service_client() -> TableServiceClient:
     """
     Gets the Azure table service client for interacting with Azure table storage.
+    The client is created once per worker process and reused, so its connections stay open between calls.
     :returns TableServiceClient: the table service client
     """
-    credential = AzureNamedKeyCredential(get_storage_account_name(), get_storage_account_key())
-    return TableServiceClient(endpoint=get_account_uri("table"), credential=credential)
+    global _table_service_client
+    if (_table_service_client is None):
+        transport = RequestsTransport(session=get_storage_http_session(), session_owner=False)
+        with _client_lock:
+            if (_table_service_client is None):
+                credential = AzureNamedKeyCredential(get_storage_account_name(), get_storage_account_key())
+                _table_service_client = TableServiceClient(endpoint=get_account_uri("table"), credential=credential, transport=transport)
+    return _table_service_client
+
+
+def get_connection_pool_stats() -> dict:
+    """
+    Gets counters describing how well the shared storage connection pool is being used.
+    Counts cover the connection pools currently held by the shared HTTP session, i.e. since the worker started.
+    :returns dict: "requests" sent, connections "opened" (new TCP/TLS handshakes), and connections "reused"
+    """
+    requests_sent = 0
+    connections_opened = 0
+    if (_http_session is not None):
+        for adapter in set(_http_session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if (pool is not None):
+                    requests_sent += pool.num_requests
+                    connections_opened += pool.num_connections
+    return {
+        "requests": requests_sent,
+        "opened": connections_opened,
+        "reused": max(requests_sent - connections_opened, 0)
+    }
 
 
 class SessionStorage:
@@ -113,17 +350,54 @@ class SessionStorage:
             return False
 
 
-    def save_file(self, blob_path: str, file_bytes: bytes, overwrite: bool = False) -> None:
+    def save_file(self, blob_path: str, file_bytes: bytes, overwrite: bool = False, etag: Optional[str] = None, compress: bool = False) -> SaveFileResult:
         """
         Saves the given data in the specified blob in this session's blob container.
+        One upload decides whether to overwrite, without a separate existence check: unconditional when "overwrite" is set,
+        else conditional on the blob not existing (If-None-Match), or on its ETag (If-Match) when "etag" is given.
+        Large files are uploaded as blocks in parallel, see get_upload_client_settings() and get_upload_concurrency().
         :param str blob_path: the path to the blob
         :param bytes file_bytes: the contents of the file
         :param bool overwrite: whether or not to overwrite the blob if it already exists; optional, default is False
+        :param str etag: only overwrite the blob if it still has this ETag; requires "overwrite"; optional, default is None (any version)
+        :param bool compress: whether or not to store the file gzip compressed, see is_gzip_at_rest_enabled(); optional, default is False
+        :returns SaveFileResult: whether the blob was created, overwritten (or either, SAVED, when "overwrite" is set without "etag") or left alone, and its ETag
+        """
+        if (etag is not None and not overwrite):
+            raise ValueError("save_file(): an ETag to match is only for overwriting, set \"overwrite\" too")
+        blob_client = get_blob_service_client().get_blob_client(self.blob_container, blob_path)
+        file_bytes, upload_options = get_upload_options(file_bytes, compress)
+        try:
+            if (etag is not None):
+                properties = blob_client.upload_blob(file_bytes, overwrite=True, etag=etag, match_condition=MatchConditions.IfNotModified, **upload_options)
+                result = SaveFileResult(SaveFileOutcome.OVERWRITTEN, properties.get("etag"))
+            elif (overwrite):
+                properties = blob_client.upload_blob(file_bytes, overwrite=True, **upload_options)
+                result = SaveFileResult(SaveFileOutcome.SAVED, properties.get("etag"))
+            else:
+                properties = blob_client.upload_blob(file_bytes, overwrite=False, **upload_options)
+                result = SaveFileResult(SaveFileOutcome.CREATED, properties.get("etag"))
+        except (ResourceExistsError, ResourceModifiedError):
+            result = SaveFileResult(SaveFileOutcome.CONFLICT)
+        log_file_saved(self.blob_container, blob_path, result)
+        return result
+
+
+    def delete_file(self, blob_path: str, etag: Optional[str] = None) -> bool:
+        """
+        Deletes the specified blob.
+        :param str blob_path: the path to the blob
+        :param str etag: only delete the blob if it still has this ETag; optional, default is None (any version)
+        :returns bool: True = blob deleted, False = blob did not exist or has changed since
         """
         blob_client = get_blob_service_client().get_blob_client(self.blob_container, blob_path)
-        overwritten: str = " (overwritten)" if (blob_client.exists() and overwrite) else ""
-        blob_client.upload_blob(file_bytes, overwrite=overwrite)
-        logging.info(f"File saved \"/{self.blob_container}/{blob_path}\"{overwritten}")
+        conditions = {"etag": etag, "match_condition": MatchConditions.IfNotModified} if (etag is not None) else {}
+        try:
+            blob_client.delete_blob(**conditions)
+            logging.info(f"File deleted \"/{self.blob_container}/{blob_path}\"")
+            return True
+        except (ResourceNotFoundError, ResourceModifiedError):
+            return False
 
 
     def blob_exists(self, blob_path: str) -> bool:
@@ -137,13 +411,26 @@ class SessionStorage:
 
     def read_file(self, blob_path: str) -> bytes:
         """
-        Reads the contents of the specified blob container file.
+        Reads the contents of the specified blob container file, decompressing it if it is stored gzip compressed.
         :param str blob_path: The specific file to read.
         :returns bytes: The contents of the file.
         """
         blob_client = get_blob_service_client().get_blob_client(self.blob_container, blob_path)
-        stream = blob_client.download_blob()
-        return stream.readall()
+        stream = blob_client.download_blob(decompress=False)  # large blobs are downloaded in ranges, which cannot be decompressed separately
+        data = stream.readall()
+        return gzip.decompress(data) if (is_gzipped(stream.properties)) else data
+
+
+    def read_file_chunks(self, blob_path: str):
+        """
+        Reads the contents of the specified blob container file piece by piece, so the whole file is never held in memory.
+        The file is decompressed if it is stored gzip compressed.
+        :param str blob_path: The specific file to read.
+        :returns Generator: A generator of 'bytes', in file order.
+        """
+        blob_client = get_blob_service_client().get_blob_client(self.blob_container, blob_path)
+        stream = blob_client.download_blob(decompress=False)
+        return gunzip_chunks(stream.chunks()) if (is_gzipped(stream.properties)) else stream.chunks()
 
 
     def get_container_sas_uri(self, duration_hours: int) -> str:
@@ -0,0 +1,385 @@
+# +----------------------------------------------------------------------------
+# | Copyright (c) 2022 Pivotal Commware
+# | All rights reserved.
+# +----------------------------------------------------------------------------
+
+import asyncio
+import gzip
+import logging
+import zlib
+from typing import Optional
+
+import aiohttp
+from azure.core import MatchConditions
+from azure.core.exceptions import HttpResponseError, ResourceExistsError, ResourceModifiedError, ResourceNotFoundError, ResourceNotModifiedError
+from azure.core.pipeline.transport import AioHttpTransport
+from azure.core.credentials import AzureNamedKeyCredential
+from azure.storage.blob import BlobProperties
+from azure.storage.blob.aio import BlobClient, BlobServiceClient
+from azure.data.tables.aio import TableServiceClient, TableClient
+
+from .session_storage import (
+    LOG_FILES,
+    LOG_TAIL_CHUNK_SIZE,
+    SaveFileOutcome,
+    SaveFileResult,
+    SessionStorage,
+    get_account_uri,
+    get_connection_pool_size,
+    get_storage_account_key,
+    get_storage_account_name,
+    get_upload_client_settings,
+    get_upload_options,
+    is_gzipped,
+    log_file_saved
+)
+
+
+# Process-wide async storage clients; they are bound to the event loop on which they were created
+_clients_loop: Optional[asyncio.AbstractEventLoop] = None
+_blob_service_client: Optional[BlobServiceClient] = None
+_table_service_client: Optional[TableServiceClient] = None
+_clients_closer: Optional[asyncio.Task] = None  # closes the clients' HTTP sessions when cancelled
+
+
+def _get_transport(http_sessions: list) -> AioHttpTransport:
+    """
+    Creates an async transport backed by a connection pool sized like the synchronous one.
+    :param list http_sessions: the HTTP sessions to close with the clients; the transport's is added to it
+    :returns AioHttpTransport: the transport
+    """
+    connector = aiohttp.TCPConnector(limit_per_host=get_connection_pool_size())
+    http_session = aiohttp.ClientSession(connector=connector)
+    http_sessions.append(http_session)
+    return AioHttpTransport(session=http_session, session_owner=False)
+
+
+async def _close_on_shutdown(http_sessions: list) -> None:
+    """
+    Waits until cancelled, i.e. the event loop is shutting down (asyncio.run() cancels the tasks left) or the clients are replaced,
+    then closes the HTTP sessions, so their connections are not leaked.
+    :param list http_sessions: the clients' HTTP sessions
+    """
+    try:
+        await asyncio.Event().wait()
+    finally:
+        for http_session in http_sessions:
+            await http_session.close()
+        logging.info("Async storage clients closed")
+
+
+def _ensure_clients() -> None:
+    """
+    Creates the async blob and table service clients, once per event loop.
+    The previous event loop's clients are closed on that loop; if it has already stopped, their connections go with it.
+    Must be called from within a coroutine.
+    """
+    global _clients_loop, _blob_service_client, _table_service_client, _clients_closer
+    loop = asyncio.get_running_loop()
+    if (_clients_loop is not loop):
+        if (_clients_loop is not None and not _clients_loop.is_closed()):
+            _clients_loop.call_soon_threadsafe(_clients_closer.cancel)
+        http_sessions = []
+        _blob_service_client = BlobServiceClient(account_url=get_account_uri("blob"),
+                                                 credential=get_storage_account_key(),
+                                                 transport=_get_transport(http_sessions),
+                                                 **get_upload_client_settings())
+        credential = AzureNamedKeyCredential(get_storage_account_name(), get_storage_account_key())
+        _table_service_client = TableServiceClient(endpoint=get_account_uri("table"), credential=credential, transport=_get_transport(http_sessions))
+        _clients_closer = loop.create_task(_close_on_shutdown(http_sessions))
+        _clients_loop = loop
+        logging.info("Async storage clients created")
+
+
+def get_async_blob_service_client() -> BlobServiceClient:
+    """
+    Gets the async Azure blob service client for interacting with Azure blob storage without blocking the event loop.
+    :returns BlobServiceClient: the async blob service client
+    """
+    _ensure_clients()
+    return _blob_service_client
+
+
+def get_async_table_service_client() -> TableServiceClient:
+    """
+    Gets the async Azure table service client for interacting with Azure table storage without blocking the event loop.
+    :returns TableServiceClient: the async table service client
+    """
+    _ensure_clients()
+    return _table_service_client
+
+
+async def _download_range(blob_client: BlobClient, offset: int, length: Optional[int], **conditions) -> tuple:
+    """
+    Downloads a range of bytes of a blob.
+    :param BlobClient blob_client: the blob
+    :param int offset: where the range starts
+    :param int length: the length of the range; None = to the end of the blob
+    :returns tuple: the bytes, and the blob's total size and ETag
+    """
+    stream = await blob_client.download_blob(offset=offset, length=length, **conditions)
+    data = await stream.readall()
+    size = int(stream.properties.content_range.rsplit("/", 1)[1])  # e.g. "bytes 100-199/4321"
+    return data, size, stream.properties.etag
+
+
+async def _read_tail_lines(blob_client: BlobClient, size: int, lines: int) -> tuple:
+    """
+    Reads the last lines of a blob, one chunk at a time from its end, so only about as much as is needed is downloaded.
+    :param BlobClient blob_client: the blob
+    :param int size: the size of the blob
+    :param int lines: the number of lines
+    :returns tuple: the bytes, and where they start in the blob
+    """
+    data, offset = b"", size
+    while (offset > 0):
+        start = max(offset - LOG_TAIL_CHUNK_SIZE, 0)
+        data = (await _download_range(blob_client, start, offset - start))[0] + data
+        offset = start
+        if (data[:-1].count(b"\n") >= lines):  # a final newline does not start another line
+            break
+
+    # Keep only the last lines
+    cut = len(data) - 1
+    for _ in range(lines):
+        cut = data.rfind(b"\n", 0, cut)
+        if (cut < 0):
+            break
+    if (cut >= 0):
+        data, offset = data[cut + 1:], offset + cut + 1
+    return data, offset
+
+
+class AsyncSessionStorage(SessionStorage):
+    """
+    The async flavour of SessionStorage; every operation that touches the network is a coroutine.
+    The SAS and direct link helpers are inherited unchanged since they do not perform any I/O.
+    """
+
+    def get_table_client(self) -> TableClient:
+        """
+        Gets an async table client for this session's table.
+        :returns TableClient: the async table client
+        """
+        return get_async_table_service_client().get_table_client(self.table)
+
+
+    async def create_blob_container(self) -> bool:
+        """
+        Creates the Azure blob container for the session.
+        :returns bool: True = container created, False = the container already exists
+        """
+        try:
+            await get_async_blob_service_client().create_container(self.blob_container)
+            logging.info(f"Blob container created: {self.blob_container}")
+            return True
+        except ResourceExistsError:
+            logging.error(f"Attempt to create a blob container \"{self.blob_container}\" that already exists")
+            return False
+
+
+    async def create_table(self) -> bool:
+        """
+        Creates the Azure table for the session.
+        :returns bool: True = table created, False = the table already exists
+        """
+        try:
+            await get_async_table_service_client().create_table(self.table)
+            logging.info(f"Table created: {self.table}")
+            return True
+        except ResourceExistsError:
+            return False
+
+
+    async def save_file(self, blob_path: str, file_bytes: bytes, overwrite: bool = False, etag: Optional[str] = None, compress: bool = False) -> SaveFileResult:
+        """
+        Saves the given data in the specified blob in this session's blob container.
+        One upload decides whether to overwrite, without a separate existence check: unconditional when "overwrite" is set,
+        else conditional on the blob not existing (If-None-Match), or on its ETag (If-Match) when "etag" is given.
+        Large files are uploaded as blocks in parallel, see get_upload_client_settings() and get_upload_concurrency().
+        :param str blob_path: the path to the blob
+        :param bytes file_bytes: the contents of the file
+        :param bool overwrite: whether or not to overwrite the blob if it already exists; optional, default is False
+        :param str etag: only overwrite the blob if it still has this ETag; requires "overwrite"; optional, default is None (any version)
+        :param bool compress: whether or not to store the file gzip compressed, see is_gzip_at_rest_enabled(); optional, default is False
+        :returns SaveFileResult: whether the blob was created, overwritten (or either, SAVED, when "overwrite" is set without "etag") or left alone, and its ETag
+        """
+        if (etag is not None and not overwrite):
+            raise ValueError("save_file(): an ETag to match is only for overwriting, set \"overwrite\" too")
+        blob_client = get_async_blob_service_client().get_blob_client(self.blob_container, blob_path)
+        file_bytes, upload_options = get_upload_options(file_bytes, compress)
+        try:
+            if (etag is not None):
+                properties = await blob_client.upload_blob(file_bytes, overwrite=True, etag=etag, match_condition=MatchConditions.IfNotModified, **upload_options)
+                result = SaveFileResult(SaveFileOutcome.OVERWRITTEN, properties.get("etag"))
+            elif (overwrite):
+                properties = await blob_client.upload_blob(file_bytes, overwrite=True, **upload_options)
+                result = SaveFileResult(SaveFileOutcome.SAVED, properties.get("etag"))
+            else:
+                properties = await blob_client.upload_blob(file_bytes, overwrite=False, **upload_options)
+                result = SaveFileResult(SaveFileOutcome.CREATED, properties.get("etag"))
+        except (ResourceExistsError, ResourceModifiedError):
+            result = SaveFileResult(SaveFileOutcome.CONFLICT)
+        log_file_saved(self.blob_container, blob_path, result)
+        return result
+
+
+    async def delete_file(self, blob_path: str, etag: Optional[str] = None) -> bool:
+        """
+        Deletes the specified blob, e.g. to undo a save_file().
+        :param str blob_path: the path to the blob
+        :param str etag: only delete the blob if it still has this ETag; optional, default is None (any version)
+        :returns bool: True = blob deleted, False = blob did not exist or has changed since
+        """
+        blob_client = get_async_blob_service_client().get_blob_client(self.blob_container, blob_path)
+        conditions = {"etag": etag, "match_condition": MatchConditions.IfNotModified} if (etag is not None) else {}
+        try:
+            await blob_client.delete_blob(**conditions)
+            logging.info(f"File deleted \"/{self.blob_container}/{blob_path}\"")
+            return True
+        except (ResourceNotFoundError, ResourceModifiedError):
+            return False
+
+
+    async def blob_exists(self, blob_path: str) -> bool:
+        """
+        Determines whether or not the specified blob already exists.
+        :param str blob_path: the path to the blob
+        :returns bool: True = blob already exists, False = blob does not already exist
+        """
+        return await get_async_blob_service_client().get_blob_client(self.blob_container, blob_path).exists()
+
+
+    async def get_file_properties(self, blob_path: str) -> Optional[BlobProperties]:
+        """
+        Gets the properties of the specified blob, e.g. its size and ETag, without reading it.
+        :param str blob_path: the path to the blob
+        :returns: the blob's properties, or None if the blob does not exist
+        """
+        try:
+            return await get_async_blob_service_client().get_blob_client(self.blob_container, blob_path).get_blob_properties()
+        except ResourceNotFoundError:
+            return None
+
+
+    async def table_exists(self) -> bool:
+        """
+        Determines whether or not the Azure table for the session already exists.
+        :returns bool: True = table already exists, False = table does not already exist
+        """
+        async for _ in get_async_table_service_client().query_tables("TableName eq @name", parameters={"name": self.table}):
+            return True
+        return False
+
+
+    async def read_file(self, blob_path: str) -> bytes:
+        """
+        Reads the contents of the specified blob container file, decompressing it if it is stored gzip compressed.
+        :param str blob_path: The specific file to read.
+        :returns bytes: The contents of the file.
+        """
+        blob_client = get_async_blob_service_client().get_blob_client(self.blob_container, blob_path)
+        stream = await blob_client.download_blob(decompress=False)  # large blobs are downloaded in ranges, which cannot be decompressed separately
+        data = await stream.readall()
+        return gzip.decompress(data) if (is_gzipped(stream.properties)) else data
+
+
+    async def read_file_chunks(self, blob_path: str):
+        """
+        Reads the contents of the specified blob container file piece by piece, so the whole file is never held in memory.
+        The file is decompressed if it is stored gzip compressed.
+        :param str blob_path: The specific file to read.
+        :returns AsyncGenerator: An async generator of 'bytes', in file order.
+        """
+        blob_client = get_async_blob_service_client().get_blob_client(self.blob_container, blob_path)
+        stream = await blob_client.download_blob(decompress=False)
+        decompressor = zlib.decompressobj(wbits=zlib.MAX_WBITS | 16) if (is_gzipped(stream.properties)) else None  # 16 = expect a gzip header
+        async for chunk in stream.chunks():
+            data = decompressor.decompress(chunk) if (decompressor is not None) else chunk
+            if (data):
+                yield data
+        if (decompressor is not None):
+            data = decompressor.flush()
+            if (data):
+                yield data
+
+
+    async def read_log(self,
+                       task_id: str,
+                       file_name: str,
+                       offset: int = 0,
+                       length: Optional[int] = None,
+                       tail_bytes: Optional[int] = None,
+                       tail_lines: Optional[int] = None,
+                       etag: Optional[str] = None) -> dict:
+        """
+        Reads all or part of a log file produced and published by a batch activity task, with blob range reads.
+        :param str task_id: The task ID of the activity for which to retrieve the log.
+        :param str file_name: The log file, e.g. "stdout.txt".
+        :param int offset: Where to start reading; optional, default is the start of the file.
+        :param int length: The most bytes to read; optional, default is to the end of the file.
+        :param int tail_bytes: Read only this many bytes from the end of the file instead; optional.
+        :param int tail_lines: Read only this many lines from the end of the file instead; optional.
+        :param str etag: The ETag of the file when it was last read to its end, at offset; if it has not changed, nothing is downloaded; optional.
+        :returns dict: The "text" read, where it starts ("offset") and ends ("end") in the file, and the file's "size" and "etag".
+        """
+        blob_client = get_async_blob_service_client().get_blob_client(self.blob_container, f"tasklogs/{task_id}/{file_name}")
+        try:
+            if (tail_bytes is not None or tail_lines is not None):
+                properties = await blob_client.get_blob_properties()
+                size, etag = properties.size, properties.etag
+                if (tail_lines is not None):
+                    data, offset = await _read_tail_lines(blob_client, size, tail_lines)
+                else:
+                    offset = max(size - tail_bytes, 0)
+                    data = (await _download_range(blob_client, offset, size - offset))[0] if (offset < size) else b""
+            else:
+                conditions = {"etag": etag, "match_condition": MatchConditions.IfModified} if (etag is not None) else {}
+                try:
+                    data, size, etag = await _download_range(blob_client, offset, length, **conditions)
+                except ResourceNotModifiedError:
+                    data, size = b"", offset
+                except HttpResponseError as ex:
+                    if (ex.status_code != 416):  # 416 = Range Not Satisfiable, i.e. at or past the end of the file
+                        raise
+                    properties = await blob_client.get_blob_properties()
+                    data, size, etag = b"", properties.size, properties.etag
+                    if (size < offset):
+                        # The file has been replaced by a shorter one, so start over
+                        offset = 0
+                        if (size > 0):
+                            data, size, etag = await _download_range(blob_client, 0, length)
+        except ResourceNotFoundError:
+            data, offset, size, etag = b"", 0, 0, None
+
+        return {"text": data.decode("ascii", "replace"), "offset": offset, "end": offset + len(data), "size": size, "etag": etag}
+
+
+    async def read_logs(self,
+                        task_id: str,
+                        offset: int = 0,
+                        length: Optional[int] = None,
+                        tail_bytes: Optional[int] = None,
+                        tail_lines: Optional[int] = None,
+                        cursor: Optional[dict] = None) -> object:
+        """
+        Returns all or part of the two log files, "stdout.txt" and "stderr.txt", produced and published by the batch activity tasks.
+        Both files are read concurrently; see read_log() for the parameters.
+        :param str task_id: The task ID of the activity for which to retrieve its logs.
+        :param dict cursor: Where each file was last read to, as returned by a previous call, so only what has been written since is read; optional.
+        :returns object: The contents of the two log files, the "ranges" of the files that were read, and the "cursor" for the next call.
+        """
+        cursor = cursor or {}
+
+        async def read_log(key: str, file_name: str) -> dict:
+            position = cursor.get(key) or {}
+            return await self.read_log(task_id, file_name, position.get("offset", offset), length, tail_bytes, tail_lines, position.get("etag"))
+
+        results = dict(zip(LOG_FILES, await asyncio.gather(*(read_log(key, file_name) for key, file_name in LOG_FILES.items()))))
+
+        response = {key: result["text"] for key, result in results.items()}
+        response["ranges"] = {key: {"offset": result["offset"], "end": result["end"], "size": result["size"]} for key, result in results.items()}
+        # The ETag is only worth remembering when the file was read to its end; then an unchanged file need not be read again
+        response["cursor"] = {key: {"offset": result["end"], "etag": result["etag"] if (result["end"] == result["size"]) else None}
+                              for key, result in results.items()}
+        return response
@@ -3,20 +3,44 @@
 # | All rights reserved.
 # +----------------------------------------------------------------------------
 
-from cgitb import enable
+import asyncio
+import base64
+import json
 import logging
+import random
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, as_completed, wait
+from dataclasses import dataclass
 from typing import Optional
 from uuid import uuid1
 from itertools import islice
 
+from azure.core.exceptions import HttpResponseError
 from azure.data.tables import UpdateMode, TableClient
+from azure.data.tables.aio import TableClient as AsyncTableClient
 
-from ..shared_code.utilities import deserialize, is_none_or_whitespace
-from ..shared_code.session_storage import SITES_BLOB_PATH, get_table_service_client
+from ..shared_code.utilities import is_none_or_whitespace
+from ..shared_code.geojson_stream import aiter_geojson_features
+from ..shared_code.session_storage import SITES_BLOB_PATH, SITES_TABLE_CHECKPOINT_BLOB_PATH
+from ..shared_code.session_storage_async import AsyncSessionStorage
 from ..shared_code.session import Session
 
 
 MAX_OPERATIONS_PER_TRANSACTION = 50
+MAX_TRANSACTIONS_IN_FLIGHT     = 8
+MAX_TRANSACTION_RETRIES        = 5
+TRANSACTION_RETRY_BASE_SECONDS = 0.5
+RETRYABLE_STATUS_CODES         = (429, 503)  # 429 = Too Many Requests, 503 = Server Busy
+
+EXPANSION_BATCH_FEATURES = 1000  # how many GeoJSON features are expanded into columns at a time
+SECTOR_NUMERIC_FIELDS    = ['azimuth', 'ant_bw', 'downtilt_deg', 'peak_tx_dbm']  # required; an empty one disables the sector
+SECTOR_FIELDS            = SECTOR_NUMERIC_FIELDS + ['ant_pattern']
+SITE_FIELDS              = ["src_indx", "longitude", "latitude", "height_m", "azimuth", "ant_bw", "ant_pattern", "downtilt_deg", "peak_tx_dbm", "enabled"]
+
+SITES_PARTITION_KEY   = "On-Air Sites"
+MAX_ENTITIES_PER_PAGE = 1000  # the most Azure table storage returns in one response
+SECTOR_KEY_FIELD      = "sector_indx"  # with "src_indx", the stable key of a sector in the sites table: its position among the sectors of that id
+CHECKPOINT_EVERY_ROWS = 5000  # how often an interrupted sites table upload saves how far it got
 
 
 def batch(iterable, max_chunk_size: int):
@@ -31,6 +55,45 @@ def batch(iterable, max_chunk_size: int):
         yield batch
 
 
+async def aenumerate(iterable):
+    "Like enumerate(), for an async iterable"
+    number = 0
+    async for item in iterable:
+        yield number, item
+        number += 1
+
+
+async def skip_async(iterable, count: int):
+    "Skips the first \"count\" items of an async iterable"
+    async for item in iterable:
+        if (count > 0):
+            count -= 1
+            continue
+        yield item
+
+
+async def batch_async(iterable, max_chunk_size: int):
+    """
+    Groups the items of a sync or async iterable into batches sized "max_chunk_size" or less.
+    :param iterable: The iterable, or async iterable, over which to yield 1 -> max_chunk_size items.
+    :param int max_chunk_size: How many items from the iterable to yield.
+    :returns AsyncGenerator: An async generator of a 'list'.
+    """
+    if (not hasattr(iterable, "__aiter__")):
+        for chunk in batch(iterable, max_chunk_size):
+            yield chunk
+        return
+
+    chunk = []
+    async for item in iterable:
+        chunk.append(item)
+        if (len(chunk) == max_chunk_size):
+            yield chunk
+            chunk = []
+    if (chunk):
+        yield chunk
+
+
 def maybe_float(v):
     try:
         return float(v)
@@ -38,77 +101,589 @@ def maybe_float(v):
         return v
 
 
-def extract_sites(geojson):
+def extract_feature_sites(feature: dict):
+    """
+    Takes in one GeoJSON feature and expands it into one entry per sector.
+    :param dict feature: One feature of the sites file
+    :returns Generator: A generator of a 'dictionary'
+    """
+    logging.debug(feature)
+    props = feature['properties']
+
+    # pull common values
+    id = feature['id']
+    long, lat = feature['geometry']['coordinates']
+    height_m = float(props['height_m'])
+
+    # loop over each piece and yield
+    num_of_entries = len(props['azimuth'])
+    for i in range(num_of_entries):
+        # if any of the required numeric fields is missing, add the entry in disabled state
+        empty_field = lambda v: v is None or (type(v) is str and v.strip() == "")
+        enabled = not any(empty_field(props[k][i]) for k in ['azimuth', 'ant_bw', 'downtilt_deg', 'peak_tx_dbm'])
+
+        yield {
+            "src_indx": id,
+            "longitude": long,
+            "latitude": lat,
+            "height_m": height_m,
+            "azimuth": maybe_float(props['azimuth'][i]),
+            "ant_bw": maybe_float(props['ant_bw'][i]),
+            "ant_pattern": props['ant_pattern'][i],  # Empty is OK
+            "downtilt_deg": maybe_float(props['downtilt_deg'][i]),
+            "peak_tx_dbm": maybe_float(props['peak_tx_dbm'][i]),
+            "enabled": enabled
+        }
+
+
+def expand_features_columns(features: list) -> dict:
+    """
+    Expands GeoJSON features into columns, one per field of the sites table, with one entry per sector;
+    the batch equivalent of extract_feature_sites(), with the number parsing and "enabled" validity computed a whole column at a time.
+    :param list features: Features of the sites file
+    :returns dict: The columns, by field name, in the order of SITE_FIELDS
+    """
+    columns = {name: [] for name in SITE_FIELDS}
+    raw = {name: [] for name in SECTOR_FIELDS}
+    for feature in features:
+        props = feature['properties']
+        id = feature['id']
+        long, lat = feature['geometry']['coordinates']
+        height_m = float(props['height_m'])
+
+        num_of_entries = len(props['azimuth'])
+        if (num_of_entries == 0):
+            continue
+        if (any(name not in props or len(props[name]) < num_of_entries for name in SECTOR_FIELDS)):
+            # Malformed, so expanding it one sector at a time fails; let it fail exactly like extract_sites() always has
+            list(extract_feature_sites(feature))
+
+        columns["src_indx"].extend([id] * num_of_entries)
+        columns["longitude"].extend([long] * num_of_entries)
+        columns["latitude"].extend([lat] * num_of_entries)
+        columns["height_m"].extend([height_m] * num_of_entries)
+        for name in SECTOR_FIELDS:
+            raw[name].extend(props[name][:num_of_entries])
+
+    # Whole columns at once: a sector is enabled unless one of its required numeric fields is empty
+    enabled = [True] * len(raw["azimuth"])
+    for name in SECTOR_NUMERIC_FIELDS:
+        numbers = floats_column(raw[name])
+        if (numbers is None):
+            # Some of the column is not numbers, so it may have empty fields
+            numbers = [maybe_float(v) for v in raw[name]]
+            enabled = [ok and not (type(v) is str and v.strip() == "") for ok, v in zip(enabled, numbers)]
+        columns[name] = numbers
+    columns["ant_pattern"] = raw["ant_pattern"]
+    columns["enabled"] = enabled
+    return columns
+
+
+def floats_column(values: list) -> Optional[list]:
+    "Converts a whole column into numbers, or returns None if any of it is not a number, e.g. an empty field"
+    try:
+        return list(map(float, values))
+    except ValueError:
+        return None
+
+
+def rows_from_columns(columns: dict, sector_counts: Optional[dict] = None):
+    """
+    Turns columns back into rows, only as they are needed, e.g. at the upload boundary.
+    :param dict columns: The columns, as returned by expand_features_columns()
+    :param dict sector_counts: How many sectors of each "src_indx" came before, to key each row with its "sector_indx"; optional, default is None (no key)
+    :returns Generator: A generator of a 'dictionary'
+    """
+    for src_indx, long, lat, height_m, azimuth, ant_bw, ant_pattern, downtilt_deg, peak_tx_dbm, enabled in zip(*(columns[name] for name in SITE_FIELDS)):
+        row = {
+            "src_indx": src_indx,
+            "longitude": long,
+            "latitude": lat,
+            "height_m": height_m,
+            "azimuth": azimuth,
+            "ant_bw": ant_bw,
+            "ant_pattern": ant_pattern,
+            "downtilt_deg": downtilt_deg,
+            "peak_tx_dbm": peak_tx_dbm,
+            "enabled": enabled
+        }
+        if (sector_counts is not None):
+            row[SECTOR_KEY_FIELD] = sector_counts.get(src_indx, 0)
+            sector_counts[src_indx] = row[SECTOR_KEY_FIELD] + 1
+        yield row
+
+
+def extract_sites(geojson, batched: bool = False):
     """
     Takes in a geojson file and expends it into one entry per row.
     :param geojson: The contents of the sites file
+    :param bool batched: Whether to expand the features a batch at a time into columns, which is faster and gives the same rows; optional, default is False
     :returns Generator: A generator of a 'dictionary'
     """
     # strip out top level geoJSON if present
     if "geoJSON" in geojson:
         geojson = geojson["geoJSON"]
 
+    if (batched):
+        for features in batch(geojson['features'], EXPANSION_BATCH_FEATURES):
+            yield from rows_from_columns(expand_features_columns(features))
+        return
+
     for feature in geojson['features']:
-        logging.debug(feature)
-        props = feature['properties']
+        yield from extract_feature_sites(feature)
 
-        # pull common values
-        id = feature['id']
-        long, lat = feature['geometry']['coordinates']
-        height_m = float(props['height_m'])
 
-        # loop over each piece and yield
-        num_of_entries = len(props['azimuth'])
-        for i in range(num_of_entries):
-            # if any of the required numeric fields is missing, add the entry in disabled state
-            empty_field = lambda v: v is None or (type(v) is str and v.strip() == "")
-            enabled = not any(empty_field(props[k][i]) for k in ['azimuth', 'ant_bw', 'downtilt_deg', 'peak_tx_dbm'])
-
-            yield {
-                "src_indx": id,
-                "longitude": long,
-                "latitude": lat,
-                "height_m": height_m,
-                "azimuth": maybe_float(props['azimuth'][i]),
-                "ant_bw": maybe_float(props['ant_bw'][i]),
-                "ant_pattern": props['ant_pattern'][i],  # Empty is OK
-                "downtilt_deg": maybe_float(props['downtilt_deg'][i]),
-                "peak_tx_dbm": maybe_float(props['peak_tx_dbm'][i]),
-                "enabled": enabled
-            }
-
-
-def batch_upsert_entities(client: TableClient, entities) -> None:
-    """
-    Creates a series of transactions to upload entities.
+def build_sites_filter(enabled: Optional[bool] = None, bbox: Optional[tuple] = None, custom_filter: Optional[str] = None) -> tuple:
+    """
+    Builds the table storage filter selecting the sites table rows matching all of the specified criteria.
+    :param bool enabled: only enabled (True) or disabled (False) sectors; optional
+    :param tuple bbox: only sectors within this (min longitude, min latitude, max longitude, max latitude) bounding box; optional
+    :param str custom_filter: a table storage filter expression to pass through, e.g. "azimuth ge 90.0"; optional
+    :returns tuple: the filter string, or None to select every row, and its parameters
+    """
+    clauses = []
+    parameters = {}
+    if (enabled is not None):
+        clauses.append("enabled eq @enabled")
+        parameters["enabled"] = enabled
+    if (bbox is not None):
+        clauses.append("longitude ge @min_lon and longitude le @max_lon and latitude ge @min_lat and latitude le @max_lat")
+        parameters.update(zip(["min_lon", "min_lat", "max_lon", "max_lat"], (float(value) for value in bbox)))
+    if (not is_none_or_whitespace(custom_filter)):
+        clauses.append(f"({custom_filter})")
+    return (" and ".join(clauses) if clauses else None), parameters
+
+
+async def iter_sites_pages(storage: AsyncSessionStorage,
+                           query_filter: Optional[str] = None,
+                           parameters: Optional[dict] = None,
+                           select: Optional[list] = None,
+                           page_size: Optional[int] = None,
+                           continuation_token: Optional[dict] = None):
+    """
+    Retrieves the rows of the sites table matching the filter, one page at a time, so the whole table is never held in memory.
+    :param AsyncSessionStorage storage: The storage of the session whose sites to read
+    :param str query_filter: The filter, see build_sites_filter(); optional, default is every row
+    :param dict parameters: The filter's parameters; optional
+    :param list select: The columns to return; optional, default is every column
+    :param int page_size: The maximum number of rows per page; optional, default is the storage service's maximum (1000)
+    :param dict continuation_token: Where to resume a previous listing; optional, default is from the start
+    :returns AsyncGenerator: An async generator of a (list of rows, continuation token or None) 'tuple'
+    """
+    client = storage.get_table_client()
+    if (query_filter is None):
+        entities = client.list_entities(select=select, results_per_page=page_size)
+    else:
+        entities = client.query_entities(query_filter, parameters=parameters, select=select, results_per_page=page_size)
+    pages = entities.by_page(continuation_token=continuation_token)
+    async for page in pages:
+        yield [entity async for entity in page], pages.continuation_token
+
+
+async def stream_sites_async(storage: AsyncSessionStorage):
+    """
+    Streams the sites file from the Blob container and expands it into one entry per row as its features arrive, a batch at a time, without blocking the event loop.
+    Each row is keyed with its "sector_indx", for the sites table.
+    :param AsyncSessionStorage storage: The storage of the session whose sites file to read
+    :returns AsyncGenerator: An async generator of a 'dictionary'
+    """
+    sector_counts = {}
+    async for features in batch_async(aiter_geojson_features(storage.read_file_chunks(SITES_BLOB_PATH)), EXPANSION_BATCH_FEATURES):
+        for site in rows_from_columns(expand_features_columns(features), sector_counts):
+            yield site
+
+
+def sector_row_key(src_indx, sector_indx: int) -> str:
+    """
+    Gets the RowKey of a sector of the sites file; the same every time the file is uploaded, so uploading it again only replaces rows.
+    The id is Base64 (URL safe) encoded, as it may contain characters RowKeys cannot, e.g. "/" or "#".
+    :param src_indx: The id of the sector's GeoJSON feature
+    :param int sector_indx: The position of the sector among the sectors of that id
+    :returns str: The RowKey, e.g. "c2l0ZS0x.2"
+    """
+    encoded_id = base64.urlsafe_b64encode(str(src_indx).encode("utf-8")).decode("ascii").rstrip("=")
+    return f"{encoded_id}.{sector_indx}"
+
+
+def as_upsert(entity) -> tuple:
+    """
+    Converts a sites entity into a table transaction "upsert" operation, assigning its keys if necessary.
+    A row without a RowKey, e.g. a new one added with PATCH, gets a unique one, even if it was copied from another row with its "sector_indx".
+    :param entity: A 'dictionary' representing one row of the sites table
+    :returns tuple: The transaction operation
+    """
+    entity['PartitionKey'] = SITES_PARTITION_KEY
+    if (is_none_or_whitespace(entity.get("RowKey"))):
+        entity['RowKey'] = str(uuid1())
+    return ('upsert', entity, {'mode': UpdateMode.REPLACE})
+
+
+def as_sector_upsert(entity) -> tuple:
+    """
+    Converts a sector of the sites file into a table transaction "upsert" operation, keyed with its sector_row_key() unless it already has a RowKey.
+    Only for the rows of the sites file, see stream_sites_async(), whose "src_indx" and "sector_indx" are unique.
+    :param entity: A 'dictionary' representing one row of the sites table
+    :returns tuple: The transaction operation
+    """
+    if (is_none_or_whitespace(entity.get("RowKey"))):
+        entity['RowKey'] = sector_row_key(entity["src_indx"], entity[SECTOR_KEY_FIELD])
+    return as_upsert(entity)
+
+
+@dataclass
+class BatchUpsertReport:
+    """
+    Summary of a batch upsert.
+    rows_written:    how many entities were written
+    transactions:    how many transactions were submitted successfully
+    retries:         how many transaction submissions were retried because storage was throttling
+    elapsed_seconds: wall clock time taken by the whole upload
+    """
+    rows_written: int = 0
+    transactions: int = 0
+    retries: int = 0
+    elapsed_seconds: float = 0.0
+
+
+def is_retryable(ex: Exception) -> bool:
+    """
+    Determines whether a failed transaction should be submitted again, i.e. storage asked us to back off.
+    :param Exception ex: the exception raised by the transaction submission
+    :returns bool: True if the transaction should be retried, False otherwise
+    """
+    return isinstance(ex, HttpResponseError) and ex.status_code in RETRYABLE_STATUS_CODES
+
+
+def retry_delay_seconds(attempt: int) -> float:
+    """
+    Exponential backoff with jitter between transaction retries.
+    :param int attempt: which retry this is, starting at 0
+    :returns float: how many seconds to wait before retrying
+    """
+    return TRANSACTION_RETRY_BASE_SECONDS * (2 ** attempt) * (0.5 + random.random())
+
+
+def submit_transaction_with_retry(client: TableClient, operations: list) -> int:
+    """
+    Submits one transaction, retrying it while storage is throttling.
+    :param TableClient client: The table client to use.
+    :param list operations: The operations making up the transaction.
+    :returns int: How many times the transaction had to be retried.
+    """
+    for attempt in range(MAX_TRANSACTION_RETRIES + 1):
+        try:
+            client.submit_transaction(iter(operations))
+            return attempt
+        except Exception as ex:
+            if (not is_retryable(ex) or attempt == MAX_TRANSACTION_RETRIES):
+                raise
+            delay = retry_delay_seconds(attempt)
+            logging.warning(f"Sites transaction throttled (status={ex.status_code}), retrying in {delay:.2f} seconds")
+            time.sleep(delay)
+
+
+async def submit_transaction_with_retry_async(client: AsyncTableClient, operations: list) -> int:
+    """
+    Submits one transaction, retrying it while storage is throttling, without blocking the event loop.
+    :param AsyncTableClient client: The async table client to use.
+    :param list operations: The operations making up the transaction.
+    :returns int: How many times the transaction had to be retried.
+    """
+    for attempt in range(MAX_TRANSACTION_RETRIES + 1):
+        try:
+            await client.submit_transaction(operations)
+            return attempt
+        except Exception as ex:
+            if (not is_retryable(ex) or attempt == MAX_TRANSACTION_RETRIES):
+                raise
+            delay = retry_delay_seconds(attempt)
+            logging.warning(f"Sites transaction throttled (status={ex.status_code}), retrying in {delay:.2f} seconds")
+            await asyncio.sleep(delay)
+
+
+def batch_upsert_entities(client: TableClient, entities, max_in_flight: int = MAX_TRANSACTIONS_IN_FLIGHT) -> BatchUpsertReport:
+    """
+    Creates a series of transactions to upload entities, and submits them concurrently.
+    At most "max_in_flight" transactions are outstanding at once, so only that many batches are held in memory.
     :param TableClient client: The table client to use.
     :param entities: A generator of a 'dictionary'
+    :param int max_in_flight: The maximum number of transactions to submit concurrently.
+    :returns BatchUpsertReport: How many rows were written, how many transactions were retried, and how long it took.
     """
-    def as_upsert(entity):
-        entity['PartitionKey'] = "On-Air Sites"
-        entity['RowKey'] = str(uuid1()) if is_none_or_whitespace(entity.get("RowKey")) else entity.get("RowKey")
-        return ('upsert', entity, {'mode': UpdateMode.REPLACE})
+    report = BatchUpsertReport()
+    started = time.perf_counter()
+
+    def collect(future: Future, size: int) -> None:
+        report.retries += future.result()  # re-raises the transaction's exception, if any
+        report.rows_written += size
+        report.transactions += 1
 
     upsert_ops = map(as_upsert, entities)
-    for operations in batch(upsert_ops, MAX_OPERATIONS_PER_TRANSACTION):
-        client.submit_transaction(iter(operations))
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        pending = {}
+        try:
+            for operations in batch(upsert_ops, MAX_OPERATIONS_PER_TRANSACTION):
+                if (len(pending) >= max_in_flight):
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        collect(future, pending.pop(future))
+                pending[executor.submit(submit_transaction_with_retry, client, operations)] = len(operations)
+            for future in as_completed(list(pending)):
+                collect(future, pending.pop(future))
+        except Exception:
+            for future in pending:
+                future.cancel()
+            raise
+
+    report.elapsed_seconds = time.perf_counter() - started
+    logging.info(f"Sites upsert: {report}")
+    return report
+
+
+async def batch_upsert_entities_async(client: AsyncTableClient, entities, max_in_flight: int = MAX_TRANSACTIONS_IN_FLIGHT, progress=None,
+                                      as_operation=as_upsert) -> BatchUpsertReport:
+    """
+    Creates a series of transactions to upload entities, and submits them concurrently without blocking the event loop.
+    At most "max_in_flight" transactions are outstanding at once, so only that many batches are held in memory.
+    :param AsyncTableClient client: The async table client to use.
+    :param entities: A generator, or async generator, of a 'dictionary'
+    :param int max_in_flight: The maximum number of transactions to submit concurrently.
+    :param progress: An async function called with how many of the first entities are written, whenever that grows; optional, default is None
+    :param as_operation: Converts an entity into its upsert operation; optional, default is as_upsert(), see as_sector_upsert() for the sites file
+    :returns BatchUpsertReport: How many rows were written, how many transactions were retried, and how long it took.
+    """
+    async def upserts():
+        async for entities_batch in batch_async(entities, MAX_OPERATIONS_PER_TRANSACTION):
+            for entity in entities_batch:
+                yield as_operation(entity)
+
+    return await batch_submit_operations_async(client, upserts(), max_in_flight, progress)
+
+
+async def batch_submit_operations_async(client: AsyncTableClient, operations, max_in_flight: int = MAX_TRANSACTIONS_IN_FLIGHT, progress=None) -> BatchUpsertReport:
+    """
+    Groups table operations, e.g. upserts and deletes of sites entities, into transactions, and submits them concurrently without blocking the event loop.
+    At most "max_in_flight" transactions are outstanding at once, so only that many batches are held in memory.
+    :param AsyncTableClient client: The async table client to use.
+    :param operations: A generator, or async generator, of a transaction operation 'tuple'; each entity at most once
+    :param int max_in_flight: The maximum number of transactions to submit concurrently.
+    :param progress: An async function called with how many of the first operations are committed, whenever that grows; optional, default is None
+    :returns BatchUpsertReport: How many rows were written, how many transactions were retried, and how long it took.
+    """
+    report = BatchUpsertReport()
+    started = time.perf_counter()
+
+    # The transactions complete in any order; only those with none missing before them count as progress
+    committed = {"operations": 0, "next": 0}
+    completed = {}  # transaction number -> size, of those completed out of order
+
+    async def collect(task: asyncio.Task, number: int, size: int) -> None:
+        report.retries += task.result()  # re-raises the transaction's exception, if any
+        report.rows_written += size
+        report.transactions += 1
+        completed[number] = size
+        before = committed["operations"]
+        while (committed["next"] in completed):
+            committed["operations"] += completed.pop(committed["next"])
+            committed["next"] += 1
+        if (progress is not None and committed["operations"] > before):
+            await progress(committed["operations"])
+
+    pending = {}
+    try:
+        async for number, operations_batch in aenumerate(batch_async(operations, MAX_OPERATIONS_PER_TRANSACTION)):
+            if (len(pending) >= max_in_flight):
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    await collect(task, *pending.pop(task))
+            pending[asyncio.ensure_future(submit_transaction_with_retry_async(client, operations_batch))] = (number, len(operations_batch))
+        if (pending):
+            done, _ = await asyncio.wait(pending)
+            for task in sorted(done, key=lambda task: pending[task][0]):
+                await collect(task, *pending.pop(task))
+    except Exception:
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)  # so the other transactions' exceptions are retrieved too
+        raise
+
+    report.elapsed_seconds = time.perf_counter() - started
+    logging.info(f"Sites upsert: {report}")
+    return report
+
+
+def encode_checkpoint(sectors: Optional[int]) -> bytes:
+    "Gets the contents of the sites table checkpoint: how many of the first sectors of the sites file are in the table, or None while the table is being synced"
+    return json.dumps({"sectors": sectors}).encode("utf-8")
+
 
+def decode_checkpoint(data: bytes) -> Optional[int]:
+    "Gets how many of the first sectors of the sites file are in the table, or None if a sync was interrupted, from the sites table checkpoint"
+    sectors = json.loads(data)["sectors"]
+    return None if (sectors is None) else int(sectors)
 
-def create_table_from_sites(session: Session) -> None:
+
+async def create_table_from_sites_async(session: Session,
+                                        sites_exists: Optional[bool] = None,
+                                        table_exists: Optional[bool] = None,
+                                        checkpoint_exists: Optional[bool] = None) -> None:
     """
-    Creates a table in Azure storage corresponding to the GeoJSON of the sites file in the Blob container.
-    This table upload happens only once; if the table already exists, this operation is skipped.
+    Creates a table in Azure storage corresponding to the GeoJSON of the sites file in the Blob container, without blocking the event loop.
+    This table upload happens only once; if the table already exists, this operation is skipped, see sync_table_from_sites_async().
+    While the upload is incomplete, a checkpoint blob says how many of the first sectors are in the table, updated as it goes;
+    if it fails, the table is kept and the next call resumes the upload from there. The rows have deterministic RowKeys, so
+    uploading some of them again, e.g. the transactions in flight when it failed, only replaces them.
+    If the checkpoint says a sync of the table was interrupted instead, the sync is run again, see sync_table_from_sites_async().
     :param Session session: The session for which to perform this operation.
+    :param bool sites_exists: whether or not the sites file exists, if the caller already knows; optional, default is None (check)
+    :param bool table_exists: whether or not the table exists, if the caller already knows; optional, default is None (check)
+    :param bool checkpoint_exists: whether or not the checkpoint blob exists, if the caller already knows; optional, default is None (check, if needed)
     """
-    if (session.storage.blob_exists(SITES_BLOB_PATH) and session.storage.create_table()):
+    storage = AsyncSessionStorage(session.name)
+    if (sites_exists is None):
+        sites_exists = await storage.blob_exists(SITES_BLOB_PATH)
+    if (not sites_exists):
+        return
+    if (table_exists is None):
+        table_exists = await storage.table_exists()
+    if (table_exists and checkpoint_exists is None):
+        checkpoint_exists = await storage.blob_exists(SITES_TABLE_CHECKPOINT_BLOB_PATH)
+
+    if (not table_exists):
+        # The checkpoint goes first, so the table is never without one until it is complete
+        await storage.save_file(SITES_TABLE_CHECKPOINT_BLOB_PATH, encode_checkpoint(0), overwrite=True)
+        await storage.create_table()
+        resume_from = 0
+    elif (checkpoint_exists):
+        resume_from = decode_checkpoint(await storage.read_file(SITES_TABLE_CHECKPOINT_BLOB_PATH))
+        if (resume_from is None):
+            logging.info(f"Repairing the sites table \"{storage.table}\" after an interrupted sync")
+            await sync_table_from_sites_async(session)
+            return
+        logging.info(f"Resuming the upload of the sites table \"{storage.table}\" from sector {resume_from}")
+    else:
+        return
+
+    sectors = {"committed": resume_from, "saved": resume_from}
+
+    async def save_checkpoint() -> None:
+        await storage.save_file(SITES_TABLE_CHECKPOINT_BLOB_PATH, encode_checkpoint(sectors["committed"]), overwrite=True)
+        sectors["saved"] = sectors["committed"]
+
+    async def progress(committed: int) -> None:
+        sectors["committed"] = resume_from + committed
+        if (sectors["committed"] - sectors["saved"] >= CHECKPOINT_EVERY_ROWS):
+            await save_checkpoint()
+
+    client = storage.get_table_client()
+    try:
+        await batch_upsert_entities_async(client, skip_async(stream_sites_async(storage), resume_from), progress=progress, as_operation=as_sector_upsert)
+    except Exception:
+        logging.exception(f"Failed to create the Azure table from sites GeoJSON; keeping the partial table, to resume from sector {sectors['committed']}")
         try:
-            client = get_table_service_client().get_table_client(session.storage.table)
-            file_bytes = session.storage.read_file(SITES_BLOB_PATH)
-            geoJSON = deserialize(file_bytes.decode('utf8'))
-            sites_generator = extract_sites(geoJSON)
-            batch_upsert_entities(client, sites_generator)
-        except Exception as ex:
-            logging.exception("Failed to create the Azure table from sites GeoJSON; deleting empty/partial table")
-            if (client is not None):
-                client.delete_table()
-            raise ex
+            await save_checkpoint()
+        except Exception:
+            logging.exception("Failed to save the sites table checkpoint; the upload will resume from an earlier one")
+        raise
+    await storage.delete_file(SITES_TABLE_CHECKPOINT_BLOB_PATH)
+
+
+@dataclass
+class SitesSyncReport:
+    """
+    Summary of syncing the sites table with a new sites file.
+    unchanged: how many rows were already up to date
+    updated:   how many rows were replaced, keeping their RowKey
+    added:     how many rows were added
+    deleted:   how many rows were deleted, no longer in the sites file, without a "sector_indx" key or with the same key as another row
+    upload:    the transactions that made the changes
+    """
+    unchanged: int = 0
+    updated: int = 0
+    added: int = 0
+    deleted: int = 0
+    upload: Optional[BatchUpsertReport] = None
+
+
+def plain_value(value):
+    "Gets the value of a table entity property, which the table client returns wrapped in an EntityProperty for some types, e.g. 64 bit integers"
+    return getattr(value, "value", value)
+
+
+def site_values(entity: dict) -> tuple:
+    "Gets the data fields of a sites table row, for comparing it with another"
+    return tuple(plain_value(entity.get(name)) for name in SITE_FIELDS)
+
+
+async def read_sites_index(client: AsyncTableClient) -> tuple:
+    """
+    Reads the whole sites table, keeping only each row's key, RowKey and data fields.
+    Rows edited with PATCH may share a key; only one of them is kept by key, the one with the sector_row_key() if any, and the others are extra rows.
+    :param AsyncTableClient client: The async table client to use.
+    :returns tuple: The rows by ("src_indx", "sector_indx") as a 'dictionary' of (RowKey, data fields),
+                    and the RowKeys of the extra rows: those without a "sector_indx", and those whose key another row has
+    """
+    keyed = {}
+    extra = []
+    async for entity in client.list_entities(results_per_page=MAX_ENTITIES_PER_PAGE):
+        sector_indx = plain_value(entity.get(SECTOR_KEY_FIELD))
+        if (sector_indx is None):
+            extra.append(entity["RowKey"])
+            continue
+        key = (plain_value(entity.get("src_indx")), sector_indx)
+        row = (entity["RowKey"], site_values(entity))
+        if (key not in keyed):
+            keyed[key] = row
+        elif (entity["RowKey"] == sector_row_key(*key)):
+            extra.append(keyed[key][0])
+            keyed[key] = row
+        else:
+            extra.append(entity["RowKey"])
+    return keyed, extra
+
+
+async def sync_table_from_sites_async(session: Session) -> Optional[SitesSyncReport]:
+    """
+    Brings an existing sites table up to date with the sites file in the Blob container, e.g. after it is overwritten, without blocking the event loop.
+    The rows are matched by "src_indx" and "sector_indx"; only changed rows are upserted and only rows no longer in the sites file,
+    or duplicating the key of another row, are deleted.
+    Afterwards the table matches the sites file, so rows edited with PATCH are replaced and rows added with PATCH are deleted;
+    an interrupted upload of the table, see create_table_from_sites_async(), is completed too.
+    Until the sync is complete, the checkpoint blob says it is in progress, so if it fails the next create_table_from_sites_async() runs it again.
+    :param Session session: The session for which to perform this operation.
+    :returns SitesSyncReport: What was changed, or None if there is no table yet, see create_table_from_sites_async()
+    """
+    storage = AsyncSessionStorage(session.name)
+    if (not await storage.table_exists()):
+        return None
+    await storage.save_file(SITES_TABLE_CHECKPOINT_BLOB_PATH, encode_checkpoint(None), overwrite=True)
+    client = storage.get_table_client()
+    current, extra = await read_sites_index(client)
+    report = SitesSyncReport()
+    added = set()
+
+    async def changes():
+        async for site in stream_sites_async(storage):
+            existing = current.pop((site["src_indx"], site[SECTOR_KEY_FIELD]), None)
+            if (existing is None):
+                report.added += 1
+            elif (existing[1] == site_values(site)):
+                report.unchanged += 1
+                continue
+            else:
+                site["RowKey"] = existing[0]
+                report.updated += 1
+            operation = as_sector_upsert(site)
+            if (existing is None):
+                added.add(site["RowKey"])
+            yield operation
+        for row_key in extra + [row_key for row_key, _ in current.values()]:
+            if (row_key in added):
+                continue  # e.g. "src_indx" 7 replaced by "7"; the same RowKey, already replaced
+            report.deleted += 1
+            yield ('delete', {'PartitionKey': SITES_PARTITION_KEY, 'RowKey': row_key})
+
+    report.upload = await batch_submit_operations_async(client, changes())
+    await storage.delete_file(SITES_TABLE_CHECKPOINT_BLOB_PATH)  # the table is complete now, whether a sync or an upload of it was interrupted
+    logging.info(f"Sites table sync: {report}")
+    return report
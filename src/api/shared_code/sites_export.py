@@ -0,0 +1,146 @@
+# +----------------------------------------------------------------------------
+# | Copyright (c) 2022 Pivotal Commware
+# | All rights reserved.
+# +----------------------------------------------------------------------------
+
+import csv
+import io
+from typing import Optional
+
+try:
+    import pyarrow  # optional, for the typed columnar formats
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+# +-------------------------------------------------------------------------------------------
+# | Export of a session's sites table as one typed, columnar file, for bulk consumers that
+# | would otherwise page through GET sites. Parquet and Arrow IPC need the optional pyarrow
+# | package, which is left out of requirements.txt for its size; add "pyarrow" there to enable
+# | them. Without it the export falls back to CSV.
+# +-------------------------------------------------------------------------------------------
+PARQUET_FORMAT = "parquet"
+ARROW_FORMAT   = "arrow"
+CSV_FORMAT     = "csv"
+EXPORT_FORMATS = [PARQUET_FORMAT, ARROW_FORMAT, CSV_FORMAT]
+
+EXPORT_BLOB_PATH = "exports/sites.{extension}"
+
+# The known columns of the sites table, see extract_feature_sites(); any others are exported as strings
+STRING_COLUMNS  = ["RowKey", "src_indx", "ant_pattern"]
+FLOAT_COLUMNS   = ["longitude", "latitude", "height_m", "azimuth", "ant_bw", "downtilt_deg", "peak_tx_dbm"]
+BOOL_COLUMNS    = ["enabled"]
+INT_COLUMNS     = ["sector_indx"]
+SKIPPED_COLUMNS = ["PartitionKey"]  # the same for every row
+
+
+def get_default_format() -> str:
+    "Gets the best export format available: Parquet if pyarrow is installed, else CSV"
+    return PARQUET_FORMAT if (pyarrow is not None) else CSV_FORMAT
+
+
+def is_format_available(format: str) -> bool:
+    "Determines whether or not the export format can be written in this environment"
+    return format == CSV_FORMAT or (format in EXPORT_FORMATS and pyarrow is not None)
+
+
+def as_float(value: object) -> Optional[float]:
+    """
+    Converts a sites table value into a number; sectors with missing fields hold empty strings.
+    :param object value: the value
+    :returns: the number, or None (null) if the value is not a number
+    """
+    if (value is None or isinstance(value, bool)):
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def as_int(value: object) -> Optional[int]:
+    "Converts a sites table value into a whole number, or None (null) if it is not one; the table client wraps 64 bit integers"
+    value = getattr(value, "value", value)
+    return value if (type(value) is int) else None
+
+
+def as_string(value: object) -> Optional[str]:
+    "Converts a sites table value into a string, keeping None (null)"
+    return None if (value is None) else str(value)
+
+
+class SitesColumns:
+    """
+    Collects the rows of the sites table into typed columns, so the rows themselves need not be kept.
+    """
+
+    def __init__(self):
+        """
+        Constructor.
+        """
+        self.columns = {name: [] for name in STRING_COLUMNS + FLOAT_COLUMNS + BOOL_COLUMNS + INT_COLUMNS}
+        self.rows    = 0
+
+
+    def add_rows(self, rows: list) -> None:
+        """
+        Adds rows of the sites table to the columns.
+        :param list rows: the rows, as returned by the table client
+        """
+        for row in rows:
+            for name in row:
+                if (name not in self.columns and name not in SKIPPED_COLUMNS):
+                    self.columns[name] = [None] * self.rows  # a column that first appears in this row
+            for name, values in self.columns.items():
+                value = row.get(name)
+                if (name in FLOAT_COLUMNS):
+                    values.append(as_float(value))
+                elif (name in BOOL_COLUMNS):
+                    values.append(None if (value is None) else bool(value))
+                elif (name in INT_COLUMNS):
+                    values.append(as_int(value))
+                else:
+                    values.append(as_string(value))
+            self.rows += 1
+
+
+    def to_arrow_table(self):
+        """
+        Converts the columns into an Arrow table, with the numeric and Boolean columns typed as such.
+        :returns pyarrow.Table: the table
+        """
+        def arrow_type(name: str):
+            if (name in FLOAT_COLUMNS):
+                return pyarrow.float64()
+            if (name in BOOL_COLUMNS):
+                return pyarrow.bool_()
+            if (name in INT_COLUMNS):
+                return pyarrow.int64()
+            return pyarrow.string()
+
+        return pyarrow.table({name: pyarrow.array(values, type=arrow_type(name)) for name, values in self.columns.items()})
+
+
+    def to_bytes(self, format: str) -> bytes:
+        """
+        Writes the columns as a file.
+        :param str format: "parquet", "arrow" (an Arrow IPC file) or "csv"
+        :returns bytes: the contents of the file
+        """
+        if (format == CSV_FORMAT):
+            text = io.StringIO()
+            writer = csv.writer(text)
+            writer.writerow(self.columns)
+            writer.writerows(zip(*self.columns.values()))
+            return text.getvalue().encode("utf-8")
+
+        sink = pyarrow.BufferOutputStream()
+        table = self.to_arrow_table()
+        if (format == PARQUET_FORMAT):
+            pyarrow.parquet.write_table(table, sink)
+        else:
+            with pyarrow.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        return sink.getvalue().to_pybytes()
@@ -0,0 +1,116 @@
+# +----------------------------------------------------------------------------
+# | Copyright (c) 2022 Pivotal Commware
+# | All rights reserved.
+# +----------------------------------------------------------------------------
+
+import asyncio
+import logging
+from typing import Optional
+
+from .batch_task_poller import is_poller_instance, unregister_batch_task
+from .session import Session, SessionState
+from .session_activity import SessionActivity
+from .session_batch import call_batch_activity_stop_api
+from .session_de import terminate_orchestrator, update_session
+from . import session_delta
+from .utilities import get_environment_variable, is_none_or_whitespace
+
+
+DEFAULT_STOP_DEADLINE_SECONDS = 20
+RUNNER_STOP_MARGIN_SECONDS    = 2  # the runner's stop calls give up this long before the deadline, so their threads do not outlive it
+
+# Outcome of stopping an activity's orchestrator or batch task
+STOPPED   = "stopped"
+SKIPPED   = "skipped"    # there was nothing to stop
+FAILED    = "failed"
+TIMED_OUT = "timed_out"  # still in progress when the deadline passed
+
+
+def get_stop_deadline_seconds() -> float:
+    """
+    Gets how long stopping a session may take, tunable with the SESSION_STOP_DEADLINE_SECONDS environment variable.
+    :returns float: the number of seconds
+    """
+    deadline_seconds = get_environment_variable("SESSION_STOP_DEADLINE_SECONDS")
+    return float(deadline_seconds) if deadline_seconds is not None else DEFAULT_STOP_DEADLINE_SECONDS
+
+
+async def stop_orchestrator(id: str, task_id: str, starter: str) -> str:
+    """
+    Stops the specified orchestrator.
+    A shared poller orchestrator is not stopped; the activity's task is removed from its registry instead.
+    :param str id: The orchestrator's instance id
+    :param str task_id: The activity's task's id.
+    :param str starter: The context.
+    :returns str: STOPPED or FAILED
+    """
+    if (is_poller_instance(id)):
+        if (not is_none_or_whitespace(task_id)):
+            await unregister_batch_task(starter, id, task_id)
+        return STOPPED
+    return STOPPED if await terminate_orchestrator(id, "session stopped by user", starter) else FAILED
+
+
+def stop_task(session_name: str, activity: SessionActivity, id: str, deadline_seconds: float) -> str:
+    """
+    Stops the specified batch task; blocking.
+    :param str session_name: The name of the session.
+    :param SessionActivity activity: The particular activity being stopped.
+    :param str id: The activity's task's id.
+    :param float deadline_seconds: How long the runner's stop call may take, retries included.
+    :returns str: STOPPED or FAILED
+    """
+    return STOPPED if call_batch_activity_stop_api(session_name, activity, id, deadline_seconds) else FAILED
+
+
+async def stop_session(session: Session, starter: str, deadline_seconds: Optional[float] = None) -> dict:
+    """
+    Stops all of the session's orchestrators and batch tasks concurrently, then changes its state to stopped.
+    Activities which have never been run are skipped. Whatever is still in progress when the deadline passes is reported as TIMED_OUT.
+    The session is changed to stopped even then, so "complete" in the summary tells whether everything was actually stopped.
+    :param Session session: the session to stop
+    :param str starter: the context
+    :param float deadline_seconds: how long the orchestrator and task stops may take; optional, default is get_stop_deadline_seconds()
+    :returns dict: per activity name, the outcome (STOPPED, SKIPPED, FAILED or TIMED_OUT) of stopping its "orchestrator" and its "task",
+                   and "complete", False if any of them FAILED or TIMED_OUT
+    """
+    if (deadline_seconds is None):
+        deadline_seconds = get_stop_deadline_seconds()
+    runner_deadline_seconds = max(deadline_seconds - RUNNER_STOP_MARGIN_SECONDS, deadline_seconds / 2)
+
+    summary = {}
+    pending = {}  # asyncio task -> (activity name, "orchestrator" or "task")
+    for activity, info in ((SessionActivity.NEARMAP, session.nearmap),
+                           (SessionActivity.VALIDATION, session.validation),
+                           (SessionActivity.WAVESCAPE, session.wavescape)):
+        name = activity.name.lower()
+        summary[name] = {"orchestrator": SKIPPED, "task": SKIPPED}
+        if (not is_none_or_whitespace(info.orchestrator_id)):
+            pending[asyncio.ensure_future(stop_orchestrator(info.orchestrator_id, info.task_id, starter))] = (name, "orchestrator")
+        if (not is_none_or_whitespace(info.task_id)):
+            pending[asyncio.ensure_future(asyncio.to_thread(stop_task, session.name, activity, info.task_id, runner_deadline_seconds))] = (name, "task")
+
+    if (pending):
+        done, not_done = await asyncio.wait(pending.keys(), timeout=deadline_seconds)
+        for task in done:
+            name, kind = pending[task]
+            if (task.exception() is not None):
+                logging.warning(f"Failed to stop {name} {kind} for session \"{session.name}\", exception={repr(task.exception())}")
+                summary[name][kind] = FAILED
+            else:
+                summary[name][kind] = task.result()
+        for task in not_done:
+            name, kind = pending[task]
+            logging.warning(f"Stopping {name} {kind} for session \"{session.name}\" did not complete within {deadline_seconds} seconds")
+            task.cancel()
+            summary[name][kind] = TIMED_OUT
+        await asyncio.gather(*not_done, return_exceptions=True)
+
+    complete = all(outcome in (STOPPED, SKIPPED) for outcomes in summary.values() for outcome in outcomes.values())
+    if (not complete):
+        logging.warning(f"Session \"{session.name}\" is changed to stopped, but not all of its orchestrators and batch tasks were stopped")
+
+    # Change the state to stopped inside the session's durable entity
+    await update_session(session.name, [session_delta.set_state(SessionState.STOPPED)], starter, session)
+    summary["complete"] = complete
+    return summary
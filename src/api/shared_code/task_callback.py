@@ -0,0 +1,44 @@
+# +----------------------------------------------------------------------------
+# | Copyright (c) 2022 Pivotal Commware
+# | All rights reserved.
+# +----------------------------------------------------------------------------
+
+from typing import Optional
+
+from .utilities import get_environment_variable, is_none_or_whitespace
+
+
+# +-------------------------------------------------------------------------------------------
+# | Push-based completion: the runner calls the portal's "tasks/{instanceId}/completed" API when
+# | a batch task finishes, which raises TASK_COMPLETED_EVENT on the waiting orchestrator.
+# | Enabled by setting WAVESCAPE_PORTAL_CALLBACK_URL (and WAVESCAPE_PORTAL_CALLBACK_KEY, the
+# | function key of the callback API); the orchestrator keeps polling, rarely, in case a callback is lost.
+# | The API answers 503, with Retry-After, while the orchestrator has not started yet; the runner should
+# | retry then, but not after a 410 (the orchestrator is no longer waiting).
+# +-------------------------------------------------------------------------------------------
+TASK_COMPLETED_EVENT = "task_completed"
+DEFAULT_CALLBACK_FALLBACK_SECONDS = 600
+
+
+def get_callback_url(instance_id: str) -> Optional[str]:
+    """
+    Gets the URL the runner should call when the batch task waited for by the specified orchestrator completes.
+    :param str instance_id: the instance id of the wait orchestrator
+    :returns: the callback URL, or None if callbacks are not enabled
+    """
+    portal_url = get_environment_variable("WAVESCAPE_PORTAL_CALLBACK_URL")  # e.g. "https://{FUNCTION_APP}.azurewebsites.net/api
+    if (is_none_or_whitespace(portal_url)):
+        return None
+    portal_key = get_environment_variable("WAVESCAPE_PORTAL_CALLBACK_KEY")
+    code = f"?code={portal_key}" if not is_none_or_whitespace(portal_key) else ""
+    return f"{portal_url}/tasks/{instance_id}/completed{code}"
+
+
+def get_callback_fallback_seconds() -> int:
+    """
+    Gets the shortest wait between the fallback status checks of a task whose completion will be reported by a callback,
+    tunable with the BATCH_TASK_CALLBACK_FALLBACK_SECONDS environment variable.
+    :returns int: the number of seconds
+    """
+    fallback_seconds = get_environment_variable("BATCH_TASK_CALLBACK_FALLBACK_SECONDS")
+    return int(fallback_seconds) if fallback_seconds is not None else DEFAULT_CALLBACK_FALLBACK_SECONDS
@@ -0,0 +1,78 @@
+# +----------------------------------------------------------------------------
+# | Copyright (c) 2022 Pivotal Commware
+# | All rights reserved.
+# +----------------------------------------------------------------------------
+
+from typing import Optional
+
+import azure.functions as func
+
+from .session_storage_async import AsyncSessionStorage
+from .http_compression import compress_response
+from .utilities import decode_continuation_token, encode_continuation_token, to_json
+from .api_strings import invalid_query_param_json
+
+
+OFFSET_PARAM     = "offset"
+LENGTH_PARAM     = "length"
+TAIL_BYTES_PARAM = "tailBytes"
+TAIL_LINES_PARAM = "tailLines"
+CURSOR_PARAM     = "cursor"
+
+
+def get_int_param(req: func.HttpRequest, name: str, minimum: int) -> Optional[int]:
+    """
+    Gets an optional integer query parameter.
+    :param func.HttpRequest req: the HTTP request
+    :param str name: the name of the query parameter
+    :param int minimum: the smallest valid value
+    :returns: the value, or None if the parameter was not provided
+    :raises ValueError: if the value is not an integer, or is too small
+    """
+    value = req.params.get(name)
+    if (value is None):
+        return None
+    value = int(value)
+    if (value < minimum):
+        raise ValueError()
+    return value
+
+
+async def get_logs(session_name: str, task_id: str, req: func.HttpRequest) -> func.HttpResponse:
+    """
+    Gets all or part of the two log files, "stdout.txt" and "stderr.txt", produced and published by a batch task.
+    Query parameters, all optional:
+    - "offset" and "length": the range of bytes to read from each file
+    - "tailBytes" or "tailLines": read only the end of each file
+    - "cursor": read only what has been written since the previous call, whose response held the cursor
+    :param str session_name: the name of the session
+    :param str task_id: the id of the batch task
+    :param func.HttpRequest req: the HTTP request
+    :returns func.HttpResponse: the logs, the ranges that were read, and the cursor for the next call; compressed if the client accepts it
+    """
+    params = {}
+    for name, minimum in [(OFFSET_PARAM, 0), (LENGTH_PARAM, 1), (TAIL_BYTES_PARAM, 1), (TAIL_LINES_PARAM, 1)]:
+        try:
+            params[name] = get_int_param(req, name, minimum)
+        except ValueError:
+            return func.HttpResponse(invalid_query_param_json(name, f"an integer of at least {minimum}"), status_code=400)  # 400 = Bad Request
+
+    try:
+        cursor = decode_continuation_token(req.params.get(CURSOR_PARAM))
+    except ValueError:
+        return func.HttpResponse(invalid_query_param_json(CURSOR_PARAM, "a cursor from a previous response"), status_code=400)  # 400 = Bad Request
+
+    if (params[TAIL_BYTES_PARAM] is not None and params[TAIL_LINES_PARAM] is not None):
+        return func.HttpResponse(invalid_query_param_json(TAIL_BYTES_PARAM, f"not to be combined with \"{TAIL_LINES_PARAM}\""), status_code=400)  # 400 = Bad Request
+    tail_param = TAIL_BYTES_PARAM if (params[TAIL_BYTES_PARAM] is not None) else TAIL_LINES_PARAM
+    if (params[tail_param] is not None and (cursor is not None or params[OFFSET_PARAM] is not None)):
+        return func.HttpResponse(invalid_query_param_json(tail_param, f"not to be combined with \"{OFFSET_PARAM}\" or \"{CURSOR_PARAM}\""), status_code=400)  # 400 = Bad Request
+
+    response = await AsyncSessionStorage(session_name).read_logs(task_id,
+                                                                 offset=params[OFFSET_PARAM] or 0,
+                                                                 length=params[LENGTH_PARAM],
+                                                                 tail_bytes=params[TAIL_BYTES_PARAM],
+                                                                 tail_lines=params[TAIL_LINES_PARAM],
+                                                                 cursor=cursor)
+    response["cursor"] = encode_continuation_token(response["cursor"])
+    return compress_response(req, func.HttpResponse(to_json(response)))
@@ -0,0 +1,60 @@
+# +----------------------------------------------------------------------------
+# | Copyright (c) 2022 Pivotal Commware
+# | All rights reserved.
+# +----------------------------------------------------------------------------
+
+from typing import Optional
+
+from .session_storage_async import AsyncSessionStorage
+from .api_strings import blob_not_uploaded_json, blob_upload_mismatch_json, invalid_body_json
+
+
+# +-------------------------------------------------------------------------------------------
+# | Large files need not transit the function host: the client gets a write SAS URI for the
+# | blob from the "sasuri" function, uploads the file directly to the session's blob container
+# | (in parallel blocks, then a block list), and then "commits" by calling the usual endpoint
+# | with "uploaded" in the body instead of the Base64 file. The commit only verifies the blob.
+# +-------------------------------------------------------------------------------------------
+UPLOADED_PARAM_NAME = "uploaded"
+SIZE_FIELD_NAME     = "size"
+ETAG_FIELD_NAME     = "etag"
+
+
+def get_expected_upload(uploaded: object) -> dict:
+    """
+    Gets what the client says it uploaded, from the value of an "uploaded" body param.
+    :param object uploaded: either true, or an object with the optional "size" (in bytes) and "etag" of the upload
+    :returns dict: the expected "size" and "etag", either of which may be missing
+    """
+    return uploaded if isinstance(uploaded, dict) else {}
+
+
+async def verify_uploaded_file(storage: AsyncSessionStorage, blob_path: str, expected: dict) -> Optional[str]:
+    """
+    Verifies that a file uploaded directly to the session's blob container is there, and is the upload the client made.
+    Only the blob's properties are read, never its contents.
+    :param AsyncSessionStorage storage: the session's storage
+    :param str blob_path: the path to the blob
+    :param dict expected: the optional "size" (in bytes) and "etag" of the upload, see get_expected_upload()
+    :returns: the JSON error message for a 400 response, or None if the file is as expected
+    """
+    # The size may be a number or a string of digits, the ETag must be a string
+    expected_size = expected.get(SIZE_FIELD_NAME)
+    if (expected_size is not None and (isinstance(expected_size, bool) or not isinstance(expected_size, (int, str)) or not str(expected_size).isdigit())):
+        return invalid_body_json
+    expected_etag = expected.get(ETAG_FIELD_NAME)
+    if (expected_etag is not None and not isinstance(expected_etag, str)):
+        return invalid_body_json
+
+    properties = await storage.get_file_properties(blob_path)
+    if (properties is None or properties.size == 0):
+        return blob_not_uploaded_json(blob_path)
+
+    if (expected_size is not None and int(expected_size) != properties.size):
+        return blob_upload_mismatch_json(blob_path, SIZE_FIELD_NAME, expected_size, properties.size)
+
+    # ETags are quoted in HTTP headers, but clients may pass them either way
+    if (expected_etag is not None and expected_etag.strip('"') != (properties.etag or "").strip('"')):
+        return blob_upload_mismatch_json(blob_path, ETAG_FIELD_NAME, expected_etag, properties.etag)
+
+    return None
@@ -3,8 +3,12 @@
 # | All rights reserved.
 # +----------------------------------------------------------------------------
 
+import base64
+import json
 import os
+import time
 import jsonpickle
+from contextlib import contextmanager
 from typing import Optional
 
 
@@ -19,13 +23,23 @@ def is_none_or_whitespace(input: str) -> bool:
 
 def to_json(input: object, pretty=True) -> str:
     """
-    Converts the provided Python object into a pretty JSON string using 'jsonpickle'.
+    Converts the provided Python object into a pretty JSON string.
+    Plain JSON data (dict, list, str, numbers, bool, None) is converted directly with the 'json' module;
+    anything else falls back to 'jsonpickle', which produces the same output for plain data.
     :param object input: The Python object to convert
     :param bool pretty: Whether or not to pretty-print the result with indentation of 4 spaces
     :returns str: The JSON string representation of the Python object
     """
     indent_level = 4 if pretty else None
-    return jsonpickle.encode(input, indent=indent_level, unpicklable=False)
+    try:
+        return json.dumps(input, indent=indent_level, default=_not_plain_json)
+    except (TypeError, ValueError):
+        return jsonpickle.encode(input, indent=indent_level, unpicklable=False)
+
+
+def _not_plain_json(input: object) -> None:
+    "Tells json.dumps() that the object is not plain JSON data, so to_json() falls back to jsonpickle"
+    raise TypeError(f"{type(input).__name__} is not plain JSON data")
 
 
 def serialize(input: object) -> str:
@@ -46,6 +60,35 @@ def deserialize(input: str) -> object:
     return jsonpickle.decode(input)
 
 
+def encode_continuation_token(token: Optional[dict]) -> Optional[str]:
+    """
+    Converts an Azure table storage continuation token into an opaque, URL-safe string for API clients.
+    :param dict token: The continuation token returned by the storage SDK, or None.
+    :returns str: The opaque token, or None if there are no more results.
+    """
+    if (not token):
+        return None
+    return base64.urlsafe_b64encode(json.dumps(token).encode("utf-8")).decode("ascii")
+
+
+def decode_continuation_token(text: Optional[str]) -> Optional[dict]:
+    """
+    Converts an opaque continuation token string back into the form the storage SDK expects.
+    :param str text: The opaque token, as produced by encode_continuation_token(), or None.
+    :returns dict: The continuation token, or None if no token was provided.
+    :raises ValueError: if the token is malformed
+    """
+    if (is_none_or_whitespace(text)):
+        return None
+    try:
+        token = json.loads(base64.urlsafe_b64decode(text.encode("ascii")))
+    except Exception:
+        raise ValueError("malformed continuation token")
+    if (not isinstance(token, dict)):
+        raise ValueError("malformed continuation token")
+    return token
+
+
 def get_environment_variable(name) -> Optional[str]:
     """
     Returns the value of the specified environment variable.
@@ -66,3 +109,38 @@ def str_to_bool(value: str) -> bool:
     :returns bool: True if the parameter represents affirmative, False otherwise
     """
     return str(value).lower() in ("true", "yes", "y", "t", "1")
+
+
+class PhaseTimer:
+    """
+    Measures how long each phase of handling a request takes, e.g. for logging and for the "Server-Timing" response header.
+    """
+
+    def __init__(self):
+        """
+        Constructor.
+        """
+        self.phases = {}  # phase name -> elapsed milliseconds, in the order the phases started
+
+
+    @contextmanager
+    def phase(self, name: str):
+        """
+        Times the enclosed block as the named phase; usable in both sync and async code.
+        :param str name: the name of the phase, e.g. "probes"
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + (time.perf_counter() - start) * 1000
+
+
+    def summary(self) -> str:
+        "Gets the phases' timings for a log message, e.g. \"probes=12ms, start=80ms\""
+        return ", ".join(f"{name}={ms:.0f}ms" for name, ms in self.phases.items())
+
+
+    def server_timing(self) -> str:
+        "Gets the phases' timings as the value of a \"Server-Timing\" HTTP response header"
+        return ", ".join(f"{name};dur={ms:.1f}" for name, ms in self.phases.items())
@@ -0,0 +1,57 @@
+# +----------------------------------------------------------------------------
+# | Copyright (c) 2022 Pivotal Commware
+# | All rights reserved.
+# +----------------------------------------------------------------------------
+
+import logging
+import threading
+import time
+
+from .runner_api import get_runner_api_stats
+from .session_cache import session_cache
+from .session_storage import get_connection_pool_stats
+from .utilities import get_environment_variable, to_json
+
+
+# +-------------------------------------------------------------------------------------------
+# | The worker's own metrics, e.g. the runner API latency/error histograms, the session cache
+# | hits and the storage connections reused, are logged as one "Worker stats" line, at most
+# | every WORKER_STATS_LOG_SECONDS, by whichever function of the worker calls
+# | log_worker_stats() next: the status checks and the session lookups of the APIs.
+# +-------------------------------------------------------------------------------------------
+DEFAULT_WORKER_STATS_LOG_SECONDS = 300
+
+_stats_lock = threading.Lock()
+_next_log = 0.0
+
+
+def get_worker_stats_log_seconds() -> float:
+    """
+    Gets how often the worker's metrics are logged, tunable with the WORKER_STATS_LOG_SECONDS environment variable; 0 disables it.
+    :returns float: the number of seconds
+    """
+    log_seconds = get_environment_variable("WORKER_STATS_LOG_SECONDS")
+    return float(log_seconds) if log_seconds is not None else DEFAULT_WORKER_STATS_LOG_SECONDS
+
+
+def get_worker_stats() -> dict:
+    """
+    Gets the worker's metrics, since it started.
+    :returns dict: the "runner_api" stats, see get_runner_api_stats(), the "session_cache" stats, see SessionCache.stats(),
+        and the "storage_connections" stats, see get_connection_pool_stats()
+    """
+    return {"runner_api": get_runner_api_stats(), "session_cache": session_cache.stats(), "storage_connections": get_connection_pool_stats()}
+
+
+def log_worker_stats() -> None:
+    "Logs the worker's metrics, unless they were logged less than get_worker_stats_log_seconds() ago"
+    global _next_log
+    log_seconds = get_worker_stats_log_seconds()
+    if (log_seconds <= 0):
+        return
+    with _stats_lock:
+        now = time.monotonic()
+        if (now < _next_log):
+            return
+        _next_log = now + log_seconds
+    logging.info(f"Worker stats: {to_json(get_worker_stats(), pretty=False)}")
@@ -3,20 +3,26 @@
 # | All rights reserved.
 # +----------------------------------------------------------------------------
 
+import asyncio
 import base64
 import logging
 import azure.functions as func
 
-from azure.core.exceptions import ResourceNotFoundError
+from azure.core.exceptions import HttpResponseError, ResourceNotFoundError
 
-from ..shared_code.sites import batch_upsert_entities
-from ..shared_code.session import Session
-from ..shared_code.session_storage import RAW_SITES_BLOB_PATH, SITES_BLOB_PATH, get_table_service_client
-from ..shared_code.utilities import is_none_or_whitespace, str_to_bool, to_json
+from ..shared_code.sites import SECTOR_KEY_FIELD, batch_upsert_entities_async, build_sites_filter, iter_sites_pages, sync_table_from_sites_async
+from ..shared_code.session import Session, SessionState
+from ..shared_code.session_activity import SessionActivity
+from ..shared_code.session_storage import RAW_SITES_BLOB_PATH, SITES_BLOB_PATH, SaveFileOutcome, is_gzip_at_rest_enabled
+from ..shared_code.session_storage_async import AsyncSessionStorage
+from ..shared_code.uploaded_files import UPLOADED_PARAM_NAME, get_expected_upload, verify_uploaded_file
+from ..shared_code.utilities import decode_continuation_token, encode_continuation_token, is_none_or_whitespace, str_to_bool, to_json
 from ..shared_code.api_strings import (
+    already_running_text,
     invalid_body_json,
     missing_sites_table_json,
     missing_body_param_json,
+    invalid_query_param_json,
     invalid_b64_json,
     blob_exists_json,
     sites_body_missing_both,
@@ -25,11 +31,26 @@ from ..shared_code.api_strings import (
     sites_no_entities
 )
 from ..shared_code.find_session import find_session
+from ..shared_code.http_compression import compress_response
+
+
+# Query parameters of GET; each may also be given OData style, with a "$" prefix, e.g. "$top"
+FILTER_PARAM             = "filter"
+ENABLED_PARAM            = "enabled"
+BBOX_PARAM               = "bbox"
+SELECT_PARAM             = "select"
+TOP_PARAM                = "top"
+CONTINUATION_TOKEN_PARAM = "continuationToken"
+CONTINUATION_HEADER      = "x-continuation-token"
+MAX_PAGE_SIZE            = 1000  # the most Azure table storage returns in one response
 
 
 async def put(session: Session, req: func.HttpRequest, starter: str) -> func.HttpResponse:
     """
     Saves the original sites data to the session's Azure blob container: the "raw" (a CSV file) and the "processed" (a GeoJSON file).
+    Instead of the data, the body may say both files have been "uploaded" directly with write SAS URIs; they are then only verified.
+    If the sites table already exists, e.g. the files were overwritten, it is brought up to date with only the changed rows.
+    Not allowed while Validation or WaveScape is running, since both read the sites.
     :param Session session: The session object.
     :param func.HttpRequest req: The HTTP request object.
     :param str starter: The context.
@@ -46,6 +67,27 @@ async def put(session: Session, req: func.HttpRequest, starter: str) -> func.Htt
     except Exception:
         return func.HttpResponse(invalid_body_json, status_code=400)  # 400 = Bad Request
 
+    # Ensure that the sites do not change under a running Validation or WaveScape activity
+    for activity, state, info in ((SessionActivity.VALIDATION, SessionState.VALIDATION_RUNNING, session.validation),
+                                  (SessionActivity.WAVESCAPE, SessionState.WAVESCAPE_RUNNING, session.wavescape)):
+        if (state.name in session.states):
+            msg = already_running_text(activity, session.name, info.task_id)
+            logging.info(msg)
+            return func.HttpResponse(to_json(msg), status_code=400)  # 400 = Bad Request
+
+    storage = AsyncSessionStorage(session.name)
+    uploaded = body.get(UPLOADED_PARAM_NAME)
+    if (uploaded):
+        # Either true, or the expected upload of each file, e.g. {"raw": {"size": 1234}, "processed": {"etag": "0x8DA..."}}
+        expected = uploaded if isinstance(uploaded, dict) else {}
+        files = {RAW_SITES_BLOB_PATH: expected.get(RAW_PARAM_NAME), SITES_BLOB_PATH: expected.get(PROCESSED_PARAM_NAME)}
+        errors = await asyncio.gather(*(verify_uploaded_file(storage, path, get_expected_upload(file)) for path, file in files.items()))
+        error = next((error for error in errors if error is not None), None)
+        if (error is not None):
+            return func.HttpResponse(error, status_code=400)  # 400 = Bad Request
+        await sync_table_from_sites_async(session)
+        return func.HttpResponse(status_code=204)  # 204 = No Content
+
     raw_b64 = body.get(RAW_PARAM_NAME)
     if (is_none_or_whitespace(raw_b64)):
         return func.HttpResponse(missing_body_param_json(RAW_PARAM_NAME), status_code=400)  # 400 = Bad Request
@@ -58,36 +100,100 @@ async def put(session: Session, req: func.HttpRequest, starter: str) -> func.Htt
 
     processed = body.get(PROCESSED_PARAM_NAME)
 
-    # Maybe error if the blobs already exist
+    # Save the data to the cloud, maybe erroring if the blobs already exist
     optional_overwrite = body.get("overwrite")
     overwrite = not is_none_or_whitespace(optional_overwrite) and str_to_bool(optional_overwrite)
-    if (session.storage.blob_exists(RAW_SITES_BLOB_PATH) and not overwrite):
-        return func.HttpResponse(blob_exists_json(RAW_SITES_BLOB_PATH), status_code=400)  # 400 = Bad Request
-    if (session.storage.blob_exists(SITES_BLOB_PATH) and not overwrite):
-        return func.HttpResponse(blob_exists_json(SITES_BLOB_PATH), status_code=400)  # 400 = Bad Request
-
-    # Save the data to the cloud
-    session.storage.save_file(RAW_SITES_BLOB_PATH, raw_bytes, overwrite)
-    session.storage.save_file(SITES_BLOB_PATH, to_json(processed, pretty=False), overwrite)
+    files = {RAW_SITES_BLOB_PATH: raw_bytes, SITES_BLOB_PATH: to_json(processed, pretty=False)}
+    compress = is_gzip_at_rest_enabled()
+    saved = await asyncio.gather(*(storage.save_file(path, data, overwrite, compress=compress) for path, data in files.items()))
+    results = dict(zip(files, saved))
+    conflicts = [path for path, result in results.items() if result.conflict]
+    if (conflicts):
+        # The two files go together, so undo any just created, unless it has already been changed again
+        created = [storage.delete_file(path, result.etag) for path, result in results.items() if result.outcome == SaveFileOutcome.CREATED]
+        await asyncio.gather(*created)
+        return func.HttpResponse(blob_exists_json(conflicts[0]), status_code=400)  # 400 = Bad Request
 
+    await sync_table_from_sites_async(session)
     return func.HttpResponse(status_code=204)  # 204 = No Content
 
 
-async def get(session: Session) -> func.HttpResponse:
+def get_param(req: func.HttpRequest, name: str):
+    "Gets a query parameter given either plainly or OData style, e.g. \"top\" or \"$top\""
+    value = req.params.get(name)
+    return value if (value is not None) else req.params.get(f"${name}")
+
+
+async def get(session: Session, req: func.HttpRequest) -> func.HttpResponse:
     """
-    Gets the sites data from Azure table storage and returns it as a JSON list of objects; list may be empty.
+    Gets the sites data from Azure table storage and returns it as a compact JSON list of objects; list may be empty.
+    Optional query parameters, combined with "and":
+    - "enabled": true or false, only enabled or disabled sectors
+    - "bbox": "minLon,minLat,maxLon,maxLat", only sectors within the bounding box
+    - "filter": a table storage filter expression, e.g. "azimuth ge 90.0 and ant_bw lt 65.0"
+    - "select": comma separated columns to return; RowKey is always returned
+    - "top" and/or "continuationToken": return one page of rows, with the token for the next page, if any, in the "x-continuation-token" header
+    Without "top" or "continuationToken" every matching row is returned at once, as the portal expects, so the whole response is held in memory;
+    callers reading large tables should page through them instead.
     NOTE: This table is created and populated the first time either Validation or WaveScape is initiated.
     :param Session session: The session object.
+    :param func.HttpRequest req: The HTTP request object.
     :returns: An HttpResponse object.
     """
+    enabled = get_param(req, ENABLED_PARAM)
+    if (enabled is not None):
+        enabled = str_to_bool(enabled)
+
+    bbox = get_param(req, BBOX_PARAM)
+    if (bbox is not None):
+        try:
+            bbox = tuple(float(value) for value in bbox.split(","))
+            if (len(bbox) != 4):
+                raise ValueError()
+        except ValueError:
+            return func.HttpResponse(invalid_query_param_json(BBOX_PARAM, "\"minLon,minLat,maxLon,maxLat\""), status_code=400)  # 400 = Bad Request
+
+    select = get_param(req, SELECT_PARAM)
+    if (select is not None):
+        select = [column.strip() for column in select.split(",") if column.strip()]
+        if ("RowKey" not in select):
+            select.append("RowKey")  # so every row can still be PATCHed
+
+    page_size = get_param(req, TOP_PARAM)
+    if (page_size is not None):
+        try:
+            page_size = int(page_size)
+            if (not (1 <= page_size <= MAX_PAGE_SIZE)):
+                raise ValueError()
+        except ValueError:
+            return func.HttpResponse(invalid_query_param_json(TOP_PARAM, f"an integer from 1 to {MAX_PAGE_SIZE}"), status_code=400)  # 400 = Bad Request
+
+    try:
+        continuation_token = decode_continuation_token(get_param(req, CONTINUATION_TOKEN_PARAM))
+    except ValueError:
+        return func.HttpResponse(invalid_query_param_json(CONTINUATION_TOKEN_PARAM, "a token from a previous response"), status_code=400)  # 400 = Bad Request
+
+    query_filter, parameters = build_sites_filter(enabled, bbox, get_param(req, FILTER_PARAM))
+    pages = iter_sites_pages(AsyncSessionStorage(session.name), query_filter, parameters, select, page_size or MAX_PAGE_SIZE, continuation_token)
     try:
-        sites = []
-        for entity in get_table_service_client().get_table_client(session.storage.table).list_entities():
-            sites.append(entity)
+        # Each page of rows is serialized as it arrives, so only the JSON text of the earlier pages is kept, not their rows
+        pieces = []
+        headers = {}
+        async for sites, next_token in pages:
+            pieces.extend(to_json(site, pretty=False) for site in sites)
+            if (page_size is not None or continuation_token is not None):
+                next_token = encode_continuation_token(next_token)
+                if (next_token is not None):
+                    headers[CONTINUATION_HEADER] = next_token
+                break
     except ResourceNotFoundError:
         return func.HttpResponse(missing_sites_table_json, status_code=400)  # 400 = Bad Request
+    except HttpResponseError as ex:
+        if (ex.status_code != 400):
+            raise
+        return func.HttpResponse(invalid_query_param_json(FILTER_PARAM, "a valid table storage filter expression"), status_code=400)  # 400 = Bad Request
 
-    return func.HttpResponse(to_json(sites))
+    return func.HttpResponse("[" + ",".join(pieces) + "]", headers=headers)
 
 
 async def patch(session: Session, req: func.HttpRequest, starter: str) -> func.HttpResponse:
@@ -133,20 +239,21 @@ async def patch(session: Session, req: func.HttpRequest, starter: str) -> func.H
             return func.HttpResponse(sites_entity_cannot_specify("new", ROW_KEY_REQUIRED_NAME), status_code=400)  # 400 = Bad Request
         if (new_entity.get(ENABLED_REQUIRED_NAME) is None):
             return func.HttpResponse(sites_entity_missing_field("new", ENABLED_REQUIRED_NAME), status_code=400)  # 400 = Bad Request
+        new_entity.pop(SECTOR_KEY_FIELD, None)  # e.g. copied from another row; a new row is not a sector of the sites file
 
-    client = get_table_service_client().get_table_client(session.storage.table)
+    client = AsyncSessionStorage(session.name).get_table_client()
 
     # Updated the changed entities
     if (updated_entities):
         logging.info(f"sites PATCH, updating these existing entities:\n{updated_entities}")
-        batch_upsert_entities(client, (entity for entity in updated_entities))
+        await batch_upsert_entities_async(client, (entity for entity in updated_entities))
     else:
         logging.info(sites_no_entities("updated"))
 
     # Add the new entities
     if (new_entities):
         logging.info(f"sites PATCH, adding these new entities:\n{new_entities}")
-        batch_upsert_entities(client, (entity for entity in new_entities))
+        await batch_upsert_entities_async(client, (entity for entity in new_entities))
     else:
         logging.info(sites_no_entities("new"))
 
@@ -156,14 +263,14 @@ async def patch(session: Session, req: func.HttpRequest, starter: str) -> func.H
 async def main(req: func.HttpRequest, starter: str) -> func.HttpResponse:
     try:
         # Retrieve the Session object from the durable entity
-        session: Session = await find_session(req, starter)
+        session: Session = await find_session(req, starter, consistent=(req.method == "PUT"))
         if (session is None):
             return func.HttpResponse(status_code=410)  # 410 = Gone
 
         if (req.method == "PUT"):
             return await put(session, req, starter)
         elif (req.method == "GET"):
-            return await get(session)
+            return compress_response(req, await get(session, req))
         elif (req.method == "PATCH"):
             return await patch(session, req, starter)
         else:
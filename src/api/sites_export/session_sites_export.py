@@ -0,0 +1,81 @@
+# +----------------------------------------------------------------------------
+# | Copyright (c) 2022 Pivotal Commware
+# | All rights reserved.
+# +----------------------------------------------------------------------------
+
+import asyncio
+import logging
+import time
+
+import azure.functions as func
+from azure.core.exceptions import ResourceNotFoundError
+
+from ..shared_code.session import Session
+from ..shared_code.session_storage import READ_PERMISSION_PARAM, generate_link
+from ..shared_code.session_storage_async import AsyncSessionStorage
+from ..shared_code.sites import iter_sites_pages
+from ..shared_code.sites_export import EXPORT_BLOB_PATH, EXPORT_FORMATS, SitesColumns, get_default_format, is_format_available
+from ..shared_code.utilities import to_json
+from ..shared_code.api_strings import invalid_query_param_json, missing_sites_table_json
+from ..shared_code.find_session import find_session
+
+
+FORMAT_PARAM = "format"
+PAGE_SIZE    = 1000  # the most Azure table storage returns in one response
+
+
+async def post(session: Session, req: func.HttpRequest) -> func.HttpResponse:
+    """
+    Exports the session's sites table as one typed, columnar file in the session's blob container.
+    The optional "format" query parameter is "parquet", "arrow" or "csv"; the default is Parquet if available, else CSV.
+    A requested format that is not available in this environment falls back to CSV.
+    :param Session session: The session object.
+    :param func.HttpRequest req: The HTTP request object.
+    :returns: An HttpResponse object with the file's format, size, number of rows and a limited-time read SAS URI.
+    """
+    format = (req.params.get(FORMAT_PARAM) or get_default_format()).lower()
+    if (format not in EXPORT_FORMATS):
+        return func.HttpResponse(invalid_query_param_json(FORMAT_PARAM, " or ".join(f"\"{name}\"" for name in EXPORT_FORMATS)), status_code=400)  # 400 = Bad Request
+    if (not is_format_available(format)):
+        logging.warning(f"Sites export format \"{format}\" is not available (pyarrow is not installed), exporting CSV instead")
+        format = get_default_format()
+
+    # Converting the rows and writing the file are CPU-bound, so they run in worker threads, one at a time, off the event loop
+    start = time.perf_counter()
+    storage = AsyncSessionStorage(session.name)
+    columns = SitesColumns()
+    try:
+        async for rows, _ in iter_sites_pages(storage, page_size=PAGE_SIZE):
+            await asyncio.to_thread(columns.add_rows, rows)
+    except ResourceNotFoundError:
+        return func.HttpResponse(missing_sites_table_json, status_code=400)  # 400 = Bad Request
+
+    file_bytes = await asyncio.to_thread(columns.to_bytes, format)
+    blob_path = EXPORT_BLOB_PATH.format(extension=format)
+    await storage.save_file(blob_path, file_bytes, overwrite=True)
+    logging.info(f"Sites of session \"{session.name}\" exported: {columns.rows} rows, {len(file_bytes)} bytes of {format} in {time.perf_counter() - start:.1f}s")
+
+    return func.HttpResponse(to_json({
+        "format": format,
+        "rows": columns.rows,
+        "size": len(file_bytes),
+        "blobPath": blob_path,
+        "url": generate_link(storage.blob_container, blob_path, READ_PERMISSION_PARAM)
+    }))
+
+
+async def main(req: func.HttpRequest, starter: str) -> func.HttpResponse:
+    try:
+        # Retrieve the Session object from the durable entity
+        session: Session = await find_session(req, starter)
+        if (session is None):
+            return func.HttpResponse(status_code=410)  # 410 = Gone
+
+        if (req.method == "POST"):
+            return await post(session, req)
+        else:
+            raise ValueError()  # if we get here, our function.json is misconfigured
+
+    except Exception as ex:
+        logging.exception(ex)
+        return func.HttpResponse(repr(ex), status_code=500)  # 500 = Internal Server Error
@@ -0,0 +1,85 @@
+# +----------------------------------------------------------------------------
+# | Copyright (c) 2022 Pivotal Commware
+# | All rights reserved.
+# +----------------------------------------------------------------------------
+
+import asyncio
+import logging
+
+import azure.functions as func
+
+from ..shared_code.api_strings import invalid_body_json, missing_body_param_json
+from ..shared_code.session import SessionState
+from ..shared_code.session_de import get_session
+from ..shared_code.session_index import iter_session_summary_pages
+from ..shared_code.stop_session import stop_session
+from ..shared_code.utilities import to_json, is_none_or_whitespace
+
+
+SESSION_NAMES_PARAM = "sessionNames"
+RUNNING_PARAM       = "running"
+RUNNING_STATES      = [SessionState.NEARMAP_RUNNING, SessionState.VALIDATION_RUNNING, SessionState.WAVESCAPE_RUNNING]
+
+MAX_CONCURRENT_SESSION_STOPS = 8
+
+
+async def running_session_names() -> list:
+    """
+    Gets the names of the sessions with an activity running, from the session index.
+    :returns list: the session names
+    """
+    names = set()
+    for state in RUNNING_STATES:
+        async for summaries, _ in iter_session_summary_pages(state=state):
+            names.update(summary["name"] for summary in summaries)
+    return sorted(names)
+
+
+async def main(req: func.HttpRequest, starter: str) -> func.HttpResponse:
+    """
+    Stops many sessions at once, e.g. when draining a deployment.
+    The body is either {"sessionNames": [...]}, a list of non-empty strings, to stop the named sessions, or {"running": true} to stop every session with an activity running.
+    Returns, per session name, the same summary as the session "stop" API, null if the session does not exist,
+    or {"error": ...} if stopping it failed; the other sessions are stopped regardless.
+    """
+    try:
+        try:
+            body = req.get_json()
+            if (not isinstance(body, dict)):
+                raise ValueError()
+        except ValueError:
+            return func.HttpResponse(invalid_body_json, status_code=400)  # 400 = Bad Request
+
+        if (body.get(RUNNING_PARAM) is True):
+            session_names = await running_session_names()
+        elif (isinstance(body.get(SESSION_NAMES_PARAM), list)):
+            session_names = body[SESSION_NAMES_PARAM]
+            if (not all(isinstance(session_name, str) and not is_none_or_whitespace(session_name) for session_name in session_names)):
+                return func.HttpResponse(invalid_body_json, status_code=400)  # 400 = Bad Request
+            session_names = list(dict.fromkeys(session_names))  # each session is stopped once
+        else:
+            return func.HttpResponse(missing_body_param_json(SESSION_NAMES_PARAM), status_code=400)  # 400 = Bad Request
+
+        # Stop the sessions concurrently, a few at a time; each session's own stops also run concurrently
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_SESSION_STOPS)
+
+        async def stop(session_name: str):
+            async with semaphore:
+                session = await get_session(session_name, starter, consistent=True)
+                if (session is None):
+                    return None
+                return await stop_session(session, starter)
+
+        summaries = await asyncio.gather(*(stop(session_name) for session_name in session_names), return_exceptions=True)
+        for session_name, summary in zip(session_names, summaries):
+            if (isinstance(summary, Exception)):
+                logging.error(f"Failed to stop session \"{session_name}\", exception={repr(summary)}")
+        summaries = [{"error": repr(summary)} if isinstance(summary, Exception) else summary for summary in summaries]
+        stopped = sum(summary is not None and "error" not in summary for summary in summaries)
+        logging.info(f"Stopped {stopped} of {len(session_names)} sessions")
+
+    except Exception as ex:
+        logging.exception(ex)
+        return func.HttpResponse(repr(ex), status_code=500)  # 500 = Internal Server Error
+
+    return func.HttpResponse(to_json(dict(zip(session_names, summaries))), mimetype="application/json")
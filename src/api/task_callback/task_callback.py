@@ -0,0 +1,54 @@
+# +----------------------------------------------------------------------------
+# | Copyright (c) 2022 Pivotal Commware
+# | All rights reserved.
+# +----------------------------------------------------------------------------
+
+import logging
+
+import azure.functions as func
+from azure.durable_functions import DurableOrchestrationClient
+from azure.durable_functions.models.OrchestrationRuntimeStatus import OrchestrationRuntimeStatus
+
+from ..shared_code.runner_api import interpret_task_status
+from ..shared_code.task_callback import TASK_COMPLETED_EVENT
+
+
+RETRY_AFTER_SECONDS = 5
+
+
+async def main(req: func.HttpRequest, starter: str) -> func.HttpResponse:
+    """
+    Called by the runner when a batch task finishes; wakes up the orchestrator waiting for the task.
+    The body is the task's status, as returned by the "status" API, plus its "task_id".
+    The orchestrator is started after the task, so a task that finishes quickly may call back before the orchestrator exists;
+    the runner is then asked to retry (503) rather than told that the orchestrator is gone (410).
+    """
+    try:
+        instance_id = req.route_params.get("instanceId")
+        try:
+            body: dict = req.get_json()
+            task_id: str = body["task_id"]
+            activity_name = str(body.get("activity", "")).upper()
+            status = interpret_task_status(activity_name, task_id, body)
+        except (ValueError, KeyError, TypeError):
+            return func.HttpResponse("Body must be the task's status, with its \"task_id\"", status_code=400)  # 400 = Bad Request
+
+        if (status["check_again"]):
+            return func.HttpResponse(status_code=202)  # 202 = Accepted; not completed yet, nothing to do
+
+        client = DurableOrchestrationClient(starter)
+        try:
+            await client.raise_event(instance_id, TASK_COMPLETED_EVENT, {"task_id": task_id, **status})
+        except Exception as ex:
+            logging.warning(f"Task {task_id} completion callback for orchestrator {instance_id} not delivered, exception={repr(ex)}")
+            orchestrator = await client.get_status(instance_id)
+            if (orchestrator is None or orchestrator.runtime_status in (None, OrchestrationRuntimeStatus.Pending)):
+                headers = {"Retry-After": str(RETRY_AFTER_SECONDS)}
+                return func.HttpResponse(status_code=503, headers=headers)  # 503 = Service Unavailable; the orchestrator has not started yet
+            return func.HttpResponse(status_code=410)  # 410 = Gone; the orchestrator is no longer waiting
+
+    except Exception as ex:
+        logging.exception(ex)
+        return func.HttpResponse(repr(ex), status_code=500)  # 500 = Internal Server Error
+
+    return func.HttpResponse(status_code=204)  # 204 = No Content
@@ -3,32 +3,42 @@
 # | All rights reserved.
 # +----------------------------------------------------------------------------
 
+import asyncio
 import azure.functions as func
 import logging
 
-from ..shared_code.session_storage import SITES_BLOB_PATH
-from ..shared_code.sites import create_table_from_sites
+from ..shared_code.session_storage import SITES_BLOB_PATH, SITES_TABLE_CHECKPOINT_BLOB_PATH
+from ..shared_code.session_storage_async import AsyncSessionStorage
+from ..shared_code.sites import create_table_from_sites_async
 from ..shared_code.session import Session, SessionState
 from ..shared_code.session_activity import SessionActivity
-from ..shared_code.utilities import to_json
+from ..shared_code.utilities import PhaseTimer, to_json
 from ..shared_code.session_batch import start_validation
 from ..shared_code.api_strings import already_running_text, initiated_text, missing_configuration_json, missing_sites_json
 from ..shared_code.find_session import find_session
+from ..shared_code.task_logs import get_logs
 
 
-async def post(session: Session, starter: str) -> func.HttpResponse:
+async def post(session: Session, starter: str, timer: PhaseTimer) -> func.HttpResponse:
     """
     Starts the validation batch task.
     :param Session session: The session.
     :param str starter: The context.
+    :param PhaseTimer timer: Times the phases of the kick-off, reported in the "Server-Timing" response header.
     :returns func.HttpResponse: an HttpResponse object.
     """
     # Ensure that the session has been configured
     if (not session.configuration):
         return func.HttpResponse(missing_configuration_json, status_code=400)  # 400 = Bad Request
 
+    # Probe the storage concurrently; the results are carried forward so nothing is checked twice
+    storage = AsyncSessionStorage(session.name)
+    with timer.phase("probes"):
+        sites_exists, table_exists, checkpoint_exists = await asyncio.gather(
+            storage.blob_exists(SITES_BLOB_PATH), storage.table_exists(), storage.blob_exists(SITES_TABLE_CHECKPOINT_BLOB_PATH))
+
     # Ensure that sites have been uploaded to Azure Blob container
-    if (not session.storage.blob_exists(SITES_BLOB_PATH)):
+    if (not sites_exists):
         return func.HttpResponse(missing_sites_json, status_code=400)  # 400 = Bad Request
 
     # Ensure that only one Validation activity is running at a time
@@ -37,34 +47,39 @@ async def post(session: Session, starter: str) -> func.HttpResponse:
         logging.info(msg)
         return func.HttpResponse(to_json(msg), status_code=400)  # 400 = Bad Request
 
-    create_table_from_sites(session)
+    with timer.phase("table"):
+        await create_table_from_sites_async(session, sites_exists=sites_exists, table_exists=table_exists, checkpoint_exists=checkpoint_exists)
 
-    await start_validation(session, starter)
+    with timer.phase("start"):
+        await start_validation(session, starter, timer)
 
     logging.info(initiated_text(SessionActivity.VALIDATION, session.name, session.validation.task_id))
+    logging.info(f"Validation kick-off timings for session \"{session.name}\": {timer.summary()}")
 
-    return func.HttpResponse(status_code=202)  # 202 = Accepted
+    return func.HttpResponse(status_code=202, headers={"Server-Timing": timer.server_timing()})  # 202 = Accepted
 
 
-async def get(session: Session) -> func.HttpResponse:
+async def get(session: Session, req: func.HttpRequest) -> func.HttpResponse:
     """
     Gets the two log files, "stdout.txt" and "stderr.txt", produced and published by the batch validation task.
+    Parts of them may be requested, see get_logs().
     """
-    response = session.storage.read_logs(session.validation.task_id)
-    return func.HttpResponse(to_json(response))
+    return await get_logs(session.name, session.validation.task_id, req)
 
 
 async def main(req: func.HttpRequest, starter: str) -> func.HttpResponse:
     try:
         # Retrieve the Session object from the durable entity
-        session: Session = await find_session(req, starter)
+        timer = PhaseTimer()
+        with timer.phase("session"):
+            session: Session = await find_session(req, starter, consistent=(req.method != "GET"))
         if (session is None):
             return func.HttpResponse(status_code=410)  # 410 = Gone
 
         if (req.method == "POST"):
-            return await post(session, starter)
+            return await post(session, starter, timer)
         elif (req.method == "GET"):
-            return await get(session)
+            return await get(session, req)
         else:
             raise ValueError()  # if we get here, our function.json is misconfigured
 
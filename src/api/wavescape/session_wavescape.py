@@ -3,25 +3,30 @@
 # | All rights reserved.
 # +----------------------------------------------------------------------------
 
+import asyncio
 import azure.functions as func
 import logging
 
-from ..shared_code.session_storage import SITES_BLOB_PATH
-from ..shared_code.sites import create_table_from_sites
+from ..shared_code.session_storage import SITES_BLOB_PATH, SITES_TABLE_CHECKPOINT_BLOB_PATH
+from ..shared_code.session_storage_async import AsyncSessionStorage
+from ..shared_code.sites import create_table_from_sites_async
 from ..shared_code.session import Session, SessionState
+from ..shared_code.session_codec import session_to_dict
 from ..shared_code.session_activity import SessionActivity
-from ..shared_code.utilities import to_json, is_none_or_whitespace
+from ..shared_code.utilities import PhaseTimer, to_json, is_none_or_whitespace
 from ..shared_code.session_batch import start_wavescape
 from ..shared_code.api_strings import already_running_text, initiated_text, missing_configuration_json, missing_sites_json, invalid_body_json, missing_body_param_json
 from ..shared_code.find_session import find_session
+from ..shared_code.task_logs import get_logs
 
 
-async def post(session: Session, req: func.HttpRequest, starter: str) -> func.HttpResponse:
+async def post(session: Session, req: func.HttpRequest, starter: str, timer: PhaseTimer) -> func.HttpResponse:
     """
     Starts the WaveScape batch task.
     :param Session session: The session.
     :param func.HttpRequest req: The HTTP request.
     :param str starter: The context.
+    :param PhaseTimer timer: Times the phases of the kick-off, reported in the "Server-Timing" response header.
     :returns func.HttpResponse: an HttpResponse object.
     """
     ITERATION_NAME_PARAM_NAME = "iteration_name"
@@ -37,6 +42,9 @@ async def post(session: Session, req: func.HttpRequest, starter: str) -> func.Ht
     if (is_none_or_whitespace(iteration_name)):
         return func.HttpResponse(missing_body_param_json(ITERATION_NAME_PARAM_NAME), status_code=400)  # 400 = Bad Request
 
+    # The session as it was, so that start_wavescape() saves the new iteration name along with its own changes
+    baseline = session_to_dict(session)
+
     # No check for uniqueness at this time; 1.3 feature.  Just don't duplicate the last entry if users keep entering the same iteration name
     if (iteration_name != session.current_iteration_name()):
         session.iteration_names.append(iteration_name)
@@ -46,8 +54,14 @@ async def post(session: Session, req: func.HttpRequest, starter: str) -> func.Ht
     if (stages is None):
         return func.HttpResponse(missing_body_param_json(STAGES_PARAM_NAME), status_code=400)  # 400 = Bad Request
 
+    # Probe the storage concurrently; the results are carried forward so nothing is checked twice
+    storage = AsyncSessionStorage(session.name)
+    with timer.phase("probes"):
+        sites_exists, table_exists, checkpoint_exists = await asyncio.gather(
+            storage.blob_exists(SITES_BLOB_PATH), storage.table_exists(), storage.blob_exists(SITES_TABLE_CHECKPOINT_BLOB_PATH))
+
     # Ensure that sites have been uploaded to Azure Blob container
-    if (not session.storage.blob_exists(SITES_BLOB_PATH)):
+    if (not sites_exists):
         return func.HttpResponse(missing_sites_json, status_code=400)  # 400 = Bad Request
 
     # Ensure that the session has been configured
@@ -61,34 +75,39 @@ async def post(session: Session, req: func.HttpRequest, starter: str) -> func.Ht
         return func.HttpResponse(to_json(msg), status_code=400)  # 400 = Bad Request
 
     # Convert the GeoJSON file in the Azure blob container into its equivalent Azure table for easy human editing
-    create_table_from_sites(session)
+    with timer.phase("table"):
+        await create_table_from_sites_async(session, sites_exists=sites_exists, table_exists=table_exists, checkpoint_exists=checkpoint_exists)
 
-    await start_wavescape(session, stages, starter)
+    with timer.phase("start"):
+        await start_wavescape(session, stages, starter, timer, baseline)
 
     logging.info(initiated_text(SessionActivity.WAVESCAPE, session.name, session.wavescape.task_id))
+    logging.info(f"WaveScape kick-off timings for session \"{session.name}\": {timer.summary()}")
 
-    return func.HttpResponse(status_code=202)  # 202 = Accepted
+    return func.HttpResponse(status_code=202, headers={"Server-Timing": timer.server_timing()})  # 202 = Accepted
 
 
-async def get(session: Session) -> func.HttpResponse:
+async def get(session: Session, req: func.HttpRequest) -> func.HttpResponse:
     """
     Gets the two log files, "stdout.txt" and "stderr.txt", produced and published by the batch WaveScape task.
+    Parts of them may be requested, see get_logs().
     """
-    response = session.storage.read_logs(session.wavescape.task_id)
-    return func.HttpResponse(to_json(response))
+    return await get_logs(session.name, session.wavescape.task_id, req)
 
 
 async def main(req: func.HttpRequest, starter: str) -> func.HttpResponse:
     try:
         # Retrieve the Session object from the durable entity
-        session: Session = await find_session(req, starter)
+        timer = PhaseTimer()
+        with timer.phase("session"):
+            session: Session = await find_session(req, starter, consistent=(req.method != "GET"))
         if (session is None):
             return func.HttpResponse(status_code=410)  # 410 = Gone
 
         if (req.method == "POST"):
-            return await post(session, req, starter)
+            return await post(session, req, starter, timer)
         elif (req.method == "GET"):
-            return await get(session)
+            return await get(session, req)
         else:
             raise ValueError()  # if we get here, our function.json is misconfigured
 
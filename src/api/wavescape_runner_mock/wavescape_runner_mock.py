@@ -4,9 +4,11 @@
 # +----------------------------------------------------------------------------
 
 import datetime
+import threading
 import uuid
 import random
 
+import requests
 from flask import Flask, request, Response
 
 # Flask cant handle/import relative paths, so be explicit
@@ -21,20 +23,25 @@ app = Flask(__name__)
 @app.route("/api/nearmap/start", methods=['POST'])
 def activity_start():
     app.logger.info(f"{request.url_rule} body =\n{to_json(request.json)}")
-    return Response(uuid.uuid4().hex, status=202)
-    # return Response("error", status=500, mimetype='application/json')  # Keep for debugging
+    task_id = uuid.uuid4().hex
 
+    # Callback mode: report the task completed after a simulated duration, if the portal asked for a callback
+    callback_seconds = get_environment_variable("WAVESCAPE_RUNNER_MOCK_CALLBACK_SECONDS")
+    callback_url = request.json.get("callback_url")
+    if (callback_seconds is not None and callback_url):
+        activity = str(request.url_rule).split("/")[2]
+        threading.Timer(float(callback_seconds), call_back, args=(callback_url, activity, task_id)).start()
 
-@app.route("/api/wavescape/status/<task_id>")
-@app.route("/api/validation/status/<task_id>")
-@app.route("/api/nearmap/status/<task_id>")
-def activity_status(task_id):
-    completed_chance = get_environment_variable("WAVESCAPE_RUNNER_MOCK_TASK_COMPLETED_CHANCE")
-    COMPLETED_CHANCE = completed_chance if completed_chance is not None else 0.25
+    return Response(task_id, status=202)
+    # return Response("error", status=500, mimetype='application/json')  # Keep for debugging
 
-    failure_chance = get_environment_variable("WAVESCAPE_RUNNER_MOCK_TASK_FAILURE_CHANCE")
-    FAILURE_CHANCE = failure_chance if failure_chance is not None else 0.10
 
+def make_execution_info(failed: bool) -> dict:
+    """
+    Makes up the execution info of a completed batch task.
+    :param bool failed: whether or not the task failed
+    :returns dict: the execution info, as returned by the "status" API
+    """
     execution_info_success = {
         "additional_properties": {},
         "start_time": None,
@@ -81,11 +88,27 @@ def activity_status(task_id):
         }
     }
 
-    # Flask automatically converts dictionaries to JSON response
+    return execution_info_failure if failed else execution_info_success
+
+
+def get_failure_chance() -> float:
+    "Gets the chance that a completed task failed"
+    failure_chance = get_environment_variable("WAVESCAPE_RUNNER_MOCK_TASK_FAILURE_CHANCE")
+    return float(failure_chance) if failure_chance is not None else 0.10
+
+
+def make_task_status() -> dict:
+    """
+    Makes up the status of a batch task: completed (successfully or not) or still running, at random.
+    :returns dict: the status, as returned by the "status" API
+    """
+    completed_chance = get_environment_variable("WAVESCAPE_RUNNER_MOCK_TASK_COMPLETED_CHANCE")
+    COMPLETED_CHANCE = float(completed_chance) if completed_chance is not None else 0.25
+
     if (random.random() <= COMPLETED_CHANCE):
         return {
             "state": {"_value_": "completed"},
-            "execution_info": execution_info_failure if (random.random() <= FAILURE_CHANCE) else execution_info_success
+            "execution_info": make_execution_info(random.random() <= get_failure_chance())
         }
     else:
         return {
@@ -94,8 +117,39 @@ def activity_status(task_id):
         }
 
 
-@app.route("/api/wavescape/stop", methods=['POST'])
-@app.route("/api/validation/stop", methods=['POST'])
-@app.route("/api/nearmap/stop", methods=['POST'])
-def activity_stop():
+def call_back(callback_url: str, activity: str, task_id: str) -> None:
+    """
+    Reports the completion of a (simulated) batch task to the portal, like the runner does when given a callback URL.
+    """
+    body = {
+        "task_id": task_id,
+        "activity": activity,
+        "state": {"_value_": "completed"},
+        "execution_info": make_execution_info(random.random() <= get_failure_chance())
+    }
+    try:
+        response = requests.post(callback_url, data=to_json(body, pretty=False), headers={"Content-Type": "application/json"}, timeout=30)
+        app.logger.info(f"Callback for task {task_id} returned {response.status_code}")
+    except requests.RequestException as ex:
+        app.logger.warning(f"Callback for task {task_id} failed, exception={repr(ex)}")
+
+
+@app.route("/api/wavescape/status/<task_id>")
+@app.route("/api/validation/status/<task_id>")
+@app.route("/api/nearmap/status/<task_id>")
+def activity_status(task_id):
+    # Flask automatically converts dictionaries to JSON response
+    return make_task_status()
+
+
+@app.route("/api/status", methods=['POST'])
+def activity_status_batch():
+    # Body is {"tasks": [{"activity": ..., "task_id": ...}, ...]}; response maps each task id to its status
+    return {task["task_id"]: make_task_status() for task in request.json["tasks"]}
+
+
+@app.route("/api/wavescape/stop/<task_id>", methods=['POST'])
+@app.route("/api/validation/stop/<task_id>", methods=['POST'])
+@app.route("/api/nearmap/stop/<task_id>", methods=['POST'])
+def activity_stop(task_id):
     return ""
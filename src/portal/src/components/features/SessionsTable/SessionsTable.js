@@ -48,7 +48,8 @@ const SessionsTable = (props) => {
 
     async function getAllSessions() {
         appInsights.trackTrace({ message: 'Getting data of all sessions', severityLevel: SeverityLevel.Information });
-        const getAllCall = await generalAPICall('GET', '', '');
+        // The session index holds just the summary fields this table needs
+        const getAllCall = await generalAPICall('GET', '?source=index', '');
         setDisable(false);
         if (getAllCall.responseOk) {
             setShowError(null);